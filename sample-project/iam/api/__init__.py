@@ -2,4 +2,9 @@ from iam.api import base
 from iam.api import projects
 from iam.api import users
 from iam.api import groups
-from iam.api import roles
\ No newline at end of file
+from iam.api import roles
+from iam.api import jobs
+from iam.api import events
+from iam.api import search
+from iam.api import batch
+from iam.api import profiler
@@ -0,0 +1,39 @@
+from fastapi import Request
+
+from iam.api import models
+from iam.api import routes
+from iam.core import batch
+from iam.core import utils
+from iam.api.models import ResponseModel
+
+TAGS = ['batch']
+
+
+@routes.v1_r.post("/batch", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response(sensitive_fields=["password"])
+async def run_batch(request: Request, inputs: models.BatchModel):
+    """
+    Run several operations in one call, independent ones concurrently.
+
+    Sub-requests address the authenticated v1 operations by method and path
+    (relative to `/v1`) and share the authentication of this request. A
+    sub-request waits for the earlier ones listed in `depends_on` or
+    referenced as `${<id>.<key>...}` in its path or body, which is replaced
+    with that part of their response body, e.g. `${new_user.data.id}`; it is
+    not run (`424`) if one of them failed.
+
+    - **Auth Required**: Yes
+    - **Request Body**:
+        ```
+        requests: List of sub-requests, each with:
+            id: (optional) The id of sub-request, its position by default.
+            method: The HTTP method.
+            path: The path, e.g. /users/{user_id}?fields=id,name.
+            body: (optional) The JSON body.
+            depends_on: (optional) Ids of sub-requests to wait for.
+        ```
+    - **Returns**: The id, status code and response body of each sub-request, in order.
+    """
+    subrequests = [dict(sub.model_dump(), id=sub.id or str(i)) for i, sub in enumerate(inputs.requests)]
+    allowed_routes = [route for route in routes.v1_r.routes if route.endpoint is not run_batch]
+    return await batch.run(request, subrequests, allowed_routes)
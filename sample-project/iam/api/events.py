@@ -0,0 +1,43 @@
+from typing import Optional
+from fastapi import Request, Header, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from iam.api import routes
+from iam.core import events
+
+TAGS = ['events']
+
+
+@routes.v1_sr.get("/events", tags=TAGS)
+async def get_events(
+    request: Request,
+    types: Optional[str] = Query(None, description="Comma separated list of resource types."),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Stream create/update/delete events of IAM resources as Server-Sent Events.
+
+    Events carry the type and identifiers of the changed resource only.
+    Reconnect with the `Last-Event-ID` header to resume; a `reset` event
+    means the stream cannot be resumed and resources should be listed again.
+    The feed covers the changes made through the worker serving the stream
+    only: with several workers, changes made through the others are missed.
+
+    - **Auth Required**: Yes
+    - **Query Params**:
+        ```
+        types: (optional) Comma separated list of users, groups, group_memberships,
+               projects, roles, role_assignments.
+        ```
+    """
+    selected = frozenset(t.strip() for t in types.split(',') if t.strip()) if types else None
+    # Subscribing here, before the response starts, lets a full server answer 503.
+    subscriber = events.log.subscribe(selected)
+    return StreamingResponse(
+        events.stream(subscriber, last_event_id),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+        # Also when the stream never started, e.g. the client left first.
+        background=BackgroundTask(events.log.unsubscribe, subscriber),
+    )
@@ -1,4 +1,4 @@
-from fastapi import Request
+from fastapi import Request, Depends
 
 from iam import conf
 from iam.api import models
@@ -6,20 +6,25 @@ from iam.api import routes
 from iam.core import utils
 from iam.core import keystone
 from iam.api.models import ResponseModel
+from iam.core.fieldsets import fieldset
 
 TAGS = ['groups']
 
 
 @routes.v1_r.get("/groups", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_groups(request: Request):
+async def get_groups(request: Request, fields=Depends(fieldset)):
     """
     Retrieve a list of groups.
 
     - **Auth Required**: Yes
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     """
     groups = await keystone.group_list(request)
-    return [x.to_dict() for x in groups]
+    return [fields(x) for x in groups]
 
 @routes.v1_r.post("/groups", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -40,7 +45,7 @@ async def create_group(request: Request, inputs: models.CreateGroupModel):
 
 @routes.v1_r.get("/groups/{group_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_group(request: Request, group_id: str):
+async def get_group(request: Request, group_id: str, fields=Depends(fieldset)):
     """
     Retrieve a group.
 
@@ -49,10 +54,14 @@ async def get_group(request: Request, group_id: str):
         ```
         group_id: The id of group.
         ```
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     - **Returns**: The information of given group.
     """
     group = await keystone.group_get(request, group_id)
-    return group.to_dict()
+    return fields(group)
 
 @routes.v1_r.post("/groups/{group_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -89,7 +98,7 @@ async def delete_group(request: Request, group_id: str):
 
 @routes.v1_r.get("/groups/{group_id}/users", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_group_users(request: Request, group_id: str):
+async def get_group_users(request: Request, group_id: str, fields=Depends(fieldset)):
     """
     Retrieve a group.
 
@@ -98,10 +107,14 @@ async def get_group_users(request: Request, group_id: str):
         ```
         group_id: The id of group.
         ```
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     - **Returns**: A list of users of the given group.
     """
     group_users = await keystone.user_list(request, group=group_id)
-    return [x.to_dict() for x in group_users]
+    return [fields(x) for x in group_users]
 
 @routes.v1_r.post("/groups/{group_id}/users", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -0,0 +1,165 @@
+from fastapi import Request
+
+from iam import exceptions
+from iam.api import models
+from iam.api import routes
+from iam.core import jobs
+from iam.core import utils
+from iam.core import keystone
+from iam.api.models import ResponseModel
+
+TAGS = ['jobs']
+
+
+@jobs.handler("users.import")
+async def import_users(ctx, params):
+    users = params["users"]
+    results = []
+    for i, user in enumerate(users):
+        try:
+            created = await keystone.user_create(ctx.request, **user)
+            results.append({"name": user["name"], "id": created.id})
+        except Exception as e:
+            results.append({"name": user["name"], "error": str(e)})
+        await ctx.progress(i + 1, len(users))
+    return results
+
+def _assignment_key(assignment):
+    info = getattr(assignment, '_info', assignment)
+    actor = 'user' if info.get('user') else 'group'
+    return (info['role']['id'], actor, info[actor]['id'])
+
+@jobs.handler("role_assignments.reconcile")
+async def reconcile_role_assignments(ctx, params):
+    project = params["project"]
+    current = await keystone.role_assignments_list(ctx.request, project=project, include_subtree=False)
+    # Inherited assignments come from a parent and cannot be revoked here.
+    have = {
+        _assignment_key(a) for a in current
+        if a._info.get('scope', {}).get('project', {}).get('id') == project
+        and not a._info.get('scope', {}).get('OS-INHERIT:inherited_to')
+    }
+    wanted = {
+        (a['role'], 'user' if a.get('user') else 'group', a.get('user') or a.get('group'))
+        for a in params["assignments"]
+    }
+    grant = sorted(wanted - have)
+    revoke = sorted(have - wanted) if params["remove_unlisted"] else []
+    total = len(grant) + len(revoke)
+    result = {"granted": [], "revoked": [], "errors": []}
+
+    for i, (action, (role, actor, actor_id)) in enumerate(
+            [('grant', a) for a in grant] + [('revoke', a) for a in revoke]):
+        call = keystone.role_assignment_create if action == 'grant' else keystone.role_assignment_delete
+        entry = {"role": role, actor: actor_id}
+        try:
+            await call(ctx.request, role, project=project, **{actor: actor_id})
+            result["granted" if action == 'grant' else "revoked"].append(entry)
+        except Exception as e:
+            result["errors"].append(dict(entry, action=action, error=str(e)))
+        await ctx.progress(i + 1, total)
+    return result
+
+@jobs.handler("inventory.export")
+async def export_inventory(ctx, params):
+    listings = [
+        ("users", keystone.user_list),
+        ("groups", keystone.group_list),
+        ("projects", keystone.tenant_list),
+        ("roles", keystone.role_list),
+        ("role_assignments", lambda request: keystone.role_assignments_list(request, include_subtree=False)),
+    ]
+    inventory = {}
+    for i, (name, list_func) in enumerate(listings):
+        inventory[name] = [x.to_dict() for x in await list_func(ctx.request)]
+        await ctx.progress(i + 1, len(listings))
+    return inventory
+
+
+@routes.v1_r.post("/jobs/users/import", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response(sensitive_fields=["password"])
+async def submit_import_users(request: Request, inputs: models.ImportUsersModel):
+    """
+    Create many users in the background.
+
+    - **Auth Required**: Yes
+    - **Request Body**:
+        ```
+        users: List of users, each with the fields of user creation.
+        ```
+    - **Returns**: The submitted job. Its result lists the id, or the error, of each user.
+    """
+    return jobs.engine.submit("users.import", inputs.model_dump(), request)
+
+@routes.v1_r.post("/jobs/role-assignments/reconcile", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def submit_reconcile_role_assignments(request: Request, inputs: models.ReconcileRoleAssignmentsModel):
+    """
+    Make the role assignments of a project match the given list, in the background.
+
+    - **Auth Required**: Yes
+    - **Request Body**:
+        ```
+        project: The id of project.
+        assignments: List of role assignments, each with role and user or group ids.
+        remove_unlisted: (optional) Revoke direct assignments that are not listed.
+        ```
+    - **Returns**: The submitted job. Its result lists granted, revoked and failed assignments.
+    """
+    return jobs.engine.submit("role_assignments.reconcile", inputs.model_dump(), request)
+
+@routes.v1_r.post("/jobs/inventory/export", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def submit_export_inventory(request: Request):
+    """
+    Export all users, groups, projects, roles and role assignments, in the background.
+
+    - **Auth Required**: Yes
+    - **Returns**: The submitted job. Its result holds the exported resources.
+    """
+    return jobs.engine.submit("inventory.export", {}, request)
+
+@routes.v1_r.get("/jobs", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_jobs(request: Request):
+    """
+    Retrieve a list of the jobs of the current user, newest first, without their results.
+
+    - **Auth Required**: Yes
+    """
+    return [dict(job, result=None) for job in jobs.engine.list(request.state.user)]
+
+@routes.v1_r.get("/jobs/{job_id}", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_job(request: Request, job_id: str):
+    """
+    Retrieve a job, with its progress and, once finished, its result or error.
+
+    - **Auth Required**: Yes
+    - **Request Path Args**:
+        ```
+        job_id: The id of job.
+        ```
+    """
+    job = jobs.engine.get(job_id, request.state.user)
+    if job is None:
+        raise exceptions.NotFoundException(f"Could not find job: {job_id}.")
+    return job
+
+@routes.v1_r.post("/jobs/{job_id}/cancel", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def cancel_job(request: Request, job_id: str):
+    """
+    Cancel a job. Work already done by the job is not undone.
+
+    - **Auth Required**: Yes
+    - **Request Path Args**:
+        ```
+        job_id: The id of job.
+        ```
+    """
+    job = jobs.engine.get(job_id, request.state.user)
+    if job is None:
+        raise exceptions.NotFoundException(f"Could not find job: {job_id}.")
+    if job["status"] in jobs.ACTIVE:
+        jobs.engine.cancel(job_id)
@@ -1,6 +1,8 @@
 from enum import Enum
-from pydantic import BaseModel
-from typing import Optional, Generic, TypeVar
+from pydantic import BaseModel, Field
+from typing import Any, List, Optional, Generic, TypeVar
+
+from iam import conf
 
 T = TypeVar("T")
 
@@ -28,6 +30,7 @@ class CreateProjectModel(BaseModel):
     name: str
     description: str = None
     enabled: bool = True
+    parent: str = None
 
 
 class UpdateProjectModel(BaseModel):
@@ -86,3 +89,39 @@ class AssignRoleModel(BaseModel):
 
 
 class UnassignRoleModel(AssignRoleModel): ...
+
+
+class ImportUsersModel(BaseModel):
+    users: List[CreateUserModel]
+
+
+class ProjectRoleAssignmentModel(BaseModel):
+    role: str
+    user: str = None
+    group: str = None
+
+
+class ReconcileRoleAssignmentsModel(BaseModel):
+    project: str
+    assignments: List[ProjectRoleAssignmentModel]
+    remove_unlisted: bool = False
+
+
+class BatchSubrequestModel(BaseModel):
+    id: str = None
+    method: str
+    path: str
+    body: Any = None
+    depends_on: List[str] = []
+
+
+class BatchModel(BaseModel):
+    requests: List[BatchSubrequestModel] = Field(min_length=1, max_length=conf.BATCH_MAX_REQUESTS)
+
+
+class ProfilerSettingsModel(BaseModel):
+    enabled: bool
+    threshold_ms: float = Field(conf.PROFILER_THRESHOLD_MS, ge=0)
+    sample_every: int = Field(conf.PROFILER_SAMPLE_EVERY, ge=0)
+    interval_ms: float = Field(conf.PROFILER_INTERVAL_MS, ge=1)
+    duration: float = Field(conf.PROFILER_MAX_DURATION, gt=0, le=conf.PROFILER_MAX_DURATION)
@@ -0,0 +1,111 @@
+from fastapi import Request, Query, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from iam import conf
+from iam import exceptions
+from iam.api import models
+from iam.api import routes
+from iam.core import auth
+from iam.core import utils
+from iam.core import profiler
+from iam.api.models import ResponseModel
+
+TAGS = ['profiler']
+
+
+def _check_roles(request: Request):
+    auth.require_validated(request, "Profiling")
+    if not request.state.user.has_role(*conf.PROFILER_ROLES):
+        raise exceptions.ForbiddenException("Profiling requires one of the roles: " + ", ".join(conf.PROFILER_ROLES))
+
+@routes.v1_r.get("/profiler", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_profiler(request: Request):
+    """
+    Get the profiler settings and status.
+
+    - **Auth Required**: Yes, a validated token with one of the profiler roles.
+    - **Returns**: The settings, whether the profiler is on and the number of requests tracked.
+    """
+    _check_roles(request)
+    return profiler.snapshot()
+
+@routes.v1_r.put("/profiler", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def set_profiler(request: Request, inputs: models.ProfilerSettingsModel):
+    """
+    Turn the sampling profiler on for a while, or off.
+
+    While on, requests taking at least `threshold_ms`, and one of every
+    `sample_every` requests, are profiled under their request id. With
+    the memory backend this applies to the worker serving the call only.
+
+    - **Auth Required**: Yes, a validated token with one of the profiler roles.
+    - **Request Body**:
+        ```
+        enabled: Whether to profile.
+        threshold_ms: (optional) Keep the profiles of requests at least this slow, 0 for none.
+        sample_every: (optional) Keep the profile of one of every this many requests, 0 for none.
+        interval_ms: (optional) Time between samples.
+        duration: (optional) Seconds after which profiling turns itself off.
+        ```
+    - **Returns**: The new settings.
+    """
+    _check_roles(request)
+    if inputs.enabled and inputs.threshold_ms <= 0 and inputs.sample_every <= 0:
+        raise exceptions.BadRequestException("Set threshold_ms or sample_every to profile requests.")
+    return profiler.configure(**inputs.model_dump())
+
+@routes.v1_r.get("/profiler/profiles", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def list_profiles(request: Request, limit: int = Query(100, ge=1, le=conf.PROFILER_MAX_PROFILES)):
+    """
+    List the latest profiled requests, without their stacks.
+
+    - **Auth Required**: Yes, a validated token with one of the profiler roles.
+    - **Query Params**:
+        ```
+        limit: (optional) Number of profiles, 100 by default.
+        ```
+    """
+    _check_roles(request)
+    return profiler.store.list(limit)
+
+@routes.v1_r.get("/profiler/profiles/{request_id}", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_profile(request: Request, request_id: str):
+    """
+    Get the profile of a request, with its stacks and their sample counts.
+
+    - **Auth Required**: Yes, a validated token with one of the profiler roles.
+    - **Request Path Args**:
+        ```
+        request_id: The X-Request-ID of request.
+        ```
+    """
+    _check_roles(request)
+    profile = profiler.store.get(request_id)
+    if profile is None:
+        raise exceptions.NotFoundException(f"No profile for request {request_id}.")
+    return profile
+
+@routes.v1_r.get("/profiler/profiles/{request_id}/collapsed", tags=TAGS, response_class=PlainTextResponse)
+async def get_collapsed_profile(request: Request, request_id: str):
+    """
+    Get the profile of a request as collapsed stacks, one `frame;frame;frame count`
+    line per stack, e.g. for flamegraph.pl or speedscope.
+
+    - **Auth Required**: Yes, a validated token with one of the profiler roles.
+    - **Request Path Args**:
+        ```
+        request_id: The X-Request-ID of request.
+        ```
+    """
+    try:
+        _check_roles(request)
+    except exceptions.ForbiddenException as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    profile = profiler.store.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No profile for request {request_id}.")
+    return PlainTextResponse(profiler.collapsed(profile))
@@ -1,25 +1,35 @@
-from fastapi import Request
+import asyncio
+from typing import Optional
+from fastapi import Request, Depends, Query
 
 from iam import conf
+from iam import exceptions
 from iam.api import models
 from iam.api import routes
+from iam.core import auth
 from iam.core import utils
 from iam.core import keystone
+from iam.core import hierarchy
 from iam.api.models import ResponseModel
+from iam.core.fieldsets import fieldset
 
 TAGS = ['projects']
 
 
 @routes.v1_r.get("/projects", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_projects(request: Request):
+async def get_projects(request: Request, fields=Depends(fieldset)):
     """
     Retrieve a list of projects.
 
     - **Auth Required**: Yes
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     """
     projects = await keystone.tenant_list(request)
-    return [x.to_dict() for x in projects]
+    return [fields(x) for x in projects]
 
 @routes.v1_r.post("/projects", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -33,6 +43,7 @@ async def create_project(request: Request, inputs: models.CreateProjectModel):
         name: The name of project.
         description: (optional) The description of project.
         enabled: (optional) To enable/disable the project.
+        parent: (optional) The id of parent project.
         ```
     - **Returns**: The created project.
     """
@@ -41,7 +52,7 @@ async def create_project(request: Request, inputs: models.CreateProjectModel):
 
 @routes.v1_r.get("/projects/{project_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_project(request: Request, project_id: str):
+async def get_project(request: Request, project_id: str, fields=Depends(fieldset)):
     """
     Retrieve a project.
 
@@ -50,10 +61,14 @@ async def get_project(request: Request, project_id: str):
         ```
         project_id: The id of project.
         ```
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     - **Returns**: The information of given project.
     """
     project = await keystone.tenant_get(request, project_id)
-    return project.to_dict()
+    return fields(project)
 
 @routes.v1_r.post("/projects/{project_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -88,3 +103,114 @@ async def delete_project(request: Request, project_id: str):
         ```
     """
     await keystone.tenant_delete(request, project_id)
+
+def _tree(request, project_id):
+    """The project tree, once ``project_id`` is known to be in it and visible to the user."""
+    auth.require_validated(request, "Browsing the project tree")
+    tree = hierarchy.tree
+    if tree is None:
+        raise exceptions.ServiceUnavailableException("The project tree is not ready yet.", retry_after=5)
+    if project_id not in tree.projects or not hierarchy.visible(request.state.user, project_id):
+        raise exceptions.NotFoundException(f"Could not find project: {project_id}.")
+    return tree
+
+@routes.v1_r.get("/projects/{project_id}/ancestors", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_project_ancestors(request: Request, project_id: str):
+    """
+    Retrieve the ancestors of a project, from its domain down to its parent.
+
+    - **Auth Required**: Yes, a validated token with one of the hierarchy roles
+      or scoped to the project or one of its ancestors.
+    - **Request Path Args**:
+        ```
+        project_id: The id of project.
+        ```
+    - **Returns**: The ancestors, each with its depth from the top; the domain,
+      and ancestors above the project the token is scoped to, are listed by id only.
+    """
+    tree = _tree(request, project_id)
+    user = request.state.user
+    return [tree.summary(ancestor, depth=depth) if hierarchy.visible(user, ancestor) else {"id": ancestor, "depth": depth}
+            for depth, ancestor in enumerate(tree.ancestors(project_id))]
+
+@routes.v1_r.get("/projects/{project_id}/subtree", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_project_subtree(
+    request: Request,
+    project_id: str,
+    depth: Optional[int] = Query(None, ge=1, description="Number of levels to return, all by default."),
+):
+    """
+    Retrieve the projects under a project, level by level.
+
+    - **Auth Required**: Yes, a validated token with one of the hierarchy roles
+      or scoped to the project or one of its ancestors.
+    - **Request Path Args**:
+        ```
+        project_id: The id of project.
+        ```
+    - **Query Params**:
+        ```
+        depth: (optional) Number of levels to return.
+        ```
+    - **Returns**: The projects, each with its depth below the given project.
+    """
+    tree = _tree(request, project_id)
+    return [tree.summary(child, depth=level) for child, level in tree.subtree(project_id, depth)]
+
+async def _ancestors(request, project_id):
+    """Ids of the ancestor projects and of the domain of a project, from the tree
+    when it has the project, else from Keystone."""
+    tree = hierarchy.tree
+    if tree is not None and project_id in tree.projects:
+        ancestors = tree.ancestors(project_id)
+        return [x for x in ancestors if x in tree.projects], [x for x in ancestors if x not in tree.projects]
+    project = await keystone.tenant_get(request, project_id, parents_as_ids=True)
+    domain_id = getattr(project, "domain_id", None)
+    projects = []
+    parents = getattr(project, "parents", None)
+    # Nested from the parent up: {parent: {grandparent: ...}}.
+    while parents:
+        (parent_id, parents), = parents.items()
+        if parent_id != domain_id:
+            projects.append(parent_id)
+    return projects, [domain_id] if domain_id else []
+
+@routes.v1_r.get("/projects/{project_id}/role-assignments", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def get_project_role_assignments(
+    request: Request,
+    project_id: str,
+    user: Optional[str] = Query(None, description="Only assignments of this user."),
+    group: Optional[str] = Query(None, description="Only assignments of this group."),
+):
+    """
+    Retrieve the role assignments that apply to a project: those made on it
+    and those inherited from its ancestors and domain.
+
+    - **Auth Required**: Yes
+    - **Request Path Args**:
+        ```
+        project_id: The id of project.
+        ```
+    - **Query Params**:
+        ```
+        user: (optional) The id of user.
+        group: (optional) The id of group.
+        ```
+    - **Returns**: The assignments; `inherited_from` is the project or domain an
+      inherited assignment was made on, null for direct ones.
+    """
+    projects, domains = await _ancestors(request, project_id)
+    direct, inherited = await asyncio.gather(
+        keystone.role_assignments_list(request, project=project_id, user=user, group=group,
+                                       include_subtree=False),
+        keystone.inherited_role_assignments(request, user=user, group=group,
+                                            projects=projects, domains=domains),
+    )
+    # Assignments inherited to the subtree of the project itself do not apply to it.
+    assignments = [dict(x.to_dict(), inherited_from=None) for x in direct
+                   if 'OS-INHERIT:inherited_to' not in x.scope]
+    assignments += [dict(x.to_dict(), inherited_from=source) for x, source in inherited]
+    return assignments
@@ -1,4 +1,4 @@
-from fastapi import Request
+from fastapi import Request, Depends
 
 from iam import conf
 from iam.api import models
@@ -6,20 +6,25 @@ from iam.api import routes
 from iam.core import utils
 from iam.core import keystone
 from iam.api.models import ResponseModel
+from iam.core.fieldsets import fieldset
 
 TAGS = ['roles']
 
 
 @routes.v1_r.get("/roles", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_roles(request: Request):
+async def get_roles(request: Request, fields=Depends(fieldset)):
     """
     Retrieve a list of roles.
 
     - **Auth Required**: Yes
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     """
     roles = await keystone.role_list(request)
-    return [x.to_dict() for x in roles]
+    return [fields(x) for x in roles]
 
 @routes.v1_r.post("/roles", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -39,7 +44,7 @@ async def create_role(request: Request, inputs: models.CreateRoleModel):
 
 @routes.v1_r.get("/roles/{role_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_role(request: Request, role_id: str):
+async def get_role(request: Request, role_id: str, fields=Depends(fieldset)):
     """
     Retrieve a role.
 
@@ -48,10 +53,14 @@ async def get_role(request: Request, role_id: str):
         ```
         role_id: The id of role.
         ```
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     - **Returns**: The information of given role.
     """
     role = await keystone.role_get(request, role_id)
-    return role.to_dict()
+    return fields(role)
 
 @routes.v1_r.post("/roles/{role_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -87,14 +96,18 @@ async def delete_role(request: Request, role_id: str):
 
 @routes.v1_r.get("/role-assignments", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_role_assignments(request: Request):
+async def get_role_assignments(request: Request, fields=Depends(fieldset)):
     """
     Retrieve a list of role assignments.
 
     - **Auth Required**: Yes
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     """
     roles = await keystone.role_assignments_list(request, include_subtree=False)
-    return [x.to_dict() for x in roles]
+    return [fields(x) for x in roles]
 
 @routes.v1_r.post("/role-assignments", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
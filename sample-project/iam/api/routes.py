@@ -1,9 +1,21 @@
 from fastapi import APIRouter, Depends
 
 from iam import conf
+from iam.core.admission import admit
 from iam.core.auth import validate_token
+from iam.core.ratelimit import limit_by_identity, limit_by_ip
 
 # p -> public (no auth needed)
 # r -> router
-v1_pr = APIRouter(prefix=conf.WEBROOT+'/v1')
-v1_r = APIRouter(prefix=conf.WEBROOT+'/v1', dependencies=[Depends(validate_token)])
+# Admission control runs first so shed requests never reach Keystone.
+v1_pr = APIRouter(prefix=conf.WEBROOT+'/v1', dependencies=[
+    Depends(admit), Depends(limit_by_ip),
+])
+v1_r = APIRouter(prefix=conf.WEBROOT+'/v1', dependencies=[
+    Depends(admit), Depends(validate_token), Depends(limit_by_identity),
+])
+# sr -> streaming router; long-lived streams skip admission control,
+# which bounds request concurrency rather than open connections.
+v1_sr = APIRouter(prefix=conf.WEBROOT+'/v1', dependencies=[
+    Depends(validate_token), Depends(limit_by_identity),
+])
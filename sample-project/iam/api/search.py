@@ -0,0 +1,54 @@
+from typing import Optional
+from fastapi import Request, Query
+
+from iam import conf
+from iam import exceptions
+from iam.api import routes
+from iam.core import auth
+from iam.core import utils
+from iam.core import search
+from iam.api.models import ResponseModel
+
+TAGS = ['search']
+
+
+@routes.v1_r.get("/search", tags=TAGS, response_model=ResponseModel)
+@utils.handle_response()
+async def search_resources(
+    request: Request,
+    q: Optional[str] = Query(None, description="Words to look for in name, email and description, or an id."),
+    types: Optional[str] = Query(None, description="Comma separated list of users, groups, projects."),
+    domain_id: Optional[str] = Query(None),
+    enabled: Optional[bool] = Query(None),
+    limit: int = Query(20, ge=1, le=conf.SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Search users, groups and projects, best matches first.
+
+    Every word of `q` must match the start of a word in, or a part of,
+    the name, email or description; a `q` equal to an id matches that
+    resource. The index is refreshed periodically, so recent changes made
+    through other workers may take a while to show up.
+
+    - **Auth Required**: Yes, a validated token with one of the search roles.
+    - **Query Params**:
+        ```
+        q: (optional) Search words, or an id.
+        types: (optional) Comma separated list of users, groups, projects.
+        domain_id: (optional) Only resources of this domain.
+        enabled: (optional) Only enabled/disabled resources.
+        limit: (optional) Number of results, 20 by default.
+        offset: (optional) Number of results to skip.
+        ```
+    - **Returns**: The total number of matches and the requested page of them.
+    """
+    auth.require_validated(request, "Searching")
+    if not request.state.user.has_role(*conf.SEARCH_ROLES):
+        raise exceptions.ForbiddenException("Searching requires one of the roles: " + ", ".join(conf.SEARCH_ROLES))
+    if search.index is None:
+        raise exceptions.ServiceUnavailableException("The search index is not ready yet.", retry_after=5)
+    selected = [t.strip() for t in types.split(',') if t.strip()] if types else None
+    total, results = search.index.search(q, types=selected, domain_id=domain_id, enabled=enabled,
+                                         limit=limit, offset=offset)
+    return {"total": total, "limit": limit, "offset": offset, "results": results}
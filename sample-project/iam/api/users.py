@@ -1,4 +1,4 @@
-from fastapi import Request
+from fastapi import Request, Depends
 
 from iam import conf
 from iam.api import models
@@ -6,20 +6,25 @@ from iam.api import routes
 from iam.core import utils
 from iam.core import keystone
 from iam.api.models import ResponseModel
+from iam.core.fieldsets import fieldset
 
 TAGS = ['users']
 
 
 @routes.v1_r.get("/users", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_users(request: Request):
+async def get_users(request: Request, fields=Depends(fieldset)):
     """
     Retrieve a list of users.
 
     - **Auth Required**: Yes
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     """
     users = await keystone.user_list(request)
-    return [x.to_dict() for x in users]
+    return [fields(x) for x in users]
 
 @routes.v1_r.post("/users", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
@@ -43,7 +48,7 @@ async def create_user(request: Request, inputs: models.CreateUserModel):
 
 @routes.v1_r.get("/users/{user_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
-async def get_user(request: Request, user_id: str):
+async def get_user(request: Request, user_id: str, fields=Depends(fieldset)):
     """
     Retrieve a user.
 
@@ -52,10 +57,14 @@ async def get_user(request: Request, user_id: str):
         ```
         user_id: The id of user.
         ```
+    - **Query Params**:
+        ```
+        fields: (optional) Comma separated list of fields to return.
+        ```
     - **Returns**: The information of given user.
     """
     user = await keystone.user_get(request, user_id)
-    return user.to_dict()
+    return fields(user)
 
 @routes.v1_r.post("/users/{user_id}", tags=TAGS, response_model=ResponseModel)
 @utils.handle_response()
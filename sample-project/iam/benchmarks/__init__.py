@@ -0,0 +1,58 @@
+"""Micro-benchmarks, runnable from the root of project, e.g.::
+
+    python -m iam.benchmarks.response_envelope
+"""
+import time
+import asyncio
+import statistics
+
+
+def timeit(func, number=20, repeat=5):
+    """Return the best and median per-call time of ``func`` in seconds."""
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        results.append((time.perf_counter() - start) / number)
+    return min(results), statistics.median(results)
+
+def report(name, timings, baseline=None):
+    best, median = timings
+    line = f"{name:<40} best {best * 1000:9.3f} ms  median {median * 1000:9.3f} ms"
+    if baseline is not None:
+        line += f"  speedup x{baseline[0] / best:.2f}"
+    print(line)
+
+async def asgi_request(app, method="GET", path="/", headers=None, body=b""):
+    """Drive an ASGI app in-process and return ``(status, headers, body)``."""
+    headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 12345), "server": ("127.0.0.1", 80),
+    }
+    if "?" in path:
+        scope["path"], query = path.split("?", 1)
+        scope["raw_path"], scope["query_string"] = scope["path"].encode(), query.encode()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": None, "headers": [], "body": b""}
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
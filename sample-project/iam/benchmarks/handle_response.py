@@ -0,0 +1,99 @@
+"""Compare the previous ``handle_response`` wrapper with the current one on
+the success path and on expected (Keystone 404) and unexpected errors.
+
+The error paths run with error logging enabled (to a null handler) and
+disabled, since tracebacks are now only formatted when they are logged.
+"""
+import json
+import logging
+import traceback
+from functools import wraps
+from fastapi import Request
+from keystoneauth1.exceptions.http import HTTPClientError, NotFound
+
+from iam import conf
+from iam import exceptions
+from iam.benchmarks import report, run, timeit
+from iam.core import responses, utils
+from iam.core.responses import FastJSONResponse, envelope
+
+CALLS = 2000
+logger = logging.getLogger(conf.APP_NAME)
+
+
+def legacy_parse_exception(e):
+    status_code = 500
+    tb = None
+    if not next((et for et in exceptions.KNOWN_EXCEPTIONS if isinstance(e, et)), None):
+        tb = ' '.join([l.strip() for l in traceback.format_exc().splitlines() if l.strip()])
+    if isinstance(e, (HTTPClientError, exceptions.ServiceUnavailableException,
+                      exceptions.DeadlineExceededException)):
+        status_code = getattr(e, 'http_status', status_code)
+    return {"status_code": status_code, "message": str(e), "trace": tb,
+            "retry_after": getattr(e, 'retry_after', None)}
+
+def legacy_handle_response(**dkwargs):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                request = next((arg for arg in args if isinstance(arg, Request)), kwargs.get("request", None))
+                if request:
+                    if dkwargs.get("sensitive_fields"):
+                        request.state.sensitive_fields = set(map(str.lower, dkwargs["sensitive_fields"]))
+                data = await func(*args, **kwargs)
+                response = FastJSONResponse(content=envelope(data=data))
+                if request is not None and request.method in responses.CONDITIONAL_METHODS:
+                    response = responses.conditional(request, response)
+            except Exception as e:
+                parsed_exception = legacy_parse_exception(e)
+                logger.error(json.dumps({
+                    'request_id': getattr(getattr(request, 'state', None), 'request_id', None),
+                    'exception': str(e),
+                    'traceback': parsed_exception.get("trace"),
+                }))
+                status_code = parsed_exception.get('status_code', 500)
+                response = FastJSONResponse(status_code=status_code, content=envelope(
+                    success=False, status_code=status_code, message=parsed_exception.get('message')))
+            return response
+        return wrapper
+    return decorator
+
+async def ok(request: Request, user_id: str):
+    return {"id": user_id, "name": "user-1", "enabled": True}
+
+async def not_found(request: Request, user_id: str):
+    raise NotFound(f"Could not find user: {user_id}.")
+
+async def broken(request: Request, user_id: str):
+    raise RuntimeError("unexpected")
+
+def make_request(method="POST"):
+    return Request({"type": "http", "method": method, "path": "/", "headers": [], "query_string": b""})
+
+def bench(decorator, endpoint, method="POST"):
+    wrapped = decorator(sensitive_fields=["password"])(endpoint)
+    request = make_request(method)
+
+    async def calls():
+        for _ in range(CALLS):
+            await wrapped(request=request, user_id="user-1")
+
+    run(calls())  # warm up
+    return timeit(lambda: run(calls()), number=1, repeat=7)
+
+def main():
+    logger.handlers, logger.propagate = [logging.NullHandler()], False
+    print(f"{CALLS} calls per run")
+    for name, endpoint in (("success", ok), ("keystone 404", not_found), ("unexpected error", broken)):
+        for level, label in ((logging.INFO, "logged"), (logging.CRITICAL, "not logged")):
+            if endpoint is ok and level != logging.INFO:
+                continue
+            logger.setLevel(level)
+            baseline = bench(legacy_handle_response, endpoint)
+            report(f"{name} ({label}): legacy", baseline)
+            report(f"{name} ({label}): current", bench(utils.handle_response, endpoint), baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Compare the ``ResponseModel`` round trip against the fast envelope path
+for a list of 10k Keystone-like user records."""
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from iam.api.models import ResponseModel
+from iam.benchmarks import asgi_request, report, run, timeit
+from iam.core.responses import FastJSONResponse, envelope, orjson
+
+ITEMS = [
+    {
+        "id": f"{i:032x}",
+        "name": f"user-{i}",
+        "domain_id": "default",
+        "enabled": True,
+        "email": f"user-{i}@example.com",
+        "password_expires_at": None,
+        "options": {},
+        "links": {"self": f"http://keystone:5000/v3/users/{i:032x}"},
+    }
+    for i in range(10_000)
+]
+
+
+def build_apps():
+    legacy = FastAPI(default_response_class=JSONResponse)
+    fast = FastAPI(default_response_class=FastJSONResponse)
+
+    @legacy.get("/users", response_model=ResponseModel)
+    async def legacy_users():
+        return ResponseModel(data=[dict(x) for x in ITEMS])
+
+    @fast.get("/users", response_model=ResponseModel)
+    async def fast_users():
+        return FastJSONResponse(content=envelope(data=[dict(x) for x in ITEMS]))
+
+    return legacy, fast
+
+def main():
+    print(f"encoder: {'orjson' if orjson is not None else 'json (install orjson for the fast path)'}")
+    legacy, fast = build_apps()
+    assert (
+        FastJSONResponse(content=envelope(data=ITEMS)).body
+        and run(asgi_request(legacy, path="/users"))[0] == run(asgi_request(fast, path="/users"))[0] == 200
+    )
+
+    baseline = timeit(lambda: JSONResponse(content=ResponseModel(data=ITEMS).model_dump()), number=5)
+    report("model_dump + JSONResponse", baseline)
+    report("envelope + FastJSONResponse", timeit(lambda: FastJSONResponse(content=envelope(data=ITEMS)), number=5), baseline)
+
+    baseline = timeit(lambda: run(asgi_request(legacy, path="/users")), number=5)
+    report("endpoint: ResponseModel re-validated", baseline)
+    report("endpoint: fast envelope", timeit(lambda: run(asgi_request(fast, path="/users")), number=5), baseline)
+
+
+if __name__ == '__main__':
+    main()
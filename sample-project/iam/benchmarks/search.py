@@ -0,0 +1,53 @@
+"""Time building the search index over 100k users, groups and projects,
+queries against it, and patching it after a write.
+"""
+import random
+
+from iam.benchmarks import report, timeit
+from iam.core import events
+from iam.core.search import SearchIndex
+
+USERS = 80000
+GROUPS = 10000
+PROJECTS = 10000
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+         "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa"]
+
+
+def listing():
+    rnd = random.Random(0)
+    def description():
+        return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(0, 6)))
+    return {
+        events.USERS: [{"id": f"u{i:032x}", "name": f"{rnd.choice(WORDS)}.{rnd.choice(WORDS)}{i}",
+                        "email": f"user{i}@{rnd.choice(WORDS)}.example.com", "description": description(),
+                        "domain_id": f"domain-{i % 8}", "enabled": i % 10 != 0} for i in range(USERS)],
+        events.GROUPS: [{"id": f"g{i:032x}", "name": f"group {rnd.choice(WORDS)} {i}",
+                         "description": description(), "domain_id": f"domain-{i % 8}"} for i in range(GROUPS)],
+        events.PROJECTS: [{"id": f"p{i:032x}", "name": f"project-{rnd.choice(WORDS)}-{i}",
+                           "description": description(), "domain_id": f"domain-{i % 8}",
+                           "enabled": True} for i in range(PROJECTS)],
+    }
+
+def main():
+    data = listing()
+    report("build (100k entities)", timeit(lambda: SearchIndex.build(data), number=1, repeat=1))
+    index = SearchIndex.build(data)
+    queries = [
+        ("exact id", dict(query=f"u{4242:032x}")),
+        ("prefix, rare", dict(query="juliet.kilo12")),
+        ("prefix, two terms", dict(query="oscar papa")),
+        ("substring", dict(query="ovemb", types=[events.USERS])),
+        ("prefix, common + filters", dict(query="alpha", domain_id="domain-3", enabled=True)),
+        ("one letter", dict(query="a")),
+        ("filters only, page 50", dict(domain_id="domain-1", offset=1000, limit=20)),
+    ]
+    for name, kwargs in queries:
+        total, _ = index.search(**kwargs)
+        report(f"{name} ({total} hits)", timeit(lambda: index.search(**kwargs), number=10))
+    info = dict(data[events.USERS][0], name="renamed user", email="renamed@example.org")
+    report("patch one user", timeit(lambda: index.add(events.USERS, info), number=100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measure the cold import of ``iam.main`` in fresh interpreters and check it
+against a budget, so import-time regressions are caught early::
+
+    python -m iam.benchmarks.startup --max-ms 800 --max-modules 750
+
+Exits non-zero when the median import time or the module count is over
+budget, or when a module that is meant to load lazily was imported. The
+same check runs in the test suite (``tests/test_startup.py``).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+MAX_MS = 800
+MAX_MODULES = 750
+# Loaded on first use or during warm-up, never when a worker starts.
+LAZY_MODULES = ("keystoneclient.v3.client", "keystoneauth1.identity.v3")
+
+PROBE = f"""
+import sys, time, json
+start = time.perf_counter()
+import iam.main
+print(json.dumps({{
+    "ms": (time.perf_counter() - start) * 1000,
+    "modules": len(sys.modules),
+    "eager": [m for m in {LAZY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def probe():
+    # From the directory holding the ``iam`` package, whatever the caller's.
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.run([sys.executable, "-c", PROBE], check=True, cwd=root,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure(runs=5):
+    """Median import time in ms, module count and lazy modules imported eagerly."""
+    results = [probe() for _ in range(runs)]
+    median_ms = statistics.median(r["ms"] for r in results)
+    modules = max(r["modules"] for r in results)
+    eager = sorted({m for r in results for m in r["eager"]})
+    return median_ms, modules, eager
+
+def check(median_ms, modules, eager, max_ms=MAX_MS, max_modules=MAX_MODULES):
+    """What is over budget, as messages."""
+    failures = []
+    if median_ms > max_ms:
+        failures.append(f"import time {median_ms:.1f} ms over budget")
+    if modules > max_modules:
+        failures.append(f"{modules} modules over budget")
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=MAX_MS)
+    parser.add_argument("--max-modules", type=int, default=MAX_MODULES)
+    args = parser.parse_args()
+
+    median_ms, modules, eager = measure(args.runs)
+    print(f"import iam.main  median {median_ms:8.1f} ms (budget {args.max_ms:.0f})  "
+          f"modules {modules} (budget {args.max_modules})")
+    failures = check(median_ms, modules, eager, args.max_ms, args.max_modules)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,3 +16,132 @@ OPENSTACK_OWNER_ROLE = os.getenv('OPENSTACK_OWNER_ROLE', 'owner')
 
 AUTHENTICATION_HEADER = os.getenv('AUTHENTICATION_HEADER', 'X-Authentication')
 IDENTITY_HEADER = os.getenv('IDENTITY_HEADER', 'X-Identity')
+
+FAKE_KEYSTONE_PORT = int(os.getenv('FAKE_KEYSTONE_PORT', 5050))
+FAKE_KEYSTONE_USERS = int(os.getenv('FAKE_KEYSTONE_USERS', 1000))
+FAKE_KEYSTONE_LATENCY_MS = float(os.getenv('FAKE_KEYSTONE_LATENCY_MS', 0))
+
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3))
+COMPRESSION_CACHE_SIZE = int(os.getenv('COMPRESSION_CACHE_SIZE', 256))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_SLOW_CALL_MS = float(os.getenv('BREAKER_SLOW_CALL_MS', 5000))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv('BREAKER_HALF_OPEN_MAX_CALLS', 1))
+BULKHEAD_MAX_WAIT = float(os.getenv('BULKHEAD_MAX_WAIT', 1))
+KEYSTONE_AUTH_CONCURRENCY = int(os.getenv('KEYSTONE_AUTH_CONCURRENCY', 8))
+KEYSTONE_VALIDATE_CONCURRENCY = int(os.getenv('KEYSTONE_VALIDATE_CONCURRENCY', 16))
+KEYSTONE_READ_CONCURRENCY = int(os.getenv('KEYSTONE_READ_CONCURRENCY', 16))
+KEYSTONE_WRITE_CONCURRENCY = int(os.getenv('KEYSTONE_WRITE_CONCURRENCY', 8))
+
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 30))
+MAX_REQUEST_TIMEOUT = float(os.getenv('MAX_REQUEST_TIMEOUT', 120))
+DEADLINE_HEADER = os.getenv('DEADLINE_HEADER', 'X-Request-Timeout')
+
+KEYSTONE_RETRIES = int(os.getenv('KEYSTONE_RETRIES', 2))
+RETRY_BACKOFF_BASE_MS = float(os.getenv('RETRY_BACKOFF_BASE_MS', 50))
+RETRY_BACKOFF_MAX_MS = float(os.getenv('RETRY_BACKOFF_MAX_MS', 1000))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', 0.2))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv('RETRY_BUDGET_MIN_PER_SEC', 1))
+HEDGE_TOKEN_VALIDATION = os.getenv('HEDGE_TOKEN_VALIDATION', 'False').lower() in ('true', '1', 'yes')
+HEDGE_MIN_DELAY_MS = float(os.getenv('HEDGE_MIN_DELAY_MS', 20))
+HEDGE_LATENCY_WINDOW = int(os.getenv('HEDGE_LATENCY_WINDOW', 200))
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'True').lower() in ('true', '1', 'yes')
+ADMISSION_INITIAL_LIMIT = int(os.getenv('ADMISSION_INITIAL_LIMIT', 64))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', 4))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', 1024))
+ADMISSION_TARGET_LATENCY_MS = float(os.getenv('ADMISSION_TARGET_LATENCY_MS', 1000))
+ADMISSION_BACKOFF_RATIO = float(os.getenv('ADMISSION_BACKOFF_RATIO', 0.9))
+ADMISSION_NORMAL_SHARE = float(os.getenv('ADMISSION_NORMAL_SHARE', 0.9))
+ADMISSION_LOW_SHARE = float(os.getenv('ADMISSION_LOW_SHARE', 0.7))
+ADMISSION_HIGH_MAX_WAIT_MS = float(os.getenv('ADMISSION_HIGH_MAX_WAIT_MS', 2000))
+ADMISSION_NORMAL_MAX_WAIT_MS = float(os.getenv('ADMISSION_NORMAL_MAX_WAIT_MS', 500))
+ADMISSION_LOW_MAX_WAIT_MS = float(os.getenv('ADMISSION_LOW_MAX_WAIT_MS', 0))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() in ('true', '1', 'yes')
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+RATE_LIMIT_USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE', 20))
+RATE_LIMIT_USER_BURST = float(os.getenv('RATE_LIMIT_USER_BURST', 40))
+RATE_LIMIT_PROJECT_RATE = float(os.getenv('RATE_LIMIT_PROJECT_RATE', 100))
+RATE_LIMIT_PROJECT_BURST = float(os.getenv('RATE_LIMIT_PROJECT_BURST', 200))
+RATE_LIMIT_IP_ENABLED = os.getenv('RATE_LIMIT_IP_ENABLED', 'False').lower() in ('true', '1', 'yes')
+RATE_LIMIT_IP_RATE = float(os.getenv('RATE_LIMIT_IP_RATE', 5))
+RATE_LIMIT_IP_BURST = float(os.getenv('RATE_LIMIT_IP_BURST', 20))
+# Addresses or networks of the reverse proxies whose X-Forwarded-For is honoured.
+RATE_LIMIT_TRUSTED_PROXIES = [p.strip() for p in os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '').split(',') if p.strip()]
+
+LOGIN_CACHE_ENABLED = os.getenv('LOGIN_CACHE_ENABLED', 'False').lower() in ('true', '1', 'yes')
+LOGIN_CACHE_MIN_TTL = float(os.getenv('LOGIN_CACHE_MIN_TTL', 300))
+LOGIN_CACHE_MAX_ENTRIES = int(os.getenv('LOGIN_CACHE_MAX_ENTRIES', 10000))
+
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 300))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 10000))
+CACHE_SNAPSHOT_DIR = os.getenv('CACHE_SNAPSHOT_DIR', '')
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv('CACHE_SNAPSHOT_INTERVAL', 60))
+
+KEYSTONE_POOL_SIZE = int(os.getenv('KEYSTONE_POOL_SIZE', 32))
+KEYSTONE_SERVICE_USERNAME = os.getenv('KEYSTONE_SERVICE_USERNAME', '')
+KEYSTONE_SERVICE_PASSWORD = os.getenv('KEYSTONE_SERVICE_PASSWORD', '')
+KEYSTONE_SERVICE_PROJECT = os.getenv('KEYSTONE_SERVICE_PROJECT', '')
+RESOURCE_CACHE_TTL = float(os.getenv('RESOURCE_CACHE_TTL', 0))
+RESOURCE_CACHE_MAX_ENTRIES = int(os.getenv('RESOURCE_CACHE_MAX_ENTRIES', 256))
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'True').lower() in ('true', '1', 'yes')
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', 8))
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', 30))
+
+OPENAPI_SCHEMA_PATH = os.getenv('OPENAPI_SCHEMA_PATH', '')
+
+IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', 'True').lower() in ('true', '1', 'yes')
+IDEMPOTENCY_HEADER = os.getenv('IDEMPOTENCY_HEADER', 'Idempotency-Key')
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 3600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))
+
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory')
+JOB_SQLITE_PATH = os.getenv('JOB_SQLITE_PATH', 'iam-jobs.sqlite3')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', 3600))
+JOB_MAX_ENTRIES = int(os.getenv('JOB_MAX_ENTRIES', 1000))
+JOB_RETENTION = float(os.getenv('JOB_RETENTION', 86400))
+
+EVENTS_LOG_SIZE = int(os.getenv('EVENTS_LOG_SIZE', 10000))
+EVENTS_SUBSCRIBER_BUFFER = int(os.getenv('EVENTS_SUBSCRIBER_BUFFER', 1000))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', 1000))
+EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', 15))
+
+SEARCH_ENABLED = os.getenv('SEARCH_ENABLED', 'False').lower() in ('true', '1', 'yes')
+SEARCH_REFRESH_INTERVAL = float(os.getenv('SEARCH_REFRESH_INTERVAL', 300))
+SEARCH_ROLES = [x.strip() for x in os.getenv('SEARCH_ROLES', 'admin').split(',') if x.strip()]
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 100))
+
+HIERARCHY_ENABLED = os.getenv('HIERARCHY_ENABLED', 'False').lower() in ('true', '1', 'yes')
+HIERARCHY_REFRESH_INTERVAL = float(os.getenv('HIERARCHY_REFRESH_INTERVAL', 300))
+HIERARCHY_ROLES = [x.strip() for x in os.getenv('HIERARCHY_ROLES', 'admin').split(',') if x.strip()]
+
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 50))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+
+SERVER_LOOP = os.getenv('SERVER_LOOP', 'auto')
+SERVER_HTTP = os.getenv('SERVER_HTTP', 'auto')
+SERVER_PRELOAD = os.getenv('SERVER_PRELOAD', 'True').lower() in ('true', '1', 'yes')
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', 2048))
+SERVER_KEEPALIVE_TIMEOUT = int(os.getenv('SERVER_KEEPALIVE_TIMEOUT', 65))
+SERVER_LIMIT_CONCURRENCY = int(os.getenv('SERVER_LIMIT_CONCURRENCY', 2048))
+SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 0))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 0))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))
+
+PROFILER_ROLES = [x.strip() for x in os.getenv('PROFILER_ROLES', 'admin').split(',') if x.strip()]
+PROFILER_BACKEND = os.getenv('PROFILER_BACKEND', 'memory')
+PROFILER_SQLITE_PATH = os.getenv('PROFILER_SQLITE_PATH', 'iam-profiles.sqlite3')
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 10))
+PROFILER_THRESHOLD_MS = float(os.getenv('PROFILER_THRESHOLD_MS', 1000))
+PROFILER_SAMPLE_EVERY = int(os.getenv('PROFILER_SAMPLE_EVERY', 0))
+PROFILER_MAX_DURATION = float(os.getenv('PROFILER_MAX_DURATION', 600))
+PROFILER_MAX_ACTIVE = int(os.getenv('PROFILER_MAX_ACTIVE', 64))
+PROFILER_MAX_PROFILES = int(os.getenv('PROFILER_MAX_PROFILES', 100))
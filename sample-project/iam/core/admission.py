@@ -0,0 +1,200 @@
+"""Adaptive admission control and load shedding.
+
+Every routed request passes through ``admit`` before authentication. The
+controller keeps a concurrency limit that grows additively while requests
+finish within ``ADMISSION_TARGET_LATENCY_MS`` and shrinks multiplicatively
+when latency or queueing delay exceed it (AIMD).
+
+Requests are split into priorities. Each priority may only use a share of
+the limit, so low priority work (list endpoints) is shed with
+``503 + Retry-After`` first while high priority work (login, token
+validation) still gets through and may queue briefly for a slot.
+"""
+import time
+import asyncio
+import collections
+from functools import lru_cache
+from fastapi import Request, HTTPException
+
+from iam import conf
+from iam.core import batch
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+HIGH_PRIORITY_ENDPOINTS = {"login", "validate_token"}
+# Endpoints that only fan out to sub-requests, which are admitted one by one.
+BATCH_ENDPOINTS = {"run_batch"}
+# Scope entry with the priority of a batch request, inherited by its sub-requests.
+PRIORITY_KEY = "iam.admission.priority"
+
+SHARES = {
+    HIGH: 1.0,
+    NORMAL: conf.ADMISSION_NORMAL_SHARE,
+    LOW: conf.ADMISSION_LOW_SHARE,
+}
+MAX_WAIT = {
+    HIGH: conf.ADMISSION_HIGH_MAX_WAIT_MS / 1000,
+    NORMAL: conf.ADMISSION_NORMAL_MAX_WAIT_MS / 1000,
+    LOW: conf.ADMISSION_LOW_MAX_WAIT_MS / 1000,
+}
+
+
+class AdmissionController:
+    def __init__(self, initial_limit=conf.ADMISSION_INITIAL_LIMIT, min_limit=conf.ADMISSION_MIN_LIMIT,
+                 max_limit=conf.ADMISSION_MAX_LIMIT, target_latency_ms=conf.ADMISSION_TARGET_LATENCY_MS,
+                 backoff_ratio=conf.ADMISSION_BACKOFF_RATIO):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency_ms / 1000
+        self.backoff_ratio = backoff_ratio
+        self.inflight = 0
+        self._waiters = {priority: collections.deque() for priority in PRIORITIES}
+        self._last_decrease = 0.0
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "shed": {priority: 0 for priority in PRIORITIES},
+        }
+
+    def capacity(self, priority) -> int:
+        return max(1, int(self.limit * SHARES[priority]))
+
+    def _queued_ahead(self, priority) -> bool:
+        for p in PRIORITIES:
+            if self._waiters[p]:
+                return True
+            if p == priority:
+                return False
+        return False
+
+    async def acquire(self, priority) -> float:
+        """Wait for a slot and return the queueing delay in seconds.
+
+        :raises: HTTPException(503) when the request is shed
+        """
+        if self.inflight < self.capacity(priority) and not self._queued_ahead(priority):
+            self.inflight += 1
+            self.stats["admitted"] += 1
+            return 0.0
+
+        max_wait = MAX_WAIT[priority]
+        if max_wait > 0:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters[priority].append(waiter)
+            self.stats["queued"] += 1
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # The client went away while queued: give back the slot if
+                # ``_wake`` handed one over already, else leave the queue.
+                if waiter.done() and not waiter.cancelled():
+                    self.inflight -= 1
+                    self._wake()
+                else:
+                    waiter.cancel()
+                    try:
+                        self._waiters[priority].remove(waiter)
+                    except ValueError:
+                        pass
+                raise
+            if waiter.done() and not waiter.cancelled():
+                self.stats["admitted"] += 1
+                return time.monotonic() - start
+            waiter.cancel()
+            try:
+                self._waiters[priority].remove(waiter)
+            except ValueError:
+                pass
+            # Shedding after queueing for a while is itself a sign of overload.
+            self._decrease()
+
+        self.stats["shed"][priority] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Service is overloaded, please retry later.",
+            headers={"Retry-After": str(conf.ADMISSION_RETRY_AFTER)},
+        )
+
+    def release(self, latency, queue_delay):
+        self.inflight -= 1
+        if latency > self.target_latency or queue_delay > self.target_latency:
+            self._decrease()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _decrease(self):
+        # At most one multiplicative decrease per target latency interval, so a
+        # burst of slow completions counts as one congestion signal.
+        now = time.monotonic()
+        if now - self._last_decrease >= self.target_latency:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            self._last_decrease = now
+
+    def _wake(self):
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters and self.inflight < self.capacity(priority):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self.inflight += 1
+                    waiter.set_result(None)
+            if waiters:
+                # Lower priorities never overtake a waiting higher priority.
+                return
+
+    def snapshot(self):
+        return {
+            "limit": round(self.limit, 2),
+            "inflight": self.inflight,
+            "capacity": {priority: self.capacity(priority) for priority in PRIORITIES},
+            "waiting": {priority: len(self._waiters[priority]) for priority in PRIORITIES},
+            **self.stats,
+        }
+
+
+controller = AdmissionController()
+
+
+@lru_cache(maxsize=512)
+def _priority(endpoint_name, method, path):
+    if endpoint_name in HIGH_PRIORITY_ENDPOINTS:
+        return HIGH
+    if method == "GET" and "{" not in path:
+        return LOW  # list endpoints
+    return NORMAL
+
+def priority(request: Request) -> str:
+    route = request.scope.get("route")
+    return _priority(getattr(route, "name", None), request.method, getattr(route, "path", request.url.path))
+
+async def admit(request: Request):
+    """Router dependency gating each request through the admission controller.
+
+    A batch request takes no slot itself: each of its sub-requests takes
+    one, at the priority of the batch.
+    """
+    if not conf.ADMISSION_CONTROL:
+        yield
+        return
+    if batch.SCOPE_KEY in request.scope:
+        level = request.scope.get(PRIORITY_KEY) or priority(request)
+    else:
+        level = priority(request)
+        if getattr(request.scope.get("route"), "name", None) in BATCH_ENDPOINTS:
+            request.scope[PRIORITY_KEY] = level
+            yield
+            return
+    queue_delay = await controller.acquire(level)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(time.monotonic() - start, queue_delay)
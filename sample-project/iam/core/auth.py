@@ -1,26 +1,67 @@
+import sys
 import json
 import base64
-from async_lru import alru_cache
+from functools import lru_cache
 from fastapi import Request, HTTPException, Depends
 from fastapi.security.api_key import APIKeyHeader
 
 from iam import conf
-from iam.core.keystone import token_validate
+from iam import exceptions
+from iam.core import batch
+from iam.core import cache
+from iam.core.keystone import token_validate, token_cache_expiry
 
+# Principals by token, expiring with the cached validation result.
+principal_cache = cache.TTLCache(maxsize=conf.TOKEN_CACHE_MAX_ENTRIES)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
 
 class User:
-    def __init__(self, token_info, **kwargs):
-        self.id = token_info.get('user', {}).get('id')
-        self.username = token_info.get('user', {}).get('name')
-        self.project_id = token_info.get('project', {}).get('id')
-        self.project_name = token_info.get('project', {}).get('name')
+    """Authenticated principal, built once per token and cached with it.
+
+    Ids are interned and role names/ids kept in frozensets, so role checks
+    are set lookups rather than scans of the token's role list.
+
+    ``validated`` is only true for principals built from a token Keystone
+    validated; those taken from the identity header are whatever the
+    client sent, and only the Keystone calls made with their token check them.
+    """
+
+    __slots__ = ("id", "username", "domain_id", "project_id", "project_name",
+                 "project_domain_id", "scope", "roles", "role_ids", "role_names", "token",
+                 "validated")
+
+    def __init__(self, token_info, validated=False, **kwargs):
+        user = token_info.get('user') or {}
+        project = token_info.get('project') or {}
+        self.id = _intern(user.get('id'))
+        self.username = user.get('name')
+        self.domain_id = _intern((user.get('domain') or {}).get('id'))
+        self.project_id = _intern(project.get('id'))
+        self.project_name = project.get('name')
+        self.project_domain_id = _intern((project.get('domain') or {}).get('id'))
+        if project:
+            self.scope = "project"
+        elif token_info.get('domain'):
+            self.scope = "domain"
+        else:
+            self.scope = "unscoped"
         self.roles = token_info.get('roles', [])
+        self.role_ids = frozenset(_intern(role['id']) for role in self.roles if role.get('id'))
+        self.role_names = frozenset(_intern(role['name']) for role in self.roles if role.get('name'))
         self.token = token_info.get('token')
+        self.validated = validated
 
     @property
     def is_authenticated(self) -> bool:
         return True
-    
+
+    def has_role(self, *roles) -> bool:
+        """Whether the principal has any of ``roles``, given by name or id."""
+        return any(role in self.role_names or role in self.role_ids for role in roles)
+
     def to_dict(self):
         return {
             "user": {
@@ -37,17 +78,54 @@ class User:
         }
 
 
+@lru_cache(maxsize=1024)
+def _identity_principal(identity):
+    try:
+        return User(json.loads(base64.b64decode(identity.encode())))
+    except:
+        return None
+
+async def _token_principal(token):
+    principal = principal_cache.get(token)
+    if principal is None:
+        token_info = await token_validate(token)
+        if token_info:
+            principal = User(token_info, validated=True)
+            principal_cache.set(token, principal, token_cache_expiry(token_info))
+    return principal
+
+def require_validated(request: Request, feature):
+    """Refuse ``feature`` to a principal taken from the identity header.
+
+    For features answered from this service's own state, without calling
+    Keystone with the caller's token: nothing else would check the roles
+    and ids the client put in the header.
+
+    :raises: exceptions.ForbiddenException
+    """
+    if not request.state.user.validated:
+        raise exceptions.ForbiddenException(
+            f"{feature} requires a token validated by Keystone ({conf.AUTHENTICATION_HEADER}), "
+            f"not an {conf.IDENTITY_HEADER} header.")
+
 async def validate_token(
         request: Request,
         token: str = Depends(APIKeyHeader(name=conf.AUTHENTICATION_HEADER, auto_error=False)),
         identity: str = Depends(APIKeyHeader(name=conf.IDENTITY_HEADER, auto_error=False)),
 ):
-    token_info = None
-    try:
-        token_info = json.loads(base64.b64decode(identity.encode()))
-    except:
-        token_info = await token_validate(token)
-    if not token_info:
+    if batch.SCOPE_KEY in request.scope:
+        # A batch sub-request, authenticated with the batch request.
+        request.state.user = request.scope[batch.SCOPE_KEY]["user"]
+        return request.state.user
+    principal = _identity_principal(identity) if identity else None
+    if principal is None and token:
+        try:
+            principal = await _token_principal(token)
+        except (exceptions.ServiceUnavailableException,
+                exceptions.DeadlineExceededException) as e:
+            raise HTTPException(status_code=e.http_status, detail=str(e),
+                                headers={"Retry-After": str(getattr(e, "retry_after", None) or 1)})
+    if principal is None:
         raise HTTPException(status_code=401, detail=f"Invalid or missing {conf.AUTHENTICATION_HEADER}")
-    request.state.user = User(token_info)
-    return token_info
+    request.state.user = principal
+    return principal
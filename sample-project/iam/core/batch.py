@@ -0,0 +1,185 @@
+"""Several v1 operations in one HTTP call.
+
+Sub-requests are dispatched in-process to the application's router, below
+the middleware stack, carrying the principal of the batch request: their
+token is not validated again. Admission control and rate limits still
+apply to each sub-request.
+
+Sub-requests run concurrently, at most ``BATCH_CONCURRENCY`` at a time,
+except that one waits for the earlier sub-requests it ``depends_on`` or
+references: a string ``${<id>.<key>...}`` in its path or body is replaced
+with that part of the referenced response body, e.g. ``${new_user.data.id}``.
+A sub-request whose dependency failed is not run and gets ``424``.
+"""
+import re
+import json
+import asyncio
+import logging
+from starlette.routing import Match
+from starlette.exceptions import HTTPException
+
+from iam import conf
+from iam import exceptions
+from iam.core.responses import dumps, envelope
+
+LOG = logging.getLogger(__name__)
+
+# Scope entry of sub-requests, holding the principal of the batch request.
+SCOPE_KEY = "iam.batch"
+REFERENCE = re.compile(r"\$\{([\w-]+)((?:\.[\w-]+)*)\}")
+# Entries of the batch request's scope that belong to that request only.
+_REQUEST_KEYS = ("route", "endpoint", "path_params", "state",
+                 "fastapi_inner_astack", "fastapi_function_astack")
+# Headers of the batch request that do not apply to its sub-requests.
+_SKIPPED_HEADERS = {b"content-length", b"content-type", b"accept-encoding",
+                    b"if-none-match", b"if-match", conf.IDEMPOTENCY_HEADER.lower().encode()}
+
+
+class UnresolvedReference(Exception):
+    pass
+
+
+def references(value):
+    """Ids of the sub-requests referenced in ``value``."""
+    if isinstance(value, str):
+        return {match.group(1) for match in REFERENCE.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*map(references, value.values()))
+    if isinstance(value, list):
+        return set().union(*map(references, value))
+    return set()
+
+def _lookup(results, match):
+    value = results[match.group(1)]["body"]
+    for key in filter(None, match.group(2).split(".")):
+        try:
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise UnresolvedReference(f"Could not resolve {match.group(0)}.")
+    return value
+
+def resolve(value, results):
+    """``value`` with its references replaced from the ``results`` so far."""
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match:
+            # A whole-string reference keeps the type of what it refers to.
+            return _lookup(results, match)
+        return REFERENCE.sub(lambda m: str(_lookup(results, m)), value)
+    if isinstance(value, dict):
+        return {k: resolve(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, results) for v in value]
+    return value
+
+def plan(subrequests):
+    """Dependencies of each sub-request, by id.
+
+    :raises: exceptions.BadRequestException on duplicate ids or on
+        dependencies that are not earlier sub-requests
+    """
+    dependencies = {}
+    for sub in subrequests:
+        if sub["id"] in dependencies:
+            raise exceptions.BadRequestException(f"Duplicate sub-request id: {sub['id']}.")
+        needed = set(sub["depends_on"]) | references(sub["path"]) | references(sub["body"])
+        unknown = needed - dependencies.keys()
+        if unknown:
+            raise exceptions.BadRequestException(
+                f"Sub-request {sub['id']} depends on {', '.join(sorted(unknown))}, "
+                "which must be earlier sub-requests.")
+        dependencies[sub["id"]] = sorted(needed)
+    return dependencies
+
+def _result(sub_id, status_code, body):
+    return {"id": sub_id, "status_code": status_code, "body": body}
+
+def _error(sub_id, status_code, message):
+    return _result(sub_id, status_code, envelope(success=False, status_code=status_code, message=message))
+
+
+async def _dispatch(request, allowed_routes, sub_id, method, path, body):
+    path, _, query = path.partition("?")
+    scope = {k: v for k, v in request.scope.items() if k not in _REQUEST_KEYS}
+    payload = dumps(body) if body is not None else b""
+    headers = [(k, v) for k, v in request.scope["headers"] if k not in _SKIPPED_HEADERS]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    full_path = f"{conf.WEBROOT}/v1{path}"
+    scope.update({
+        "method": method,
+        "path": full_path,
+        "raw_path": full_path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": {"request_id": f"{getattr(request.state, 'request_id', None)}:{sub_id}"},
+        SCOPE_KEY: {"user": request.state.user},
+    })
+    if not any(route.matches(scope)[0] != Match.NONE for route in allowed_routes):
+        return _error(sub_id, 404, f"No batchable operation at {method} {path}.")
+
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    response = {"status": 500, "headers": [], "body": b""}
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    try:
+        await request.app.router(scope, receive, send)
+    except HTTPException as e:
+        # Raised by the router itself (e.g. 405), outside of any route's handlers.
+        return _error(sub_id, e.status_code, e.detail)
+    content_type = dict(response["headers"]).get(b"content-type", b"")
+    data = response["body"]
+    if content_type.startswith(b"application/json") and data:
+        data = json.loads(data)
+    else:
+        data = data.decode("utf-8", "replace") or None
+    return _result(sub_id, response["status"], data)
+
+async def run(request, subrequests, allowed_routes):
+    """Results of ``subrequests``, in their order.
+
+    :param subrequests: dicts with ``id``, ``method``, ``path``, ``body`` and ``depends_on``
+    :param allowed_routes: the routes sub-requests may be dispatched to
+    """
+    dependencies = plan(subrequests)
+    slots = asyncio.Semaphore(conf.BATCH_CONCURRENCY)
+    results = {}
+    tasks = {}
+
+    async def execute(sub):
+        needed = dependencies[sub["id"]]
+        await asyncio.gather(*(tasks[x] for x in needed))
+        failed = [x for x in needed if results[x]["status_code"] >= 400]
+        if failed:
+            result = _error(sub["id"], 424, f"Not run, {', '.join(failed)} failed.")
+        else:
+            try:
+                path = resolve(sub["path"], results)
+                body = resolve(sub["body"], results)
+            except UnresolvedReference as e:
+                result = _error(sub["id"], 422, str(e))
+            else:
+                async with slots:
+                    try:
+                        result = await _dispatch(request, allowed_routes, sub["id"],
+                                                 sub["method"].upper(), path, body)
+                    except Exception as e:
+                        LOG.warning("Batch sub-request %s failed: %s", sub["id"], e)
+                        result = _error(sub["id"], 500, str(e))
+        results[sub["id"]] = result
+        return result
+
+    for sub in subrequests:
+        tasks[sub["id"]] = asyncio.ensure_future(execute(sub))
+    return list(await asyncio.gather(*tasks.values()))
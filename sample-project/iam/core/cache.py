@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries carry their own expiry.
+
+    Expiry times are absolute epoch seconds so entries keep their meaning
+    outside this process. Entries can be tagged (e.g. with a user id) so
+    everything derived from one subject can be invalidated at once.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (value, expires_at, tag)
+        self._tags = {}             # tag -> set(key)
+        self._lock = threading.RLock()
+
+    def get(self, key, min_ttl=0):
+        """Return the value for ``key`` if it is valid for ``min_ttl`` more seconds."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at, tag = entry
+            if expires_at - time.time() <= min_ttl:
+                if expires_at <= time.time():
+                    self._delete(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at, tag=None):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+            self._data[key] = (value, expires_at, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._delete(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._delete(key)
+
+    def _delete(self, key):
+        value, expires_at, tag = self._data.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def items(self):
+        """Unexpired ``(key, value, expires_at, tag)`` tuples, oldest first."""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, value, expires_at, tag)
+                for key, (value, expires_at, tag) in self._data.items()
+                if expires_at > now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._data)
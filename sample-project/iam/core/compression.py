@@ -0,0 +1,163 @@
+import zlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+from iam import conf
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional speedup
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional speedup
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+# Streamed message by message; compressing would hold messages back.
+UNCOMPRESSED_TYPES = (b"text/event-stream",)
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = self.compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def compressobj(self):
+        return zlib.compressobj(conf.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class _BrotliStream:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=conf.COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=conf.COMPRESSION_BROTLI_QUALITY)
+
+    def compressobj(self):
+        return _BrotliStream()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _compressor(self):
+        # ZstdCompressor instances are reusable but not thread safe. One-shot
+        # compress() calls finish before the next can start on the thread.
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=conf.COMPRESSION_ZSTD_LEVEL)
+        return compressor
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor().compress(data)
+
+    def compressobj(self):
+        # A stream keeps state in its compressor between chunks, and streams
+        # of one event loop thread interleave: each gets its own.
+        return zstandard.ZstdCompressor(level=conf.COMPRESSION_ZSTD_LEVEL).compressobj()
+
+
+# In order of preference when the client weighs several encodings equally.
+ENCODERS = OrderedDict(
+    (encoder.name, encoder) for encoder in (
+        ZstdEncoder() if zstandard is not None else None,
+        BrotliEncoder() if brotli is not None else None,
+        GzipEncoder(),
+    ) if encoder is not None
+)
+
+
+@lru_cache(maxsize=128)
+def negotiate(accept_encoding: str):
+    """Pick the best supported encoder for an ``Accept-Encoding`` header."""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name, encoder in ENCODERS.items():
+        q = weights.get(name, wildcard)
+        if q > best_q:
+            best, best_q = encoder, q
+    return best
+
+def is_compressible(headers) -> bool:
+    content_type = b""
+    for key, value in headers:
+        if key == b"content-encoding":
+            return False
+        if key == b"content-type":
+            content_type = value
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(UNCOMPRESSED_TYPES)
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Give each content-coding of a representation its own strong ETag."""
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+def strip_encoding(etag: str) -> str:
+    for name in ENCODERS:
+        suffix = f'-{name}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+class CompressedCache:
+    """Small LRU of compressed bodies keyed by ``(etag, encoding)``.
+
+    Repeat hits for an unchanged representation reuse the compressed bytes
+    instead of compressing the same body again.
+    """
+
+    def __init__(self, maxsize=conf.COMPRESSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+compressed_cache = CompressedCache()
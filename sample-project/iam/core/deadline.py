@@ -0,0 +1,47 @@
+"""Per-request deadlines.
+
+``DeadlineMiddleware`` starts a deadline for every request (``REQUEST_TIMEOUT``
+by default, overridable by the client through ``DEADLINE_HEADER`` up to
+``MAX_REQUEST_TIMEOUT``). It lives in a context variable, so every Keystone
+call made while serving the request can ask for the remaining budget.
+"""
+import time
+import contextvars
+
+from iam import conf
+from iam import exceptions
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def parse_timeout(value) -> float:
+    """Timeout in seconds from a header value, clamped to the allowed range."""
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return conf.REQUEST_TIMEOUT
+    if timeout <= 0:
+        return conf.REQUEST_TIMEOUT
+    return min(timeout, conf.MAX_REQUEST_TIMEOUT)
+
+def start(timeout):
+    return _deadline.set(time.monotonic() + timeout)
+
+def reset(token):
+    _deadline.reset(token)
+
+def remaining(default=None):
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return deadline - time.monotonic()
+
+def budget() -> float:
+    """Time left for the next upstream call.
+
+    :raises: exceptions.DeadlineExceededException once the budget is spent
+    """
+    left = remaining(conf.REQUEST_TIMEOUT)
+    if left <= 0:
+        raise exceptions.DeadlineExceededException("Request deadline exceeded.")
+    return left
@@ -0,0 +1,172 @@
+"""Change feed behind ``/events``.
+
+Writes made through this service publish an event (resource type, action
+and identifiers only; subscribers fetch details through the regular,
+policy-checked routes). Events are serialized once, kept in a ring buffer
+of the last ``EVENTS_LOG_SIZE`` and fanned out to subscribers, each with a
+bounded buffer. A subscriber that falls ``EVENTS_SUBSCRIBER_BUFFER``
+events behind is disconnected and resumes from the ring buffer with
+``Last-Event-ID``.
+
+Event ids are ``<stream>:<sequence>``, where the stream is unique to this
+worker process. When an id cannot be resumed from (another worker, or too
+old) the client gets a ``reset`` event and should resync by listing.
+
+In-process consumers (e.g. indexes kept by this worker) register with
+``listen`` and also get the written resource, when the write returned one.
+"""
+import os
+import uuid
+import asyncio
+import logging
+import collections
+from fastapi import HTTPException
+
+from iam import conf
+from iam.core.responses import dumps
+
+LOG = logging.getLogger(__name__)
+
+STREAM = uuid.uuid4().hex[:12]
+
+USERS = "users"
+GROUPS = "groups"
+GROUP_MEMBERSHIPS = "group_memberships"
+PROJECTS = "projects"
+ROLES = "roles"
+ROLE_ASSIGNMENTS = "role_assignments"
+TYPES = (USERS, GROUPS, GROUP_MEMBERSHIPS, PROJECTS, ROLES, ROLE_ASSIGNMENTS)
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+class Subscriber:
+    def __init__(self, types=None, buffer_size=conf.EVENTS_SUBSCRIBER_BUFFER):
+        self.types = types
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+
+
+class EventLog:
+    def __init__(self, size=conf.EVENTS_LOG_SIZE, max_subscribers=conf.EVENTS_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._log = collections.deque(maxlen=size)  # (sequence, type, message)
+        self._sequence = 0
+        self.subscribers = set()
+        self.dropped = 0
+
+    def publish(self, type, action, **data):
+        self._sequence += 1
+        event_id = f"{STREAM}:{self._sequence}"
+        payload = dumps({"id": event_id, "type": type, "action": action, "data": data}).decode()
+        event = (self._sequence, type, f"id: {event_id}\nevent: {type}.{action}\ndata: {payload}\n\n")
+        self._log.append(event)
+        for subscriber in list(self.subscribers):
+            if subscriber.types and type not in subscriber.types:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        # Too far behind: end its stream; it resumes from the log on reconnect.
+        self.subscribers.discard(subscriber)
+        self.dropped += 1
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def subscribe(self, types=None) -> Subscriber:
+        if len(self.subscribers) >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Too many event subscribers.",
+                                headers={"Retry-After": "5"})
+        subscriber = Subscriber(types)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def since(self, last_event_id):
+        """Logged events after ``last_event_id``, or None if it cannot be resumed from."""
+        stream, _, sequence = last_event_id.partition(":")
+        try:
+            sequence = int(sequence)
+        except ValueError:
+            return None
+        if stream != STREAM or sequence > self._sequence:
+            return None
+        if self._log and sequence < self._log[0][0] - 1:
+            return None
+        return [event for event in self._log if event[0] > sequence]
+
+    def snapshot(self):
+        return {
+            "stream": STREAM,
+            "sequence": self._sequence,
+            "logged": len(self._log),
+            "subscribers": len(self.subscribers),
+            "dropped": self.dropped,
+        }
+
+
+log = EventLog()
+listeners = []
+
+
+def _new_stream():
+    global STREAM
+    STREAM = uuid.uuid4().hex[:12]
+
+# Workers forked from a preloaded process must not share its stream.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_new_stream)
+
+
+def listen(func):
+    """Call ``func(type, action, data, resource)`` on every event of this worker."""
+    listeners.append(func)
+    return func
+
+def publish(type, action, resource=None, **data):
+    log.publish(type, action, **data)
+    for func in listeners:
+        try:
+            func(type, action, data, resource)
+        except Exception as e:
+            # The write itself succeeded; a listener must not fail the request.
+            LOG.warning("Event listener %s failed on %s.%s: %s", func.__name__, type, action, e)
+
+async def stream(subscriber, last_event_id=None):
+    """Server-Sent Events for ``subscriber``, after replaying from ``last_event_id``.
+
+    The subscriber is taken with ``log.subscribe`` before the response starts,
+    so that a refused subscription can still be answered with its status.
+    """
+    types = subscriber.types
+    try:
+        yield "retry: 3000\n\n"
+        last = 0
+        if last_event_id:
+            replay = log.since(last_event_id)
+            if replay is None:
+                yield f"event: reset\ndata: {dumps({'stream': STREAM}).decode()}\n\n"
+            else:
+                for sequence, type, message in replay:
+                    if not types or type in types:
+                        yield message
+                    last = sequence
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), conf.EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            if event[0] > last:
+                yield event[2]
+    finally:
+        log.unsubscribe(subscriber)
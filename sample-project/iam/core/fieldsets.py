@@ -0,0 +1,35 @@
+from typing import Optional
+from functools import lru_cache
+from fastapi import Query
+
+
+def _to_dict(resource):
+    return resource.to_dict()
+
+@lru_cache(maxsize=256)
+def compile_projector(fields=()):
+    """Return a callable that turns a keystoneclient resource into a dict.
+
+    With no ``fields`` the full ``to_dict()`` is returned, otherwise only the
+    requested top-level keys are read from the resource, skipping the deep
+    copy ``to_dict()`` makes of the whole record.
+    """
+    if not fields:
+        return _to_dict
+
+    def projector(resource):
+        info = getattr(resource, '_info', resource)
+        return {k: info[k] for k in fields if k in info}
+
+    return projector
+
+def fieldset(
+    fields: Optional[str] = Query(
+        None,
+        description="Comma separated list of fields to return, e.g. `id,name`.",
+    )
+):
+    """Dependency resolving the ``fields`` query parameter to a projector."""
+    if not fields:
+        return compile_projector()
+    return compile_projector(tuple(sorted({f.strip() for f in fields.split(',') if f.strip()})))
@@ -0,0 +1,177 @@
+"""Index of the project tree.
+
+Projects are listed with the service credential (``KEYSTONE_SERVICE_*``)
+every ``HIERARCHY_REFRESH_INTERVAL`` and patched from the project events of
+this worker in between. Each project keeps its children and its ancestor
+path, so subtree and ancestry questions are answered without asking
+Keystone, and inherited role assignments are looked up on the known
+ancestors of a project directly.
+
+Top-level projects have their domain as parent, which is not listed as a
+project; it starts their paths.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+
+from iam import conf
+from iam.core import events
+from iam.core import keystone
+
+LOG = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ("id", "name", "domain_id", "parent_id", "enabled", "description")
+
+
+class ProjectTree:
+    def __init__(self):
+        self.projects = {}  # id -> summary
+        self.children = {}  # id -> set of ids
+        self.paths = {}     # id -> ancestor ids, root first
+        self.built_at = None
+
+    @classmethod
+    def build(cls, infos):
+        tree = cls()
+        for info in infos:
+            tree._insert(info)
+        for project_id in tree.projects:
+            tree._path(project_id)
+        tree.built_at = time.time()
+        return tree
+
+    def _insert(self, info):
+        summary = {field: info.get(field) for field in SUMMARY_FIELDS}
+        old = self.projects.get(summary["id"])
+        if old is not None and old["parent_id"] != summary["parent_id"]:
+            self.children.get(old["parent_id"], set()).discard(summary["id"])
+        self.projects[summary["id"]] = summary
+        if summary["parent_id"] is not None:
+            self.children.setdefault(summary["parent_id"], set()).add(summary["id"])
+
+    def _path(self, project_id):
+        # Keystone bounds the depth of trees (max_project_tree_depth), so
+        # the recursion is shallow.
+        path = self.paths.get(project_id)
+        if path is None:
+            parent_id = self.projects[project_id]["parent_id"]
+            if parent_id is None:
+                path = ()
+            elif parent_id in self.projects:
+                path = self._path(parent_id) + (parent_id,)
+            else:
+                path = (parent_id,)
+            self.paths[project_id] = path
+        return path
+
+    def add(self, info):
+        self._insert(info)
+        # A new parent moves the whole subtree.
+        moved = [info["id"]] + [project_id for project_id, _ in self.subtree(info["id"])]
+        for project_id in moved:
+            self.paths.pop(project_id, None)
+        for project_id in moved:
+            self._path(project_id)
+
+    def remove(self, project_id):
+        summary = self.projects.pop(project_id, None)
+        if summary is None:
+            return
+        self.children.get(summary["parent_id"], set()).discard(project_id)
+        self.paths.pop(project_id, None)
+        # Keystone only deletes leaves; should children be left anyway,
+        # their paths now start at the removed project.
+        orphans = [child for child, _ in self.subtree(project_id)]
+        for child in orphans:
+            self.paths.pop(child, None)
+        for child in orphans:
+            self._path(child)
+
+    def subtree(self, project_id, max_depth=None):
+        """``(id, depth)`` of the projects under ``project_id``, breadth first."""
+        found = []
+        queue = deque((child, 1) for child in sorted(self.children.get(project_id, ())))
+        while queue:
+            child, depth = queue.popleft()
+            found.append((child, depth))
+            if max_depth is None or depth < max_depth:
+                queue.extend((x, depth + 1) for x in sorted(self.children.get(child, ())))
+        return found
+
+    def ancestors(self, project_id):
+        return self.paths[project_id]
+
+    def contains(self, ancestor_id, project_id) -> bool:
+        """Whether ``project_id`` is ``ancestor_id`` or in its subtree."""
+        return project_id == ancestor_id or ancestor_id in self.paths.get(project_id, ())
+
+    def summary(self, project_id, **extra):
+        return dict(self.projects.get(project_id) or {"id": project_id}, **extra)
+
+    def snapshot(self):
+        return {
+            "built_at": self.built_at,
+            "projects": len(self.projects),
+            "max_depth": max(map(len, self.paths.values()), default=0),
+        }
+
+
+tree = None
+# Events seen while a rebuild lists Keystone, applied again to the new tree.
+_pending = None
+
+
+@events.listen
+def _on_event(type, action, data, resource):
+    if type != events.PROJECTS:
+        return
+    if _pending is not None:
+        _pending.append((action, data, resource))
+    if tree is not None:
+        _apply(tree, action, data, resource)
+
+def _apply(target, action, data, resource):
+    if action == events.DELETED:
+        target.remove(data["id"])
+    elif resource is not None:
+        target.add(resource.to_dict())
+
+def visible(user, project_id) -> bool:
+    """Whether ``user`` may see the ancestry and subtree of ``project_id``: with
+    one of ``HIERARCHY_ROLES``, or with a token scoped to it or one of its ancestors.
+
+    The tree is answered without Keystone, so only principals from a validated
+    token are trusted with their roles and scope.
+    """
+    if not user.validated:
+        return False
+    return user.has_role(*conf.HIERARCHY_ROLES) or (
+        user.project_id is not None and tree.contains(user.project_id, project_id))
+
+async def refresh():
+    global tree, _pending
+    _pending = []
+    try:
+        listing = await keystone.list_directory((events.PROJECTS,))
+        loop = asyncio.get_event_loop()
+        rebuilt = await loop.run_in_executor(None, ProjectTree.build, listing[events.PROJECTS])
+        for event in _pending:
+            _apply(rebuilt, *event)
+        tree = rebuilt
+    finally:
+        _pending = None
+    LOG.info("Project tree rebuilt with %d projects.", len(tree.projects))
+
+async def run_periodic(interval=conf.HIERARCHY_REFRESH_INTERVAL):
+    while True:
+        try:
+            await refresh()
+        except Exception as e:
+            LOG.warning("Unable to rebuild the project tree: %s", e)
+        await asyncio.sleep(interval)
+
+def snapshot():
+    if tree is None:
+        return {"built_at": None}
+    return tree.snapshot()
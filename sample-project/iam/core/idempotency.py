@@ -0,0 +1,112 @@
+"""``Idempotency-Key`` support for mutating routes.
+
+The first request with a given key runs; duplicates that arrive while it is
+in flight wait for it, and later duplicates get its stored response (with
+``Idempotency-Replayed: true``) until ``IDEMPOTENCY_TTL`` passes. Keys are
+scoped per user, method and path, and reusing a key for a different request
+body is rejected with 422.
+
+Responses with a 5xx status are handed to waiting duplicates but not
+stored, so a later retry runs again. If the first request never produces a
+response, one of the waiting duplicates runs instead.
+"""
+import time
+import asyncio
+import hashlib
+import secrets
+from fastapi import Request, HTTPException
+from fastapi.responses import Response
+
+from iam import conf
+from iam.core import cache
+from iam.core.responses import dumps
+
+METHODS = ("POST", "PUT", "PATCH", "DELETE")
+MAX_KEY_LENGTH = 255
+_HEADER = conf.IDEMPOTENCY_HEADER.lower().encode("latin-1")
+
+# key -> (fingerprint, status_code, body, headers)
+store = cache.TTLCache(maxsize=conf.IDEMPOTENCY_MAX_ENTRIES)
+# key -> (fingerprint, future of the first request's response)
+_inflight = {}
+# Fingerprints hash request bodies (passwords included) under a per-process key.
+_fingerprint_key = secrets.token_bytes(32)
+
+
+def _header(request: Request):
+    # Scanning the raw headers avoids the KeyError ``Headers.get`` raises
+    # internally for the common case of a request without the header.
+    for name, value in request.scope["headers"]:
+        if name == _HEADER:
+            return value.decode("latin-1")
+    return None
+
+def scope_key(request: Request):
+    """The scoped idempotency key of ``request``, or None when it has none."""
+    if not conf.IDEMPOTENCY_ENABLED or request.method not in METHODS:
+        return None
+    key = _header(request)
+    if not key:
+        return None
+    user = getattr(request.state, "user", None)
+    if user is None:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{conf.IDEMPOTENCY_HEADER} is too long.")
+    return (user.id, request.method, request.url.path, key)
+
+def fingerprint(arguments) -> str:
+    return hashlib.blake2b(dumps(arguments), digest_size=16, key=_fingerprint_key).hexdigest()
+
+def _mismatch():
+    return HTTPException(
+        status_code=422,
+        detail=f"{conf.IDEMPOTENCY_HEADER} was already used for a different request.",
+    )
+
+def _replay(stored):
+    _, status_code, body, headers = stored
+    response = Response(content=body, status_code=status_code, headers=headers)
+    response.headers["idempotency-replayed"] = "true"
+    return response
+
+def _snapshot(fingerprint, response):
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return (fingerprint, response.status_code, response.body, headers)
+
+async def once(key, fingerprint, respond):
+    """Return the response for ``key``, calling ``respond`` only for the first request."""
+    while True:
+        stored = store.get(key)
+        if stored is not None:
+            if stored[0] != fingerprint:
+                raise _mismatch()
+            return _replay(stored)
+
+        pending = _inflight.get(key)
+        if pending is None:
+            break
+        if pending[0] != fingerprint:
+            raise _mismatch()
+        try:
+            return _replay(await asyncio.shield(pending[1]))
+        except asyncio.CancelledError:
+            if not pending[1].cancelled():
+                raise
+            # The first request never finished (e.g. the client went away),
+            # so the next duplicate in line takes over.
+
+    future = asyncio.get_event_loop().create_future()
+    _inflight[key] = (fingerprint, future)
+    try:
+        response = await respond()
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        _inflight.pop(key, None)
+    snapshot = _snapshot(fingerprint, response)
+    if response.status_code < 500:
+        store.set(key, snapshot, time.time() + conf.IDEMPOTENCY_TTL)
+    future.set_result(snapshot)
+    return response
@@ -0,0 +1,379 @@
+"""Background jobs for operations that outlive a request.
+
+``submit`` records a job and returns it immediately; the work runs as an
+asyncio task on this worker, at most ``JOB_WORKERS`` at a time, with its own
+``JOB_TIMEOUT`` deadline and the submitting user's credentials. Handlers are
+registered per kind with ``handler`` and report progress through
+``JobContext.progress``, which is also where cancellation takes effect.
+
+Job records live in a ``JobStore``: ``memory`` (per worker) or ``sqlite``
+(``JOB_SQLITE_PATH``, shared by the workers of a host and kept across
+restarts), or another implementation given as ``package.module:Class``. Job
+parameters are never stored, so credentials in them (e.g. passwords of
+imported users) are not persisted; only a digest of the submitting token
+is, so that a job submitted with a principal from the identity header is
+only shown to requests carrying the same token. A job whose worker died,
+or that was started before the server restarted, is marked failed when the
+next worker starts.
+"""
+import os
+import abc
+import json
+import time
+import uuid
+import types
+import hashlib
+import asyncio
+import logging
+import sqlite3
+import importlib
+import threading
+from collections import OrderedDict
+
+from iam import conf
+from iam.core import deadline
+from iam.core.responses import dumps
+
+LOG = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE = (PENDING, RUNNING)
+
+# Progress is saved at most this often, except for the final update.
+PROGRESS_INTERVAL = 0.5
+
+# Identifies this run of the server: the workers forked by the launcher share
+# it, a restarted container (where pids start over) gets a new one.
+BOOT_ID = uuid.uuid4().hex
+
+handlers = {}
+
+
+def handler(kind):
+    """Register ``func(ctx, params)`` as the handler of ``kind`` jobs."""
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+class JobStore(abc.ABC):
+    """Interface of a job store. Jobs are plain dicts keyed by ``id``."""
+
+    @abc.abstractmethod
+    def save(self, job):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list(self, owner, limit=100):
+        """The most recent jobs of ``owner``, newest first."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def request_cancel(self, job_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def cancel_requested(self, job_id) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def active(self):
+        """Pending and running jobs, of any worker."""
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """Jobs of this worker only, dropping the oldest finished ones past ``max_jobs``."""
+
+    def __init__(self, max_jobs=conf.JOB_MAX_ENTRIES):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._cancel_requested = set()
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+            if len(self._jobs) > self.max_jobs:
+                for job_id in [i for i, j in self._jobs.items() if j["status"] not in ACTIVE]:
+                    if len(self._jobs) <= self.max_jobs:
+                        break
+                    del self._jobs[job_id]
+                    self._cancel_requested.discard(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self, owner, limit=100):
+        with self._lock:
+            jobs = [dict(j) for j in reversed(self._jobs.values()) if j["owner"] == owner]
+        return jobs[:limit]
+
+    def request_cancel(self, job_id):
+        self._cancel_requested.add(job_id)
+
+    def cancel_requested(self, job_id) -> bool:
+        return job_id in self._cancel_requested
+
+    def active(self):
+        with self._lock:
+            return [dict(j) for j in self._jobs.values() if j["status"] in ACTIVE]
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs in a local SQLite database, finished ones kept for ``JOB_RETENTION``."""
+
+    def __init__(self, path=conf.JOB_SQLITE_PATH, retention=conf.JOB_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._connect()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, owner TEXT, status TEXT, updated_at REAL,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0, data TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, updated_at)")
+        os.chmod(path, 0o600)
+        # A connection must not be used across a fork: workers forked from
+        # a preloaded process open their own.
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reconnect)
+
+    def _reconnect(self):
+        # The inherited connection is left open, closing it could disturb
+        # the parent's use of the database.
+        self._inherited = self._conn
+        self._connect()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            # cancel_requested is only ever set by ``request_cancel``, possibly
+            # from another worker, so saving must not overwrite it.
+            self._conn.execute(
+                "INSERT INTO jobs (id, owner, status, updated_at, data) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET"
+                " status = excluded.status, updated_at = excluded.updated_at, data = excluded.data",
+                (job["id"], job["owner"], job["status"], job["updated_at"], dumps(job).decode()))
+            if job["status"] not in ACTIVE:
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE updated_at < ? AND status NOT IN (?, ?)",
+                    (time.time() - self.retention, *ACTIVE))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, owner, limit=100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs WHERE owner = ? ORDER BY updated_at DESC LIMIT ?",
+                (owner, limit)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+    def cancel_requested(self, job_id) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def active(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs WHERE status IN (?, ?)", ACTIVE).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def _load_store(backend):
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore()
+    module_name, _, class_name = backend.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _worker_alive(boot_id, pid) -> bool:
+    if boot_id != BOOT_ID:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _token_digest(token):
+    return hashlib.sha256((token or "").encode()).hexdigest()
+
+def owned_by(job, user) -> bool:
+    """Whether ``job`` belongs to ``user``.
+
+    The user id of a principal taken from the identity header is whatever
+    the client sent, so for those the token the job was submitted with
+    must match as well.
+    """
+    if job["owner"] != user.id:
+        return False
+    return user.validated or job.get("token_digest") == _token_digest(user.token)
+
+def _public(job):
+    return {k: v for k, v in job.items() if k != "token_digest"}
+
+
+class JobRequest:
+    """Stand-in for the submitting request in the ``keystone`` calls of a job.
+
+    It carries the user (and so the token) of the request without keeping
+    the request itself alive.
+    """
+
+    def __init__(self, request):
+        self.state = types.SimpleNamespace(user=request.state.user)
+        self.client = request.client
+
+
+class JobContext:
+    """What a handler gets: the submitting user's ``request`` and progress reporting."""
+
+    def __init__(self, engine, job, request):
+        self.engine = engine
+        self.job = job
+        self.request = request
+        self._saved_at = 0.0
+
+    async def progress(self, done, total=None):
+        """Record progress; raises ``CancelledError`` once a cancel was requested."""
+        self.job["progress"] = {"done": done, "total": total}
+        now = time.time()
+        if now - self._saved_at >= PROGRESS_INTERVAL or done == total:
+            self._saved_at = self.job["updated_at"] = now
+            self.engine.store.save(self.job)
+            if self.engine.store.cancel_requested(self.job["id"]):
+                raise asyncio.CancelledError()
+        # Let other requests in between the steps of a long job.
+        await asyncio.sleep(0)
+
+
+class JobEngine:
+    def __init__(self, store, max_workers=conf.JOB_WORKERS):
+        self.store = store
+        self.max_workers = max_workers
+        self._tasks = {}
+        self._slots = None
+
+    @property
+    def slots(self):
+        # Created lazily so it binds to the running event loop.
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        return self._slots
+
+    def submit(self, kind, params, request):
+        """Record a ``kind`` job for the user of ``request`` and start it."""
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "owner": request.state.user.id,
+            "token_digest": _token_digest(request.state.user.token),
+            "status": PENDING,
+            "progress": {"done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "boot_id": BOOT_ID,
+            "worker": os.getpid(),
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.save(job)
+        self._tasks[job["id"]] = asyncio.ensure_future(
+            self._run(job, handlers[kind], params, JobRequest(request)))
+        return _public(job)
+
+    async def _run(self, job, func, params, request):
+        token = deadline.start(conf.JOB_TIMEOUT)
+        try:
+            async with self.slots:
+                job["status"] = RUNNING
+                job["updated_at"] = time.time()
+                self.store.save(job)
+                job["result"] = await func(JobContext(self, job, request), params)
+                job["status"] = SUCCEEDED
+        except asyncio.CancelledError:
+            job["status"] = CANCELLED
+        except Exception as e:
+            LOG.warning("Job %s (%s) failed: %s", job["id"], job["kind"], e)
+            job["status"] = FAILED
+            job["error"] = str(e)
+        finally:
+            deadline.reset(token)
+            job["updated_at"] = time.time()
+            self.store.save(job)
+            self._tasks.pop(job["id"], None)
+
+    def get(self, job_id, user):
+        job = self.store.get(job_id)
+        if job is None or not owned_by(job, user):
+            return None
+        return _public(job)
+
+    def list(self, user, limit=100):
+        """The most recent jobs of ``user``, newest first."""
+        return [_public(job) for job in self.store.list(user.id, limit) if owned_by(job, user)]
+
+    def cancel(self, job_id):
+        self.store.request_cancel(job_id)
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    def recover(self):
+        """Fail the unfinished jobs of workers that are gone."""
+        for job in self.store.active():
+            if not _worker_alive(job.get("boot_id"), job.get("worker")):
+                job["status"] = FAILED
+                job["error"] = "Interrupted by a worker restart."
+                job["updated_at"] = time.time()
+                self.store.save(job)
+
+    async def shutdown(self):
+        """Cancel the jobs of this worker and wait for them to record it."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self):
+        return {
+            "backend": type(self.store).__name__,
+            "max_workers": self.max_workers,
+            "running": len(self._tasks),
+        }
+
+
+engine = JobEngine(_load_store(conf.JOB_BACKEND))
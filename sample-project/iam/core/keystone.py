@@ -1,18 +1,63 @@
 import re
+import hmac
+import time
+import asyncio
+import hashlib
 import logging
+import iso8601
+import secrets
 import requests
-from functools import lru_cache
-from async_lru import alru_cache
+from functools import lru_cache, partial
+from requests.adapters import HTTPAdapter
 from keystoneauth1 import session, token_endpoint
-from keystoneauth1.identity import v3 as v3_auth
-from keystoneclient.v3 import client as v3_client
 from keystoneauth1 import exceptions as keystone_exceptions
 
 from iam import conf
 from iam import exceptions
+from iam.core import cache
+from iam.core import deadline
+from iam.core import events
+from iam.core import resilience
+from iam.core import snapshot
 
 LOG = logging.getLogger(__name__)
 
+# Scoped auth results of recent logins, see ``authenticate``.
+login_cache = cache.TTLCache(maxsize=conf.LOGIN_CACHE_MAX_ENTRIES)
+# Credentials are only ever kept as an HMAC under a per-process secret.
+_login_cache_secret = secrets.token_bytes(32)
+
+# Validated token info, persisted across restarts when snapshots are enabled.
+token_cache = snapshot.register("tokens", cache.TTLCache(maxsize=conf.TOKEN_CACHE_MAX_ENTRIES))
+# In-flight validations, so concurrent requests with one token share a call.
+_token_validations = {}
+
+# Role listings, which rarely change, per caller token, see ``_cached_list``.
+# Disabled unless RESOURCE_CACHE_TTL is set.
+resource_cache = snapshot.register("resources", cache.TTLCache(maxsize=conf.RESOURCE_CACHE_MAX_ENTRIES))
+
+# One connection pool for every Keystone session of this worker, so
+# connections are reused across requests and can be opened ahead of traffic.
+_http = requests.Session()
+for _prefix in ("http://", "https://"):
+    _http.mount(_prefix, HTTPAdapter(pool_connections=1, pool_maxsize=conf.KEYSTONE_POOL_SIZE))
+
+
+def _v3_auth():
+    from keystoneauth1.identity import v3
+    return v3
+
+def _v3_client():
+    # keystoneclient (through pkg_resources and oslo.utils) is the slowest
+    # import of the service, so it is loaded on first use, normally during
+    # warm-up, rather than when a worker starts.
+    from keystoneclient.v3 import client
+    return client
+
+def preload():
+    """Import the Keystone client libraries deferred at module import."""
+    _v3_auth()
+    _v3_client()
 
 def _get_session(**kwargs):
     insecure = conf.OPENSTACK_SSL_NO_VERIFY
@@ -21,7 +66,8 @@ def _get_session(**kwargs):
     if insecure:
         verify = False
 
-    return session.Session(verify=verify, **kwargs)
+    kwargs.setdefault('timeout', deadline.budget())
+    return session.Session(verify=verify, session=_http, **kwargs)
 
 async def _get_access_info(keystone_auth):
     """Get the access info from an unscoped auth
@@ -36,7 +82,7 @@ async def _get_access_info(keystone_auth):
     session = _get_session()
 
     try:
-        unscoped_auth_ref = keystone_auth.get_access(session)
+        unscoped_auth_ref = await resilience.call(resilience.AUTH, keystone_auth.get_access, session)
     except keystone_exceptions.ConnectFailure as exc:
         LOG.error(str(exc))
         msg = 'Unable to establish connection to keystone endpoint.'
@@ -64,12 +110,12 @@ async def _get_access_info(keystone_auth):
 
 def _get_token_auth_plugin(auth_url, token, project_id=None, domain_name=None):
     if domain_name:
-        return v3_auth.Token(auth_url=auth_url,
+        return _v3_auth().Token(auth_url=auth_url,
                              token=token,
                              domain_name=domain_name,
                              reauthenticate=False)
     else:
-        return v3_auth.Token(auth_url=auth_url,
+        return _v3_auth().Token(auth_url=auth_url,
                              token=token,
                              project_id=project_id,
                              reauthenticate=False)
@@ -90,7 +136,7 @@ async def _get_project_scoped_auth(unscoped_auth, unscoped_auth_ref, recent_proj
 
     def _list_projects(session, auth_plugin, auth_ref=None):
         try:
-            client = v3_client.Client(session=session, auth=auth_plugin)
+            client = _v3_client().Client(session=session, auth=auth_plugin)
             if auth_ref.is_federated:
                 return client.federation.projects.list()
             else:
@@ -101,7 +147,8 @@ async def _get_project_scoped_auth(unscoped_auth, unscoped_auth_ref, recent_proj
             msg = 'Unable to retrieve authorized projects.'
             raise exceptions.KeystoneRetrieveProjectsException(msg)
 
-    projects = _list_projects(session, unscoped_auth, unscoped_auth_ref)
+    projects = await resilience.call(
+        resilience.AUTH, _list_projects, session, unscoped_auth, unscoped_auth_ref)
     # Attempt to scope only to enabled projects
     projects = [project for project in projects if project.enabled]
 
@@ -120,7 +167,7 @@ async def _get_project_scoped_auth(unscoped_auth, unscoped_auth_ref, recent_proj
         token = unscoped_auth_ref.auth_token
         scoped_auth = _get_token_auth_plugin(auth_url, token=token, project_id=project.id)
         try:
-            scoped_auth_ref = scoped_auth.get_access(session)
+            scoped_auth_ref = await resilience.call(resilience.AUTH, scoped_auth.get_access, session)
             if recent_project and i > 0 and conf.OPENSTACK_OWNER_ROLE not in scoped_auth_ref.role_names:
                 continue
         except (keystone_exceptions.ClientException,
@@ -132,18 +179,45 @@ async def _get_project_scoped_auth(unscoped_auth, unscoped_auth_ref, recent_proj
 
     return scoped_auth, scoped_auth_ref
 
+def _login_cache_key(unscoped_token=None, username=None, password=None, project=None):
+    credentials = "\0".join(["token" if unscoped_token else "password",
+                             username or "", password or "", unscoped_token or ""])
+    digest = hmac.new(_login_cache_secret, credentials.encode(), hashlib.sha256).hexdigest()
+    return (username or None, project or None, digest)
+
+def invalidate_login_cache(user_id):
+    login_cache.invalidate_tag(user_id)
+
 async def authenticate(unscoped_token=None, username=None, password=None, **kwargs):
+    """Authenticate and scope a token, see ``_authenticate``.
+
+    With ``LOGIN_CACHE_ENABLED`` a scoped result is reused for the same
+    credentials and requested project while it still has at least
+    ``LOGIN_CACHE_MIN_TTL`` seconds of lifetime left.
+    """
+    if not conf.LOGIN_CACHE_ENABLED:
+        return (await _authenticate(unscoped_token, username, password, **kwargs))[0]
+
+    key = _login_cache_key(unscoped_token, username, password, kwargs.get('project'))
+    result = login_cache.get(key, min_ttl=conf.LOGIN_CACHE_MIN_TTL)
+    if result is not None:
+        return dict(result)
+    result, user_id, expires_at = await _authenticate(unscoped_token, username, password, **kwargs)
+    login_cache.set(key, dict(result), expires_at, tag=user_id)
+    return result
+
+async def _authenticate(unscoped_token=None, username=None, password=None, **kwargs):
     auth_url = conf.OPENSTACK_KEYSTONE_URL
     default_domain = conf.OPENSTACK_KEYSTONE_DEFAULT_DOMAIN
 
     if unscoped_token:
-        unscoped_auth = v3_auth.Token(
+        unscoped_auth = _v3_auth().Token(
             auth_url=auth_url,
             token=unscoped_token,
             reauthenticate=False,
         )
     else:
-        unscoped_auth = v3_auth.Password(
+        unscoped_auth = _v3_auth().Password(
             auth_url=auth_url,
             username=username,
             password=password,
@@ -157,25 +231,58 @@ async def authenticate(unscoped_token=None, username=None, password=None, **kwar
         unscoped_auth_ref = await _get_access_info(unscoped_auth)
         scoped_auth, scoped_auth_ref = await _get_project_scoped_auth(
             unscoped_auth, unscoped_auth_ref, recent_project=recent_project)
-    except:
+    except (exceptions.ServiceUnavailableException,
+            exceptions.DeadlineExceededException):
+        # Keystone being unavailable or too slow for the request's deadline
+        # says nothing about the credentials: keep the 503 / 504.
+        raise
+    except Exception:
         msg = 'Invalid Username or Password.'
         raise exceptions.KeystoneAuthException(msg)
 
-    return {'scoped_token': scoped_auth_ref.auth_token, 'unscoped_token': unscoped_auth_ref.auth_token}
+    result = {'scoped_token': scoped_auth_ref.auth_token, 'unscoped_token': unscoped_auth_ref.auth_token}
+    expires_at = min(scoped_auth_ref.expires.timestamp(), unscoped_auth_ref.expires.timestamp())
+    return result, unscoped_auth_ref.user_id, expires_at
+
+def _fetch_token(url, headers, timeout):
+    response = _http.get(url, headers=headers, timeout=timeout)
+    if response.status_code >= 500:
+        # Surface (and retry) Keystone errors instead of caching them as an
+        # invalid token.
+        response.raise_for_status()
+    return response
+
+def token_cache_expiry(token_info) -> float:
+    """Until when anything derived from ``token_info`` may be cached."""
+    expires_at = time.time() + conf.TOKEN_CACHE_TTL
+    if token_info.get('expires_at'):
+        expires_at = min(expires_at, iso8601.parse_date(token_info['expires_at']).timestamp())
+    return expires_at
 
-@alru_cache
 async def token_validate(token):
+    result = token_cache.get(token)
+    if result is not None:
+        return result
+    pending = _token_validations.get(token)
+    if pending is None:
+        pending = _token_validations[token] = asyncio.ensure_future(_token_validate(token))
+        pending.add_done_callback(lambda _: _token_validations.pop(token, None))
+    return await asyncio.shield(pending)
+
+async def _token_validate(token):
     url = f"{conf.OPENSTACK_KEYSTONE_URL}/auth/tokens"
     headers = {
         "X-Auth-Token": token,
         "X-Subject-Token": token
     }
-    response = requests.get(url, headers=headers)
+    response = await resilience.call(resilience.VALIDATE, _fetch_token, url, headers,
+                                     timeout=deadline.budget())
     if response.ok:
         result = response.json().get('token')
         for field in ('methods', 'audit_ids', 'catalog'):
             result.pop(field, None)
         result['token'] = token
+        token_cache.set(token, result, token_cache_expiry(result))
         return result
 
 @lru_cache
@@ -193,11 +300,66 @@ def get_client(request):
         verify = verify and cacert
         remote_addr = request.client.host
         token_auth = token_endpoint.Token(endpoint=auth_url, token=token_id)
-        keystone_session = session.Session(auth=token_auth, original_ip=remote_addr, verify=verify)
-        conn = v3_client.Client(session=keystone_session, debug=conf.DEBUG)
+        keystone_session = session.Session(auth=token_auth, original_ip=remote_addr, verify=verify,
+                                           timeout=deadline.budget(), session=_http)
+        conn = _v3_client().Client(session=keystone_session, debug=conf.DEBUG)
         setattr(request, cache_attr, conn)
     return conn
 
+async def open_connections(count=conf.WARMUP_CONNECTIONS):
+    """Open up to ``count`` pooled connections to Keystone ahead of traffic."""
+    loop = asyncio.get_event_loop()
+    fetch = partial(_get_session().get, conf.OPENSTACK_KEYSTONE_URL, authenticated=False, raise_exc=False)
+    # Concurrent requests each need their own connection, which then stays
+    # in the pool.
+    await asyncio.gather(*(loop.run_in_executor(None, fetch) for _ in range(count)))
+
+def _service_client():
+    default_domain = conf.OPENSTACK_KEYSTONE_DEFAULT_DOMAIN
+    auth = _v3_auth().Password(
+        auth_url=conf.OPENSTACK_KEYSTONE_URL,
+        username=conf.KEYSTONE_SERVICE_USERNAME,
+        password=conf.KEYSTONE_SERVICE_PASSWORD,
+        user_domain_name=default_domain,
+        project_name=conf.KEYSTONE_SERVICE_PROJECT,
+        project_domain_name=default_domain,
+    )
+    return _v3_client().Client(session=_get_session(auth=auth))
+
+async def _cached_list(request, manager, name, **kwargs):
+    """List a whole collection, served from ``resource_cache`` when enabled.
+
+    Only unfiltered listings are cached, and only for the caller's own
+    token: Keystone policy decides who may list a collection, so one
+    caller's listing is never served to another.
+    """
+    if conf.RESOURCE_CACHE_TTL <= 0:
+        return await resilience.call(resilience.READ, manager.list, **kwargs)
+    key = (name, hashlib.sha256(request.state.user.token.encode()).hexdigest())
+    infos = resource_cache.get(key)
+    if infos is not None:
+        return [manager.resource_class(manager, dict(info), loaded=True) for info in infos]
+    resources = await resilience.call(resilience.READ, manager.list, **kwargs)
+    resource_cache.set(key, [r._info for r in resources],
+                       time.time() + conf.RESOURCE_CACHE_TTL, tag=name)
+    return resources
+
+def _id(resource):
+    return getattr(resource, 'id', resource)
+
+def _assignment(role, project, user, group, domain):
+    assignment = {'role': _id(role), 'user': _id(user), 'group': _id(group),
+                  'project': _id(project), 'domain': _id(domain)}
+    return {k: v for k, v in assignment.items() if v is not None}
+
+async def list_directory(types=(events.USERS, events.GROUPS, events.PROJECTS)):
+    """Every user, group and/or project, listed with the service credential."""
+    client = _service_client()
+    managers = {events.USERS: client.users, events.GROUPS: client.groups, events.PROJECTS: client.projects}
+    listings = await asyncio.gather(*(
+        resilience.call(resilience.READ, managers[type].list) for type in types))
+    return {type: [x._info for x in listing] for type, listing in zip(types, listings)}
+
 async def tenant_list(request, domain=None, user=None, filters=None):
     client = get_client(request)
     manager = client.projects
@@ -208,33 +370,39 @@ async def tenant_list(request, domain=None, user=None, filters=None):
     }
     if filters is not None:
         kwargs.update(filters)
-    tenants = manager.list(**kwargs)
+    tenants = await resilience.call(resilience.READ, manager.list, **kwargs)
     return tenants
 
 async def tenant_create(request, name, description=None, enabled=None,
                   domain=None, **kwargs):
     client = get_client(request)
     manager = client.projects
-    return manager.create(name, domain,
-                            description=description,
-                            enabled=enabled, **kwargs)
+    project = await resilience.call(resilience.WRITE, manager.create, name, domain,
+                                    description=description,
+                                    enabled=enabled, **kwargs)
+    events.publish(events.PROJECTS, events.CREATED, project, id=project.id)
+    return project
 
-async def tenant_get(request, project):
+async def tenant_get(request, project, **kwargs):
     client = get_client(request)
     manager = client.projects
-    return manager.get(project)
+    return await resilience.call(resilience.READ, manager.get, project, **kwargs)
 
 async def tenant_update(request, project, name=None, description=None,
                   enabled=None, domain=None, **kwargs):
     client = get_client(request)
     manager = client.projects
-    return manager.update(project, name=name, description=description,
-                            enabled=enabled, domain=domain, **kwargs)
+    result = await resilience.call(resilience.WRITE, manager.update, project, name=name,
+                                   description=description, enabled=enabled,
+                                   domain=domain, **kwargs)
+    events.publish(events.PROJECTS, events.UPDATED, result, id=_id(project))
+    return result
 
 async def tenant_delete(request, project):
     client = get_client(request)
     manager = client.projects
-    manager.delete(project)
+    await resilience.call(resilience.WRITE, manager.delete, project)
+    events.publish(events.PROJECTS, events.DELETED, id=_id(project))
 
 async def user_list(request, project=None, domain=None, group=None, filters=None):
     client = get_client(request)
@@ -246,32 +414,42 @@ async def user_list(request, project=None, domain=None, group=None, filters=None
     }
     if filters is not None:
         kwargs.update(filters)
-    return manager.list(**kwargs)
+    return await resilience.call(resilience.READ, manager.list, **kwargs)
 
 async def user_create(request, name=None, email=None, password=None, project=None,
                 enabled=None, domain=None, description=None, **data):
     client = get_client(request)
     manager = client.users
-    user = manager.create(name, password=password, email=email,
-                            default_project=project, enabled=enabled,
-                            domain=domain, description=description,
-                            **data)
+    user = await resilience.call(resilience.WRITE, manager.create, name,
+                                 password=password, email=email,
+                                 default_project=project, enabled=enabled,
+                                 domain=domain, description=description,
+                                 **data)
+    events.publish(events.USERS, events.CREATED, user, id=user.id)
     return user
 
 async def user_get(request, user_id):
     client = get_client(request)
     manager = client.users
-    return manager.get(user_id)
+    return await resilience.call(resilience.READ, manager.get, user_id)
 
 async def user_update(request, user, **data):
     client = get_client(request)
     manager = client.users
-    return manager.update(user, **data)
+    result = await resilience.call(resilience.WRITE, manager.update, user, **data)
+    # A cached login must not outlive the password it was made with, nor
+    # the user being disabled.
+    if data.get('password') or ('enabled' in data and not data['enabled']):
+        invalidate_login_cache(_id(user))
+    events.publish(events.USERS, events.UPDATED, result, id=_id(user))
+    return result
 
 async def user_delete(request, user_id):
     client = get_client(request)
     manager = client.users
-    manager.delete(user_id)
+    await resilience.call(resilience.WRITE, manager.delete, user_id)
+    invalidate_login_cache(user_id)
+    events.publish(events.USERS, events.DELETED, id=_id(user_id))
 
 async def group_list(request, domain=None, project=None, user=None, filters=None):
     client = get_client(request)
@@ -285,7 +463,7 @@ async def group_list(request, domain=None, project=None, user=None, filters=None
     if filters is not None:
         kwargs.update(filters)
     
-    groups = manager.list(**kwargs)
+    groups = await resilience.call(resilience.READ, manager.list, **kwargs)
 
     if project:
         project_groups = []
@@ -299,36 +477,46 @@ async def group_list(request, domain=None, project=None, user=None, filters=None
 async def group_create(request, name, description=None, domain=None):
     client = get_client(request)
     manager = client.groups
-    return manager.create(name=name,
-                            description=description,
-                            domain=domain)
+    group = await resilience.call(resilience.WRITE, manager.create, name=name,
+                                  description=description,
+                                  domain=domain)
+    events.publish(events.GROUPS, events.CREATED, group, id=group.id)
+    return group
 
 async def group_get(request, group_id, admin=True):
     client = get_client(request)
     manager = client.groups
-    return manager.get(group_id)
+    return await resilience.call(resilience.READ, manager.get, group_id)
 
 async def group_update(request, group_id, name=None, description=None):
     client = get_client(request)
     manager = client.groups
-    return manager.update(group=group_id,
-                            name=name,
-                            description=description)
+    group = await resilience.call(resilience.WRITE, manager.update, group=group_id,
+                                  name=name,
+                                  description=description)
+    events.publish(events.GROUPS, events.UPDATED, group, id=_id(group_id))
+    return group
     
 async def group_delete(request, group_id):
     client = get_client(request)
     manager = client.groups
-    return manager.delete(group_id)
+    result = await resilience.call(resilience.WRITE, manager.delete, group_id)
+    events.publish(events.GROUPS, events.DELETED, id=_id(group_id))
+    return result
 
 async def group_add_user(request, group, user):
     client = get_client(request)
     manager = client.users
-    return manager.add_to_group(group=group, user=user)
+    result = await resilience.call(resilience.WRITE, manager.add_to_group, group=group, user=user)
+    events.publish(events.GROUP_MEMBERSHIPS, events.CREATED, group=_id(group), user=_id(user))
+    return result
 
 async def group_remove_user(request, group, user):
     client = get_client(request)
     manager = client.users
-    return manager.remove_from_group(group=group, user=user)
+    result = await resilience.call(resilience.WRITE, manager.remove_from_group, group=group, user=user)
+    events.publish(events.GROUP_MEMBERSHIPS, events.DELETED, group=_id(group), user=_id(user))
+    return result
 
 async def role_list(request, filters=None):
     client = get_client(request)
@@ -337,27 +525,37 @@ async def role_list(request, filters=None):
     kwargs = {}
     if filters is not None:
         kwargs.update(filters)
-    return manager.list(**kwargs)
+    if not kwargs:
+        return await _cached_list(request, manager, "roles")
+    return await resilience.call(resilience.READ, manager.list, **kwargs)
 
 async def role_create(request, name):
     client = get_client(request)
     manager = client.roles
-    return manager.create(name)
+    role = await resilience.call(resilience.WRITE, manager.create, name)
+    resource_cache.invalidate_tag("roles")
+    events.publish(events.ROLES, events.CREATED, id=role.id)
+    return role
 
 async def role_get(request, role_id):
     client = get_client(request)
     manager = client.roles
-    return manager.get(role_id)
+    return await resilience.call(resilience.READ, manager.get, role_id)
 
 async def role_update(request, role_id, name=None):
     client = get_client(request)
     manager = client.roles
-    return manager.update(role_id, name)
+    role = await resilience.call(resilience.WRITE, manager.update, role_id, name)
+    resource_cache.invalidate_tag("roles")
+    events.publish(events.ROLES, events.UPDATED, id=_id(role_id))
+    return role
 
 async def role_delete(request, role_id):
     client = get_client(request)
     manager = client.roles
-    manager.delete(role_id)
+    await resilience.call(resilience.WRITE, manager.delete, role_id)
+    resource_cache.invalidate_tag("roles")
+    events.publish(events.ROLES, events.DELETED, id=_id(role_id))
 
 async def role_assignments_list(request, project=None, user=None, role=None,
                           group=None, domain=None, effective=False,
@@ -366,22 +564,39 @@ async def role_assignments_list(request, project=None, user=None, role=None,
     manager = client.role_assignments
     if include_subtree:
         domain = None
-    return manager.list(project=project, user=user, role=role, group=group,
-                        domain=domain, effective=effective,
-                        include_subtree=include_subtree,
-                        include_names=include_names)
+    return await resilience.call(resilience.READ, manager.list, project=project, user=user,
+                                 role=role, group=group, domain=domain,
+                                 effective=effective,
+                                 include_subtree=include_subtree,
+                                 include_names=include_names)
+
+async def inherited_role_assignments(request, projects=(), domains=(), user=None, group=None):
+    """Assignments inherited to the subtrees of ``projects`` and ``domains``, listed
+    concurrently, as ``(assignment, project or domain id)``."""
+    client = get_client(request)
+    manager = client.role_assignments
+    sources = [('project', x) for x in projects] + [('domain', x) for x in domains]
+    listings = await asyncio.gather(*(
+        resilience.call(resilience.READ, manager.list, user=user, group=group,
+                        os_inherit_extension_inherited_to='projects', **{kind: source})
+        for kind, source in sources))
+    return [(assignment, source) for (_, source), listing in zip(sources, listings)
+            for assignment in listing]
 
 async def role_assignment_create(request, role, project=None, user=None,
                          group=None, domain=None):
     client = get_client(request)
     manager = client.roles
-    manager.grant(role, user=user, project=project,
-                  group=group, domain=domain)
+    await resilience.call(resilience.WRITE, manager.grant, role, user=user,
+                          project=project, group=group, domain=domain)
+    events.publish(events.ROLE_ASSIGNMENTS, events.CREATED, **_assignment(role, project, user, group, domain))
 
 async def role_assignment_delete(request, role, project=None, user=None,
                             group=None, domain=None):
     client = get_client(request)
     manager = client.roles
-    return manager.revoke(role, user=user, project=project,
-                          group=group, domain=domain)
+    result = await resilience.call(resilience.WRITE, manager.revoke, role, user=user,
+                                   project=project, group=group, domain=domain)
+    events.publish(events.ROLE_ASSIGNMENTS, events.DELETED, **_assignment(role, project, user, group, domain))
+    return result
     
@@ -0,0 +1,122 @@
+"""OpenAPI schema, built once per worker and served from memory.
+
+The schema is generated during warm-up, or loaded from an artifact written
+at build time with::
+
+    python -m iam.core.openapi /app/openapi.json
+
+and pointed to by ``OPENAPI_SCHEMA_PATH``, so workers skip generation
+entirely. The schema carries a fingerprint of the routes and of the
+configuration it depends on (``WEBROOT``, auth headers); an artifact whose
+fingerprint differs from the running application's is ignored and the
+schema generated instead. Either way the schema is serialized
+once and served with an ETag; the compression middleware caches its
+encoded forms under that ETag.
+"""
+import os
+import sys
+import json
+import hashlib
+import inspect
+import logging
+from typing import NamedTuple
+from fastapi import FastAPI, Request, Response
+from fastapi.openapi.utils import get_openapi
+
+from iam import conf
+from iam.core import responses
+
+LOG = logging.getLogger(__name__)
+
+# Schema extension holding the fingerprint of what it was generated from.
+FINGERPRINT_KEY = "x-iam-fingerprint"
+
+
+class Document(NamedTuple):
+    schema: dict
+    body: bytes
+    etag: str
+
+
+def fingerprint(app: FastAPI) -> str:
+    """Hash of the documented routes of ``app`` and of the settings the schema uses."""
+    parts = [conf.APP_NAME, conf.AUTHENTICATION_HEADER, conf.IDENTITY_HEADER]
+    for route in app.routes:
+        if not getattr(route, "include_in_schema", False):
+            continue
+        endpoint = getattr(route, "endpoint", None)
+        parts.append("|".join([
+            route.path,
+            ",".join(sorted(getattr(route, "methods", None) or ())),
+            getattr(route, "name", ""),
+            str(inspect.signature(endpoint)) if endpoint else "",
+            (endpoint.__doc__ or "") if endpoint else "",
+        ]))
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+def generate(app: FastAPI) -> dict:
+    openapi_schema = get_openapi(
+        title=conf.APP_NAME,
+        version="1.0.0",
+        description="",
+        routes=app.routes,
+    )
+    openapi_schema["components"] = openapi_schema.get("components") or {}
+    openapi_schema["components"]["securitySchemes"] = {
+        "AuthToken": {
+            "type": "apiKey",
+            "in": "header",
+            "name": conf.AUTHENTICATION_HEADER
+        },
+        "Identity": {
+            "type": "apiKey",
+            "in": "header",
+            "name": conf.IDENTITY_HEADER
+        }
+    }
+    security = [{"AuthToken": []}, {"Identity": []}]
+    for path in openapi_schema["paths"].values():
+        for method in path.values():
+            method["security"] = security
+    openapi_schema[FINGERPRINT_KEY] = fingerprint(app)
+    return openapi_schema
+
+def _load_artifact(path, app):
+    try:
+        with open(path, "rb") as f:
+            body = f.read()
+        schema = json.loads(body)
+    except (OSError, ValueError) as e:
+        LOG.warning("Unable to load OpenAPI schema from %s, generating it: %s", path, e)
+        return None, None
+    if schema.get(FINGERPRINT_KEY) != fingerprint(app):
+        LOG.warning("OpenAPI schema in %s does not match the running routes, generating it.", path)
+        return None, None
+    return schema, body
+
+def document(app: FastAPI) -> Document:
+    """The schema of ``app`` with its serialized body and ETag, built once."""
+    doc = getattr(app.state, "openapi_document", None)
+    if doc is None:
+        schema = body = None
+        if conf.OPENAPI_SCHEMA_PATH:
+            schema, body = _load_artifact(conf.OPENAPI_SCHEMA_PATH, app)
+        if schema is None:
+            schema = generate(app)
+            body = responses.dumps(schema)
+        doc = app.state.openapi_document = Document(schema, body, responses.compute_etag(body))
+        app.openapi_schema = schema
+    return doc
+
+def response(app: FastAPI, request: Request) -> Response:
+    doc = document(app)
+    return responses.conditional(
+        request, Response(content=doc.body, media_type="application/json"), etag=doc.etag, public=True)
+
+
+if __name__ == '__main__':
+    from iam.main import app
+    path = sys.argv[1] if len(sys.argv) > 1 else "openapi.json"
+    with open(path, "wb") as f:
+        f.write(responses.dumps(generate(app)))
+    print(f"Wrote OpenAPI schema to {path}")
@@ -0,0 +1,402 @@
+"""On-demand sampling profiler for slow requests.
+
+Off until turned on with ``PUT /profiler`` (one of ``PROFILER_ROLES``), and
+then only for the ``duration`` given. While on, requests are tracked and a
+background thread samples, every ``interval_ms``, the stack of each tracked
+request: the chain of coroutines its task is awaiting, continued with the
+live frames of the event loop thread when the task is the one running, or
+with the frames of the executor threads running Keystone calls for it.
+Sampling awaits rather than CPU alone makes waiting show up, which is where
+the latency of this service usually goes.
+
+The samples of a request are kept under its ``request_id`` when it took at
+least ``threshold_ms`` or was one of every ``sample_every`` requests, and
+are served as collapsed stacks (``frame;frame;frame count`` lines), which
+flamegraph.pl, speedscope and most flame graph viewers take as input.
+
+Settings and profiles live in a ``ProfileStore``: ``memory`` (per worker)
+or ``sqlite`` (``PROFILER_SQLITE_PATH``, shared by the workers of a host,
+which pick up new settings within ``POLL_INTERVAL``), or another
+implementation given as ``package.module:Class``.
+"""
+import os
+import abc
+import sys
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import importlib
+import itertools
+import threading
+import contextvars
+from collections import Counter, OrderedDict, defaultdict
+
+from iam import conf
+from iam.core.responses import dumps
+
+LOG = logging.getLogger(__name__)
+
+# How often workers read the settings from the store.
+POLL_INTERVAL = 1
+
+_current = contextvars.ContextVar("iam.profile", default=None)
+_labels = {}  # code object -> frame label
+
+
+def _short_path(filename):
+    prefixes = [p for p in sys.path if p and filename.startswith(p.rstrip(os.sep) + os.sep)]
+    if not prefixes:
+        return filename
+    return filename[len(max(prefixes, key=len).rstrip(os.sep)) + 1:]
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+def _await_chain(coro):
+    """Frames of ``coro`` and of what it is awaiting, outermost first."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+def _thread_stack(frame, stop):
+    """Frames from the one running ``stop``'s code down to ``frame``, outermost first."""
+    frames = []
+    while frame is not None and frame.f_code is not stop:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class Profile:
+    def __init__(self, request_id, method, path, task, root, sampled):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.task = task
+        self.root = root
+        self.sampled = sampled
+        self.discarded = False
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.samples = Counter()
+        self.token = None
+
+    def to_dict(self, status_code, duration_ms, interval_ms):
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "duration_ms": duration_ms,
+            "started_at": self.started_at,
+            "worker": os.getpid(),
+            "interval_ms": interval_ms,
+            "samples": sum(self.samples.values()),
+            "stacks": dict(self.samples),
+        }
+
+
+class _Bound:
+    """A function run in an executor thread on behalf of a profiled request."""
+    __slots__ = ("func", "profile")
+
+    def __init__(self, func, profile):
+        self.func = func
+        self.profile = profile
+
+    def __call__(self):
+        thread_id = threading.get_ident()
+        sampler.threads[thread_id] = self.profile
+        try:
+            return self.func()
+        finally:
+            sampler.threads.pop(thread_id, None)
+
+_BOUND_CODE = _Bound.__call__.__code__
+
+
+class Sampler:
+    def __init__(self):
+        self.profiles = set()
+        self.threads = {}  # thread id -> Profile
+        self.loop_thread = None
+        self.interval = conf.PROFILER_INTERVAL_MS / 1000
+        self._stopped = None
+
+    def start(self, interval):
+        self.interval = interval
+        if self._stopped is None:
+            # Each thread has its own event, so that one stopping cannot
+            # miss it by a new one starting.
+            self._stopped = threading.Event()
+            threading.Thread(target=self._run, args=(self._stopped,), name="iam-profiler", daemon=True).start()
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+            self._stopped = None
+
+    def _run(self, stopped):
+        while not stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                LOG.warning("Profiler sample failed: %s", e)
+
+    def sample(self):
+        frames = sys._current_frames()
+        working = defaultdict(list)
+        for thread_id, profile in list(self.threads.items()):
+            working[profile].append(thread_id)
+        loop_stack = _thread_stack(frames.get(self.loop_thread), None)
+        loop_index = {id(frame): i for i, frame in enumerate(loop_stack)}
+
+        for profile in list(self.profiles):
+            chain = _await_chain(profile.task.get_coro())
+            if not chain:
+                continue
+            # A running coroutine shows no awaits, the loop thread's frames
+            # continue the chain from the outermost one.
+            running = loop_index.get(id(chain[-1]))
+            if running is not None:
+                chain += loop_stack[running + 1:]
+            for i, frame in enumerate(chain):
+                if frame is profile.root:
+                    chain = chain[i:]
+                    break
+            stack = ";".join(_label(frame.f_code) for frame in chain)
+            if running is not None or not working[profile]:
+                profile.samples[stack] += 1
+            for thread_id in working[profile]:
+                thread_frames = _thread_stack(frames.get(thread_id), _BOUND_CODE)
+                profile.samples[";".join([stack] + [_label(f.f_code) for f in thread_frames])] += 1
+
+
+class ProfileStore(abc.ABC):
+    """Interface of a profile store. Profiles are plain dicts keyed by ``request_id``."""
+
+    @abc.abstractmethod
+    def save(self, profile):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, request_id):
+        """The latest profile of ``request_id``, or None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list(self, limit=100):
+        """The latest profiles, newest first, without their stacks."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def settings(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_settings(self, settings):
+        raise NotImplementedError
+
+
+class MemoryProfileStore(ProfileStore):
+    """Profiles of this worker only, the latest ``max_profiles`` of them."""
+
+    def __init__(self, max_profiles=conf.PROFILER_MAX_PROFILES):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._settings = None
+
+    def save(self, profile):
+        self._profiles.pop(profile["request_id"], None)
+        self._profiles[profile["request_id"]] = profile
+        while len(self._profiles) > self.max_profiles:
+            self._profiles.popitem(last=False)
+
+    def get(self, request_id):
+        return self._profiles.get(request_id)
+
+    def list(self, limit=100):
+        profiles = list(reversed(self._profiles.values()))[:limit]
+        return [{k: v for k, v in p.items() if k != "stacks"} for p in profiles]
+
+    def settings(self):
+        return self._settings
+
+    def save_settings(self, settings):
+        self._settings = dict(settings)
+
+
+class SQLiteProfileStore(ProfileStore):
+    """Settings and the latest ``max_profiles`` profiles in a local SQLite database."""
+
+    def __init__(self, path=conf.PROFILER_SQLITE_PATH, max_profiles=conf.PROFILER_MAX_PROFILES):
+        self.path = path
+        self.max_profiles = max_profiles
+        self._connect()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS profiles ("
+                " request_id TEXT PRIMARY KEY, created_at REAL, summary TEXT, stacks TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS profiles_created ON profiles (created_at)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY, data TEXT)")
+        os.chmod(path, 0o600)
+        # As for the job store, workers forked from a preloaded process
+        # open their own connection.
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reconnect)
+
+    def _reconnect(self):
+        self._inherited = self._conn
+        self._connect()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+
+    def save(self, profile):
+        summary = {k: v for k, v in profile.items() if k != "stacks"}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO profiles (request_id, created_at, summary, stacks) VALUES (?, ?, ?, ?)",
+                (profile["request_id"], time.time(), dumps(summary).decode(), dumps(profile["stacks"]).decode()))
+            self._conn.execute(
+                "DELETE FROM profiles WHERE request_id NOT IN"
+                " (SELECT request_id FROM profiles ORDER BY created_at DESC LIMIT ?)", (self.max_profiles,))
+
+    def get(self, request_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, stacks FROM profiles WHERE request_id = ?", (request_id,)).fetchone()
+        return dict(json.loads(row[0]), stacks=json.loads(row[1])) if row else None
+
+    def list(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT summary FROM profiles ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def settings(self):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM settings WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_settings(self, settings):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO settings (id, data) VALUES (1, ?)",
+                               (dumps(settings).decode(),))
+
+
+def _load_store(backend):
+    if backend == "memory":
+        return MemoryProfileStore()
+    if backend == "sqlite":
+        return SQLiteProfileStore()
+    module_name, _, class_name = backend.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+sampler = Sampler()
+store = _load_store(conf.PROFILER_BACKEND)
+settings = {
+    "enabled": False,
+    "threshold_ms": conf.PROFILER_THRESHOLD_MS,
+    "sample_every": conf.PROFILER_SAMPLE_EVERY,
+    "interval_ms": conf.PROFILER_INTERVAL_MS,
+    "until": 0,
+}
+_requests = itertools.count(1)
+
+
+def active() -> bool:
+    return settings["enabled"] and time.time() < settings["until"]
+
+def apply(new):
+    """Make ``new`` the settings of this worker, starting or stopping sampling."""
+    global settings
+    settings = new
+    if active():
+        sampler.start(settings["interval_ms"] / 1000)
+    else:
+        sampler.stop()
+
+def configure(enabled, threshold_ms, sample_every, interval_ms, duration):
+    """Turn profiling on for ``duration`` seconds, or off, on every worker sharing the store."""
+    new = {
+        "enabled": enabled,
+        "threshold_ms": threshold_ms,
+        "sample_every": sample_every,
+        "interval_ms": interval_ms,
+        "until": time.time() + duration if enabled else 0,
+    }
+    store.save_settings(new)
+    apply(new)
+    return new
+
+async def run_periodic(interval=POLL_INTERVAL):
+    while True:
+        try:
+            stored = store.settings()
+            if stored is not None and stored != settings:
+                apply(stored)
+            elif not active():
+                sampler.stop()
+        except Exception as e:
+            LOG.warning("Unable to read the profiler settings: %s", e)
+        await asyncio.sleep(interval)
+
+def begin(scope):
+    """Track the request of ``scope`` if it may be kept; called by the
+    middleware, whose frame roots the sampled stacks."""
+    sampled = settings["sample_every"] > 0 and next(_requests) % settings["sample_every"] == 0
+    if not sampled and settings["threshold_ms"] <= 0:
+        return None
+    if len(sampler.profiles) >= conf.PROFILER_MAX_ACTIVE:
+        return None
+    profile = Profile(scope.get("state", {}).get("request_id"), scope["method"], scope["path"],
+                      asyncio.current_task(), sys._getframe(1), sampled)
+    profile.token = _current.set(profile)
+    sampler.loop_thread = threading.get_ident()
+    sampler.profiles.add(profile)
+    return profile
+
+def discard(profile):
+    """Stop tracking ``profile`` and never keep it."""
+    profile.discarded = True
+    sampler.profiles.discard(profile)
+
+def end(profile, status_code):
+    sampler.profiles.discard(profile)
+    _current.reset(profile.token)
+    duration_ms = round((time.perf_counter() - profile.started) * 1000, 1)
+    if profile.discarded or not profile.samples or profile.request_id is None:
+        return
+    if profile.sampled or (settings["threshold_ms"] > 0 and duration_ms >= settings["threshold_ms"]):
+        store.save(profile.to_dict(status_code, duration_ms, settings["interval_ms"]))
+
+def bind(func):
+    """``func``, attributing its samples to the profiled request it runs for,
+    if any, when it is run in another thread."""
+    profile = _current.get()
+    if profile is None:
+        return func
+    return _Bound(func, profile)
+
+def collapsed(profile) -> str:
+    """The stacks of ``profile`` as collapsed stack lines."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(profile["stacks"].items()))
+
+def snapshot():
+    return dict(settings, active=active(), backend=type(store).__name__, tracked=len(sampler.profiles))
@@ -0,0 +1,135 @@
+"""Token bucket rate limiting.
+
+Authenticated routes are limited per user and per project (from
+``request.state.user``), public routes per client IP when
+``RATE_LIMIT_IP_ENABLED`` is on. Buckets live in a
+``TokenBucketStore``; the default in-memory store is per worker, and
+``RATE_LIMIT_BACKEND`` can point at another implementation
+(``package.module:Class``) to share limits across workers.
+"""
+import abc
+import time
+import ipaddress
+import importlib
+import threading
+from collections import OrderedDict
+from fastapi import Request, HTTPException
+
+from iam import conf
+
+
+class TokenBucketStore(abc.ABC):
+    """Interface of a rate limit backend."""
+
+    @abc.abstractmethod
+    def consume(self, key, rate, burst, cost=1.0):
+        """Take ``cost`` tokens from the bucket ``key``.
+
+        :returns: ``(allowed, retry_after)``, ``retry_after`` in seconds
+        """
+        raise NotImplementedError
+
+
+class MemoryTokenBucketStore(TokenBucketStore):
+    """Buckets refilled lazily on access, kept in least recently used order.
+
+    A bucket idle for long enough to be full again carries no state, so it
+    is dropped; the number of buckets is also capped at ``max_keys``.
+    """
+
+    def __init__(self, max_keys=conf.RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at, idle_ttl]
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst, cost=1.0):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now, burst / rate]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._evict(now)
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (cost - bucket[0]) / rate
+
+    def _evict(self, now):
+        # Oldest entries first; stop at the first one that is still needed.
+        while self._buckets:
+            key, (tokens, updated_at, idle_ttl) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and now - updated_at < idle_ttl:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _load_store(backend):
+    if backend == "memory":
+        return MemoryTokenBucketStore()
+    module_name, _, class_name = backend.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+store = _load_store(conf.RATE_LIMIT_BACKEND)
+
+
+trusted_proxies = [ipaddress.ip_network(p, strict=False) for p in conf.RATE_LIMIT_TRUSTED_PROXIES]
+
+
+def _trusted(host) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxies)
+
+def client_ip(request: Request) -> str:
+    """The address of the client, as seen by the first proxy it reached.
+
+    ``X-Forwarded-For`` is only honoured from a trusted proxy, and walked
+    from the right: each trusted hop appended the address it got the
+    request from, the entries left of the first untrusted one can be
+    anything the client sent.
+    """
+    host = request.client.host if request.client else "unknown"
+    if not _trusted(host):
+        return host
+    hops = [hop.strip() for hop in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+        host = hop
+    return host
+
+def check(key, rate, burst):
+    allowed, retry_after = store.consume(key, rate, burst)
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests.",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+
+def limit_by_identity(request: Request):
+    """Router dependency for authenticated routes; runs after ``validate_token``."""
+    if not conf.RATE_LIMIT_ENABLED:
+        return
+    user = getattr(request.state, "user", None)
+    if getattr(user, "id", None):
+        check(f"user:{user.id}", conf.RATE_LIMIT_USER_RATE, conf.RATE_LIMIT_USER_BURST)
+    if getattr(user, "project_id", None):
+        check(f"project:{user.project_id}", conf.RATE_LIMIT_PROJECT_RATE, conf.RATE_LIMIT_PROJECT_BURST)
+
+def limit_by_ip(request: Request):
+    """Router dependency for public routes."""
+    if not (conf.RATE_LIMIT_ENABLED and conf.RATE_LIMIT_IP_ENABLED):
+        return
+    check(f"ip:{client_ip(request)}", conf.RATE_LIMIT_IP_RATE, conf.RATE_LIMIT_IP_BURST)
@@ -0,0 +1,376 @@
+"""Circuit breakers and bulkheads for calls to Keystone.
+
+Keystone calls are grouped into operation classes (``auth``, ``validate``,
+``read``, ``write``). Each class has its own circuit breaker, so a failing
+class fails fast without waiting on timeouts, and its own bulkhead: a
+bounded thread pool running the blocking keystoneclient/requests call off
+the event loop. A slow ``authenticate`` storm can therefore only exhaust
+the ``auth`` bulkhead and never starves token validation or reads.
+
+Idempotent classes are retried on transient errors with jittered
+exponential backoff, limited by a retry budget, and token validation can
+optionally be hedged to cut tail latency.
+"""
+import time
+import random
+import asyncio
+import logging
+import functools
+import threading
+import collections
+import concurrent.futures
+import requests
+from keystoneauth1 import exceptions as keystone_exceptions
+
+from iam import conf
+from iam import exceptions
+from iam.core import deadline
+from iam.core import profiler
+
+LOG = logging.getLogger(__name__)
+
+AUTH = "auth"
+VALIDATE = "validate"
+READ = "read"
+WRITE = "write"
+
+# Errors that say something about Keystone's health. Client errors such as
+# 401/404 are healthy answers and do not trip the breaker.
+FAILURE_EXCEPTIONS = (
+    keystone_exceptions.ConnectionError,
+    keystone_exceptions.HttpServerError,
+    keystone_exceptions.RequestTimeout,
+    requests.RequestException,
+    asyncio.TimeoutError,
+)
+
+RETRYABLE_STATUSES = (502, 503, 504)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=conf.BREAKER_FAILURE_THRESHOLD,
+                 slow_call_ms=conf.BREAKER_SLOW_CALL_MS, reset_timeout=conf.BREAKER_RESET_TIMEOUT,
+                 half_open_max_calls=conf.BREAKER_HALF_OPEN_MAX_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call_ms / 1000
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            LOG.warning("Circuit breaker %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+            self.stats["opened"] += 1
+        elif state == self.CLOSED:
+            self.failures = 0
+        self.half_open_calls = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.stats["rejected"] += 1
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    self.stats["rejected"] += 1
+                    return False
+                self.half_open_calls += 1
+            self.stats["calls"] += 1
+            return True
+
+    def retry_after(self) -> int:
+        if self.state != self.OPEN:
+            return 1
+        return max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self, duration):
+        if duration >= self.slow_call:
+            with self._lock:
+                self.stats["slow_calls"] += 1
+            return self.record_failure(counted=False)
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._transition(self.CLOSED)
+            self.failures = 0
+
+    def record_failure(self, counted=True):
+        with self._lock:
+            if counted:
+                self.stats["failures"] += 1
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._transition(self.OPEN)
+
+    def release(self):
+        """Give back a half-open probe slot that never reached Keystone."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.half_open_calls:
+                self.half_open_calls -= 1
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": self.retry_after() if self.state == self.OPEN else None,
+            **self.stats,
+        }
+
+
+class Bulkhead:
+    def __init__(self, name, max_concurrent, max_wait=conf.BULKHEAD_MAX_WAIT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix=f"keystone-{name}")
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created lazily so it binds to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def run(self, func, *args, **kwargs):
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise exceptions.ServiceUnavailableException(
+                f"Too many concurrent Keystone {self.name} operations.", retry_after=1)
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        loop = asyncio.get_event_loop()
+        try:
+            future = self.executor.submit(profiler.bind(functools.partial(func, *args, **kwargs)))
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the thread is done, not until the caller
+        # stops waiting: a call abandoned on its deadline or by a losing
+        # hedge keeps its thread busy.
+        future.add_done_callback(lambda _: self._release_from_thread(loop))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def _release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    def _release_from_thread(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # The loop is closed, and the semaphore with it.
+
+    def snapshot(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+class RetryBudget:
+    """Caps retries to a fraction of recent calls, plus a small floor.
+
+    Counts are kept in per-second buckets over a sliding ``window`` so the
+    memory used does not depend on the request rate.
+    """
+
+    def __init__(self, ratio=conf.RETRY_BUDGET_RATIO, min_per_sec=conf.RETRY_BUDGET_MIN_PER_SEC, window=10):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.window = window
+        self._buckets = collections.deque()  # [second, calls, retries]
+        self._lock = threading.Lock()
+
+    def _bucket(self):
+        now = int(time.monotonic())
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != now:
+            self._buckets.append([now, 0, 0])
+        return self._buckets[-1]
+
+    def deposit(self):
+        with self._lock:
+            self._bucket()[1] += 1
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            bucket = self._bucket()
+            calls = sum(b[1] for b in self._buckets)
+            retries = sum(b[2] for b in self._buckets)
+            if retries >= calls * self.ratio + self.min_per_sec * self.window:
+                return False
+            bucket[2] += 1
+            return True
+
+
+class LatencyWindow:
+    """Latencies of the most recent successful calls."""
+
+    def __init__(self, size=conf.HEDGE_LATENCY_WINDOW):
+        self._samples = collections.deque(maxlen=size)
+
+    def add(self, duration):
+        self._samples.append(duration)
+
+    def percentile(self, pct, default):
+        samples = sorted(self._samples)
+        if len(samples) < 10:
+            return default
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def is_retryable(e) -> bool:
+    """Transient failures worth another attempt of an idempotent call."""
+    if isinstance(e, (keystone_exceptions.ConnectionError,
+                      requests.ConnectionError,
+                      requests.Timeout)):
+        return True
+    if isinstance(e, keystone_exceptions.HttpServerError):
+        return e.http_status in RETRYABLE_STATUSES
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code in RETRYABLE_STATUSES
+    return False
+
+def backoff(attempt) -> float:
+    """Exponential backoff with full jitter, in seconds."""
+    ceiling = min(conf.RETRY_BACKOFF_MAX_MS, conf.RETRY_BACKOFF_BASE_MS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling) / 1000
+
+
+class Dependency:
+    def __init__(self, name, max_concurrent, retries=0, hedge=False):
+        self.name = name
+        self.retries = retries
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(name)
+        self.bulkhead = Bulkhead(name, max_concurrent)
+        self.retry_budget = RetryBudget()
+        self.latency = LatencyWindow()
+        self.stats = {"retries": 0, "retries_exhausted": 0, "hedges": 0, "hedge_wins": 0}
+
+    async def call(self, func, *args, **kwargs):
+        deadline.budget()
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(func, args, kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries or not is_retryable(e):
+                    raise
+                delay = backoff(attempt)
+                if delay >= deadline.remaining(conf.REQUEST_TIMEOUT) or not self.retry_budget.withdraw():
+                    self.stats["retries_exhausted"] += 1
+                    raise
+                self.stats["retries"] += 1
+                LOG.info("Retrying Keystone %s operation in %.3fs after: %s", self.name, delay, e)
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, func, args, kwargs):
+        budget = deadline.budget()
+        if not self.breaker.allow():
+            raise exceptions.ServiceUnavailableException(
+                f"Keystone {self.name} operations are temporarily unavailable.",
+                retry_after=self.breaker.retry_after())
+        start = time.monotonic()
+        run = self._hedged if self.hedge else self.bulkhead.run
+        try:
+            result = await asyncio.wait_for(run(func, *args, **kwargs), timeout=budget)
+        except asyncio.TimeoutError:
+            # The caller's budget ran out; only a slow call counts against Keystone.
+            self.breaker.record_success(time.monotonic() - start)
+            raise exceptions.DeadlineExceededException(
+                f"Request deadline exceeded waiting for Keystone {self.name} operation.")
+        except exceptions.ServiceUnavailableException:
+            self.breaker.release()
+            raise
+        except FAILURE_EXCEPTIONS:
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.record_success(time.monotonic() - start)
+            raise
+        duration = time.monotonic() - start
+        self.breaker.record_success(duration)
+        self.latency.add(duration)
+        return result
+
+    async def _hedged(self, func, *args, **kwargs):
+        """Send a second attempt once the first is slower than the recent p95
+        and return whichever answers successfully first."""
+        delay = self.latency.percentile(95, default=conf.HEDGE_MIN_DELAY_MS / 1000)
+        delay = max(delay, conf.HEDGE_MIN_DELAY_MS / 1000)
+        primary = asyncio.ensure_future(self.bulkhead.run(func, *args, **kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.retry_budget.withdraw():
+            return await primary
+
+        self.stats["hedges"] += 1
+        hedge = asyncio.ensure_future(self.bulkhead.run(func, *args, **kwargs))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            self.stats["hedge_wins"] += 1
+                        return future.result()
+            # Both attempts failed, surface the primary's error.
+            return primary.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def snapshot(self):
+        return {
+            "breaker": self.breaker.snapshot(),
+            "bulkhead": self.bulkhead.snapshot(),
+            "retries": dict(self.stats, max_retries=self.retries, hedge=self.hedge),
+        }
+
+
+# Only idempotent classes (token validation, lists and gets) are retried.
+dependencies = {
+    AUTH: Dependency(AUTH, conf.KEYSTONE_AUTH_CONCURRENCY),
+    VALIDATE: Dependency(VALIDATE, conf.KEYSTONE_VALIDATE_CONCURRENCY,
+                         retries=conf.KEYSTONE_RETRIES, hedge=conf.HEDGE_TOKEN_VALIDATION),
+    READ: Dependency(READ, conf.KEYSTONE_READ_CONCURRENCY, retries=conf.KEYSTONE_RETRIES),
+    WRITE: Dependency(WRITE, conf.KEYSTONE_WRITE_CONCURRENCY),
+}
+
+
+async def call(kind, func, *args, **kwargs):
+    """Run the blocking ``func`` through the ``kind`` breaker and bulkhead,
+    bounded by the remaining request deadline."""
+    return await dependencies[kind].call(func, *args, **kwargs)
+
+def snapshot():
+    return {name: dependency.snapshot() for name, dependency in dependencies.items()}
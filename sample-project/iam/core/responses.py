@@ -0,0 +1,94 @@
+import json
+import hashlib
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from iam import conf
+from iam.core import compression
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+CONDITIONAL_METHODS = ("GET", "HEAD")
+
+
+def _default(obj):
+    return jsonable_encoder(obj)
+
+def dumps(content) -> bytes:
+    """Encode ``content`` straight to JSON bytes, preferring orjson."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+def envelope(data=None, success=True, status_code=200, error_code=0, message=None):
+    """Build the ``ResponseModel`` envelope as a plain dict.
+
+    Data returned by keystoneclient is trusted, so it is not re-validated
+    against the generic ``ResponseModel`` on the way out.
+    """
+    return {
+        "success": success,
+        "status_code": status_code,
+        "error_code": error_code,
+        "message": message,
+        "data": data,
+    }
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with ``dumps``; used app-wide as the default."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def compute_etag(body: bytes) -> str:
+    """Strong ETag over the exact response body."""
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # If-None-Match uses the weak comparison function (RFC 9110 13.1.2).
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        candidate = compression.strip_encoding(candidate)
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+def conditional(request: Request, response: Response, etag=None, public=False):
+    """Tag ``response`` with an ETag and answer a matching ``If-None-Match``
+    with ``304 Not Modified``.
+
+    Callers that already know the representation version (e.g. from a cache)
+    can pass ``etag`` so the body does not need to be hashed. Responses that
+    are the same for every caller can be marked ``public``.
+    """
+    if public:
+        headers = {
+            "etag": etag or compute_etag(response.body),
+            "cache-control": "public, no-cache",
+        }
+    else:
+        headers = {
+            "etag": etag or compute_etag(response.body),
+            "cache-control": "private, no-cache",
+            "vary": f"{conf.AUTHENTICATION_HEADER}, {conf.IDENTITY_HEADER}",
+        }
+    if etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
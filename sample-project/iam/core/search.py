@@ -0,0 +1,322 @@
+"""In-memory search over users, groups and projects.
+
+The index is built from full listings made with the service credential
+(``KEYSTONE_SERVICE_*``), rebuilt every ``SEARCH_REFRESH_INTERVAL`` and
+patched from the change events of this worker in between; writes made
+through other workers show up with the next rebuild.
+
+Entities are matched exactly on ``id``, ``domain_id`` and ``enabled``. Each
+word of a query is matched against ``name``, ``email`` and ``description``
+as the whole field, the start of the field, the start of a word (words are
+kept sorted, so a prefix is a range found by bisection) or, from three
+characters on, anywhere (trigram postings narrow the candidates, which are
+then checked). Every way of matching is a set of entities, so scoring is
+done with set and dict operations rather than per entity; an entity scores
+the best match of each word, weighted by field, summed over the words.
+
+The index holds every entity whatever the caller's scope, so searching
+requires one of ``SEARCH_ROLES``.
+"""
+import re
+import time
+import bisect
+import asyncio
+import logging
+import operator
+import itertools
+from collections import defaultdict
+
+from iam import conf
+from iam.core import events
+from iam.core import keystone
+
+LOG = logging.getLogger(__name__)
+
+TYPES = (events.USERS, events.GROUPS, events.PROJECTS)
+# Searched fields and their weight in the score.
+TEXT_FIELDS = (("name", 3), ("email", 2), ("description", 1))
+EXACT_FIELDS = ("type", "domain_id", "enabled")
+WORD = re.compile(r"\w+")
+# Score of a word matching a whole field, its start, the start of a word, or anywhere.
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING = 8, 6, 4, 2
+ID_MATCH = 100
+# Sorted with the words, marks the first word of a field.
+FIRST = "\x01"
+# Sorts after any word with the same prefix.
+LAST = "\U0010ffff"
+
+_EMPTY = frozenset()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _words(text):
+    words = set(WORD.findall(text))
+    first = WORD.search(text)
+    if first is not None and first.start() == 0:
+        words.add(FIRST + first.group())
+    return words
+
+
+class Entry:
+    __slots__ = ("key", "doc", "texts")
+
+    def __init__(self, type, info):
+        self.key = (type, info["id"])
+        self.doc = {
+            "type": type,
+            "id": info["id"],
+            "name": info.get("name"),
+            "email": info.get("email"),
+            "description": info.get("description"),
+            "domain_id": info.get("domain_id"),
+            "enabled": info.get("enabled", True),
+        }
+        self.texts = tuple((self.doc[field] or "").lower() for field, _ in TEXT_FIELDS)
+
+
+class _Field:
+    """Postings of one text field, by entity number."""
+
+    def __init__(self):
+        self.texts = {}                   # number -> lowered text
+        self.exact = defaultdict(set)     # text -> numbers
+        self.words = []                   # sorted keys of postings
+        self.postings = defaultdict(set)  # word -> numbers
+        self.trigrams = defaultdict(set)  # trigram -> numbers
+
+    def add(self, number, text, sort=True):
+        if not text:
+            return
+        self.texts[number] = text
+        self.exact[text].add(number)
+        postings = self.postings
+        for word in _words(text):
+            if sort and word not in postings:
+                bisect.insort(self.words, word)
+            postings[word].add(number)
+        trigrams = self.trigrams
+        for i in range(len(text) - 2):
+            trigrams[text[i:i + 3]].add(number)
+
+    def remove(self, number):
+        text = self.texts.pop(number, None)
+        if text is None:
+            return
+        _discard(self.exact, text, number)
+        for word in _words(text):
+            if _discard(self.postings, word, number):
+                del self.words[bisect.bisect_left(self.words, word)]
+        for trigram in _trigrams(text):
+            _discard(self.trigrams, trigram, number)
+
+    def prefixed(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + LAST, start)
+        return set().union(*map(self.postings.__getitem__, self.words[start:end]))
+
+    def containing(self, term, within, matched):
+        """Numbers in ``within`` containing ``term``, other than those ``matched``."""
+        postings = sorted((self.trigrams.get(t, _EMPTY) for t in _trigrams(term)), key=len)
+        numbers = postings[0].intersection(*postings[1:])
+        if within is not None:
+            numbers &= within
+        numbers -= matched
+        texts = self.texts
+        # Having every trigram of the term does not mean containing it.
+        return {n for n in numbers if term in texts[n]}
+
+    def tiers(self, term, weight, within=None):
+        """``(score, numbers)`` of the ways ``term`` matches this field,
+        limited to ``within`` unless it is None."""
+        exact = self.exact.get(term, _EMPTY)
+        prefix = self.prefixed(FIRST + term)
+        word_prefix = self.prefixed(term)
+        if within is not None:
+            exact, prefix, word_prefix = exact & within, prefix & within, word_prefix & within
+        tiers = [(EXACT * weight, exact), (PREFIX * weight, prefix), (WORD_PREFIX * weight, word_prefix)]
+        if len(term) >= 3:
+            # A substring match of a word start is a word prefix match already.
+            tiers.append((SUBSTRING * weight, self.containing(term, within, word_prefix)))
+        return tiers
+
+
+def _discard(postings, key, number):
+    """Remove ``number`` from ``postings[key]``; True if that emptied it."""
+    numbers = postings[key]
+    numbers.discard(number)
+    if not numbers:
+        del postings[key]
+        return True
+    return False
+
+
+class SearchIndex:
+    def __init__(self):
+        self.numbers = {}  # (type, id) -> number
+        self.entries = {}  # number -> Entry
+        self.order = {}    # number -> name and id, to sort equal scores by
+        self.fields = [_Field() for _ in TEXT_FIELDS]
+        self._exact = {}   # (field, value) -> numbers
+        self._next = 0
+        self.built_at = None
+
+    @classmethod
+    def build(cls, listing):
+        """Index ``{type: [resource info]}``, sorting the words once at the end."""
+        index = cls()
+        for type, infos in listing.items():
+            for info in infos:
+                index.add(type, info, sort=False)
+        for field in index.fields:
+            field.words = sorted(field.postings)
+        index.built_at = time.time()
+        return index
+
+    def add(self, type, info, sort=True):
+        self.remove(type, info["id"])
+        entry = Entry(type, info)
+        number = self._next
+        self._next += 1
+        self.numbers[entry.key] = number
+        self.entries[number] = entry
+        self.order[number] = f"{entry.texts[0]}\x00{entry.doc['id']}"
+        for field, text in zip(self.fields, entry.texts):
+            field.add(number, text, sort)
+        for name in EXACT_FIELDS:
+            self._exact.setdefault((name, entry.doc[name]), set()).add(number)
+
+    def remove(self, type, id):
+        number = self.numbers.pop((type, id), None)
+        if number is None:
+            return
+        entry = self.entries.pop(number)
+        del self.order[number]
+        for field in self.fields:
+            field.remove(number)
+        for name in EXACT_FIELDS:
+            _discard(self._exact, (name, entry.doc[name]), number)
+
+    def _term_scores(self, term, within=None):
+        """Number -> best weighted score of ``term`` over the fields."""
+        tiers = []
+        for field, (_, weight) in zip(self.fields, TEXT_FIELDS):
+            tiers.extend(field.tiers(term, weight, within))
+        scores = {}
+        # Lowest first, so better matches overwrite them.
+        for score, numbers in sorted(tiers, key=lambda tier: tier[0]):
+            scores.update(dict.fromkeys(numbers, score))
+        return scores
+
+    def _filters(self, types, domain_id, enabled):
+        filters = []
+        if types:
+            filters.append(set().union(*(self._exact.get(("type", t), _EMPTY) for t in types)))
+        if domain_id is not None:
+            filters.append(self._exact.get(("domain_id", domain_id), _EMPTY))
+        if enabled is not None:
+            filters.append(self._exact.get(("enabled", enabled), _EMPTY))
+        return sorted(filters, key=len)
+
+    def search(self, query="", types=None, domain_id=None, enabled=None, limit=20, offset=0):
+        """Ranked ``(total, [doc with score])`` of entities matching every word of ``query``."""
+        query = (query or "").strip()
+        phrase = query.lower()
+        filters = self._filters(types, domain_id, enabled)
+        candidates = set(filters[0]).intersection(*filters[1:]) if filters else None
+        id_matches = {self.numbers[(t, query)] for t in TYPES if (t, query) in self.numbers}
+        if candidates is not None:
+            id_matches &= candidates
+
+        term_scores = []
+        # Longest words first: they tend to match the fewest entities, and
+        # later words are only matched against the candidates left.
+        for term in sorted(set(WORD.findall(phrase)), key=len, reverse=True):
+            scores = self._term_scores(term, candidates)
+            term_scores.append(scores)
+            candidates = set(scores)
+        if candidates is None:
+            candidates = set(self.entries)
+        candidates = list(candidates | id_matches)
+
+        # Summed with map() over the candidates; they are many, the words few.
+        totals = [0] * len(candidates)
+        for scores in term_scores:
+            totals = list(map(operator.add, totals, map(scores.get, candidates, itertools.repeat(0))))
+        scores = dict(zip(candidates, totals))
+        for field, (_, weight) in zip(self.fields, TEXT_FIELDS):
+            for n in field.exact.get(phrase, _EMPTY) & scores.keys():
+                # A field equal to the whole query scores once more on top.
+                scores[n] += EXACT * weight
+        for n in id_matches:
+            scores[n] = ID_MATCH
+
+        # Only the candidates scoring at least as much as the last one of
+        # the page need ordering by name, which is the costly part.
+        candidates.sort(key=scores.__getitem__, reverse=True)
+        end = offset + limit
+        if end < len(candidates):
+            lowest = scores[candidates[end - 1]]
+            while end < len(candidates) and scores[candidates[end]] == lowest:
+                end += 1
+        ranked = sorted(candidates[:end], key=self.order.__getitem__)
+        ranked.sort(key=scores.__getitem__, reverse=True)
+        return len(candidates), [dict(self.entries[n].doc, score=scores[n])
+                                 for n in ranked[offset:offset + limit]]
+
+    def snapshot(self):
+        return {
+            "built_at": self.built_at,
+            "entries": len(self.entries),
+            "words": sum(len(field.words) for field in self.fields),
+            "trigrams": sum(len(field.trigrams) for field in self.fields),
+        }
+
+
+index = None
+# Events seen while a rebuild lists Keystone, applied again to the new index.
+_pending = None
+
+
+@events.listen
+def _on_event(type, action, data, resource):
+    if type not in TYPES:
+        return
+    if _pending is not None:
+        _pending.append((type, action, data, resource))
+    if index is not None:
+        _apply(index, type, action, data, resource)
+
+def _apply(target, type, action, data, resource):
+    if action == events.DELETED:
+        target.remove(type, data["id"])
+    elif resource is not None:
+        target.add(type, resource.to_dict())
+
+async def refresh():
+    global index, _pending
+    _pending = []
+    try:
+        listing = await keystone.list_directory()
+        loop = asyncio.get_event_loop()
+        rebuilt = await loop.run_in_executor(None, SearchIndex.build, listing)
+        for event in _pending:
+            _apply(rebuilt, *event)
+        index = rebuilt
+    finally:
+        _pending = None
+    LOG.info("Search index rebuilt with %d entries.", len(index.entries))
+
+async def run_periodic(interval=conf.SEARCH_REFRESH_INTERVAL):
+    while True:
+        try:
+            await refresh()
+        except Exception as e:
+            LOG.warning("Unable to rebuild the search index: %s", e)
+        await asyncio.sleep(interval)
+
+def snapshot():
+    if index is None:
+        return {"built_at": None}
+    return index.snapshot()
@@ -0,0 +1,118 @@
+"""Persist ``TTLCache`` contents across worker restarts.
+
+Registered caches are written to ``CACHE_SNAPSHOT_DIR`` periodically and on
+shutdown, and loaded on startup, so new workers start with warm caches.
+
+Each cache is one file in a compact binary format::
+
+    header:  magic (8s) | version (B) | record count (I)
+    record:  expires_at (d) | key len (I) | tag len (I) | value len (I)
+             | key | tag | value          (JSON encoded)
+
+Files are memory-mapped on load and expired records are skipped without
+decoding them.
+"""
+import os
+import json
+import mmap
+import time
+import struct
+import asyncio
+import logging
+
+from iam import conf
+from iam.core.responses import dumps
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b"IAMCACHE"
+VERSION = 1
+HEADER = struct.Struct("<8sBI")
+RECORD = struct.Struct("<dIII")
+
+caches = {}
+
+
+def register(name, ttl_cache):
+    """Include ``ttl_cache`` in snapshots under ``name``."""
+    caches[name] = ttl_cache
+    return ttl_cache
+
+def enabled() -> bool:
+    return bool(conf.CACHE_SNAPSHOT_DIR)
+
+def path_for(name):
+    return os.path.join(conf.CACHE_SNAPSHOT_DIR, f"{name}.cache")
+
+def _freeze(value):
+    # JSON turns tuple keys into lists; make them hashable again.
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def dump(ttl_cache, path) -> int:
+    entries = ttl_cache.items()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # Cached entries contain tokens, keep them private to the service user.
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        for key, value, expires_at, tag in entries:
+            key, value = dumps(key), dumps(value)
+            tag = dumps(tag) if tag is not None else b""
+            f.write(RECORD.pack(expires_at, len(key), len(tag), len(value)))
+            f.write(key)
+            f.write(tag)
+            f.write(value)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+def load(ttl_cache, path) -> int:
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return 0
+    loaded = 0
+    now = time.time()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            LOG.warning("Ignoring cache snapshot %s with unknown format.", path)
+            return 0
+        offset = HEADER.size
+        for _ in range(count):
+            expires_at, key_len, tag_len, value_len = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if expires_at > now:
+                key = _freeze(json.loads(data[offset:offset + key_len]))
+                offset += key_len
+                tag = json.loads(data[offset:offset + tag_len]) if tag_len else None
+                offset += tag_len
+                value = json.loads(data[offset:offset + value_len])
+                offset += value_len
+                ttl_cache.set(key, value, expires_at, tag=tag)
+                loaded += 1
+            else:
+                offset += key_len + tag_len + value_len
+    return loaded
+
+def save_all():
+    for name, ttl_cache in caches.items():
+        try:
+            count = dump(ttl_cache, path_for(name))
+            LOG.info("Saved %d %s cache entries.", count, name)
+        except OSError as e:
+            LOG.warning("Unable to save %s cache snapshot: %s", name, e)
+
+def load_all():
+    for name, ttl_cache in caches.items():
+        try:
+            count = load(ttl_cache, path_for(name))
+            LOG.info("Loaded %d %s cache entries.", count, name)
+        except (OSError, ValueError, struct.error) as e:
+            LOG.warning("Unable to load %s cache snapshot: %s", name, e)
+
+async def run_periodic(interval=conf.CACHE_SNAPSHOT_INTERVAL):
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, save_all)
@@ -0,0 +1,34 @@
+"""Startup phase timings.
+
+``iam.main`` times its own startup phases (imports, router registration,
+middleware) and warm-up adds its phases (Keystone libraries, connections,
+OpenAPI), after which ``report`` logs one line per worker boot.
+"""
+import sys
+import time
+import logging
+import contextlib
+
+from iam import conf
+
+logger = logging.getLogger(conf.APP_NAME)
+
+timings = {}
+
+
+def record(name, started):
+    """Record a phase that began at ``started`` (``time.perf_counter()``)."""
+    timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+@contextlib.contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, started)
+
+def report():
+    total = sum(timings.values())
+    logger.info("Startup took %.1f ms (%s), %d modules loaded.", total,
+             ", ".join(f"{name} {ms} ms" for name, ms in timings.items()), len(sys.modules))
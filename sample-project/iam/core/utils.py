@@ -1,50 +1,78 @@
 import json
+import inspect
 import logging
 from fastapi import Request
 from functools import wraps
-from fastapi.responses import JSONResponse
 
 from iam import conf
 from iam import exceptions
-from iam.api.models import ResponseModel
+from iam.core import idempotency
+from iam.core import responses
+from iam.core.responses import FastJSONResponse, envelope
 
 logger = logging.getLogger(conf.APP_NAME)
 
 
+def _request_parameter(func):
+    """Position and name of the ``Request`` parameter of ``func``, if any."""
+    for position, (name, param) in enumerate(inspect.signature(func).parameters.items()):
+        if param.annotation is Request or name == "request":
+            return position, name
+    return None, None
+
 def handle_response(**dkwargs):
+    sensitive_fields = frozenset(map(str.lower, dkwargs.get("sensitive_fields") or ()))
+
     def decorator(func):
+        # Everything that only depends on ``func`` is resolved here, once.
+        request_position, request_name = _request_parameter(func)
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            try:
-                request: Request = next(
-                    (arg for arg in args if isinstance(arg, Request)), 
-                    kwargs.get("request", None)
-                )
-
-                if request:
-                    if dkwargs.get("sensitive_fields"):
-                        request.state.sensitive_fields = set(map(str.lower, dkwargs["sensitive_fields"]))
-                
-                data = await func(*args, **kwargs)
-                response = ResponseModel(data=data)
-            except Exception as e:
-                parsed_exception = exceptions.parse_exception(e)
-                log_data = {
-                    'request_id': getattr(getattr(request, 'state', None), 'request_id', None),
-                    'exception': str(e),
-                    'traceback': parsed_exception.get("trace"),
-                }
-                logger.error(json.dumps(log_data))
-                status_code = parsed_exception.get('status_code', 500)
-                response = JSONResponse(
-                    status_code=status_code,
-                    content=ResponseModel(
-                        success=False,
-                        status_code=status_code,
-                        message=parsed_exception.get('message'),
-                    ).model_dump()
-                )
-
-            return response
+            if request_name in kwargs:
+                request = kwargs[request_name]
+            elif request_position is not None and request_position < len(args):
+                request = args[request_position]
+            else:
+                request = None
+            if sensitive_fields and request is not None:
+                request.state.sensitive_fields = sensitive_fields
+
+            key = idempotency.scope_key(request) if request is not None else None
+            if key is not None:
+                arguments = {k: v for k, v in kwargs.items() if k != request_name}
+                return await idempotency.once(key, idempotency.fingerprint(arguments),
+                                              lambda: _respond(func, request, args, kwargs))
+            return await _respond(func, request, args, kwargs)
         return wrapper
     return decorator
+
+async def _respond(func, request, args, kwargs):
+    try:
+        data = await func(*args, **kwargs)
+        response = FastJSONResponse(content=envelope(data=data))
+        if request is not None and request.method in responses.CONDITIONAL_METHODS:
+            response = responses.conditional(request, response)
+    except Exception as e:
+        log = logger.isEnabledFor(logging.ERROR)
+        parsed_exception = exceptions.parse_exception(e, trace=log)
+        if log:
+            log_data = {
+                'request_id': getattr(getattr(request, 'state', None), 'request_id', None),
+                'exception': str(e),
+                'traceback': parsed_exception.get("trace"),
+            }
+            logger.error(json.dumps(log_data))
+        status_code = parsed_exception.get('status_code', 500)
+        response = FastJSONResponse(
+            status_code=status_code,
+            content=envelope(
+                success=False,
+                status_code=status_code,
+                message=parsed_exception.get('message'),
+            )
+        )
+        if parsed_exception.get('retry_after'):
+            response.headers['retry-after'] = str(parsed_exception['retry_after'])
+
+    return response
@@ -0,0 +1,60 @@
+"""Startup warm-up and readiness.
+
+A worker answers liveness checks as soon as it starts, but only reports
+ready once ``warm_up`` has run: the Keystone client libraries are imported,
+Keystone connections are opened and the OpenAPI schema is built, so the
+first routed requests do not pay for any of it.
+
+A failed phase is logged and reported but does not keep the worker out of
+rotation; it just serves its first requests cold.
+"""
+import time
+import asyncio
+import inspect
+import logging
+
+from iam import conf
+from iam.core import deadline
+from iam.core import keystone
+from iam.core import startup
+
+LOG = logging.getLogger(__name__)
+
+state = {
+    "ready": False,
+    "phases": {},
+}
+
+
+async def _phase(name, func, *args):
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+        if inspect.isawaitable(result):
+            await result
+        status = "ok"
+    except Exception as e:
+        LOG.warning("Warm-up phase %s failed: %s", name, e)
+        status = f"failed: {e}"
+    startup.record(name, start)
+    state["phases"][name] = {
+        "status": status,
+        "duration_ms": startup.timings[name],
+    }
+
+def _in_executor(func):
+    return asyncio.get_event_loop().run_in_executor(None, func)
+
+async def warm_up(app):
+    token = deadline.start(conf.WARMUP_TIMEOUT)
+    try:
+        await _phase("keystone_imports", _in_executor, keystone.preload)
+        await _phase("connections", keystone.open_connections)
+        await _phase("openapi", app.openapi)
+    finally:
+        deadline.reset(token)
+        state["ready"] = True
+    startup.report()
+
+def mark_ready():
+    state["ready"] = True
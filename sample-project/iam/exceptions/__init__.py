@@ -6,29 +6,82 @@ KNOWN_EXCEPTIONS = [
     keystoneauth1.exceptions.http.HTTPClientError,
 ]
 
+# Exception type -> (known, carries http_status), resolved once per type.
+_handling = {}
+
 def ignore_trace(cls):
     KNOWN_EXCEPTIONS.append(cls)
+    _handling.clear()
     return cls
 
-def parse_exception(e):
+def _resolve(cls):
+    handling = _handling.get(cls)
+    if handling is None:
+        known = any(klass in KNOWN_EXCEPTIONS for klass in cls.__mro__)
+        has_status = issubclass(cls, (keystoneauth1.exceptions.http.HTTPClientError,
+                                      BadRequestException,
+                                      ForbiddenException,
+                                      NotFoundException,
+                                      ServiceUnavailableException,
+                                      DeadlineExceededException))
+        handling = _handling[cls] = (known, has_status)
+    return handling
+
+def is_known(e) -> bool:
+    """Whether ``e`` is an expected error whose traceback is not worth logging."""
+    return _resolve(type(e))[0]
+
+def format_trace(e) -> str:
+    lines = traceback.format_exception(type(e), e, e.__traceback__)
+    return ' '.join([l.strip() for l in ''.join(lines).splitlines() if l.strip()])
+
+def parse_exception(e, trace=True):
+    known, has_status = _resolve(type(e))
     status_code = http_status.HTTP_500_INTERNAL_SERVER_ERROR
-    message = str(e)
-    tb = None
-
-    ignore_trace = next((et for et in KNOWN_EXCEPTIONS if isinstance(e, et)), None)
-    if ignore_trace: ...
-    else:
-        tb = ' '.join([l.strip() for l in traceback.format_exc().splitlines() if l.strip()])
-    
-    if isinstance(e, keystoneauth1.exceptions.http.HTTPClientError):
+    if has_status:
         status_code = getattr(e, 'http_status', status_code)
 
     return {
         "status_code": status_code,
-        "message": message,
-        "trace": tb,
+        "message": str(e),
+        "trace": format_trace(e) if trace and not known else None,
+        "retry_after": getattr(e, 'retry_after', None),
     }
 
 @ignore_trace
 class KeystoneAuthException(Exception):
     """Generic error class to identify and catch keystone auth errors."""
+
+
+@ignore_trace
+class BadRequestException(Exception):
+    """Raised when a request is well-formed but cannot be carried out as given."""
+    http_status = http_status.HTTP_400_BAD_REQUEST
+
+
+@ignore_trace
+class ForbiddenException(Exception):
+    """Raised when the user lacks a role this service (not Keystone) requires."""
+    http_status = http_status.HTTP_403_FORBIDDEN
+
+
+@ignore_trace
+class NotFoundException(Exception):
+    """Raised when a resource kept by this service (not Keystone) does not exist."""
+    http_status = http_status.HTTP_404_NOT_FOUND
+
+
+@ignore_trace
+class ServiceUnavailableException(Exception):
+    """Raised when a dependency is failing fast or has no capacity left."""
+    http_status = http_status.HTTP_503_SERVICE_UNAVAILABLE
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@ignore_trace
+class DeadlineExceededException(Exception):
+    """Raised when the request ran out of time before Keystone answered."""
+    http_status = http_status.HTTP_504_GATEWAY_TIMEOUT
@@ -0,0 +1,294 @@
+"""In-memory stand-in for the Keystone v3 API.
+
+Only the subset of the identity API used by ``iam.core.keystone`` is
+implemented.  Every token is accepted and mapped to a synthetic user, so a
+load generator can use as many distinct tokens as it likes without seeding.
+
+Run it from the root of project::
+
+    python -m iam.fake_keystone
+"""
+import uuid
+import zlib
+import asyncio
+import datetime
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+from iam import conf
+
+COLLECTIONS = {
+    "users": "user",
+    "groups": "group",
+    "projects": "project",
+    "roles": "role",
+    "domains": "domain",
+}
+
+app = FastAPI(title="Fake Keystone")
+
+store = {name: {} for name in COLLECTIONS}
+group_members = {}   # group_id -> set(user_id)
+assignments = set()  # (role_id, actor_type, actor_id, project_id)
+tokens = {}          # token -> user_id, for tokens issued by this instance
+
+
+def _base_url(request: Request):
+    return str(request.base_url).rstrip("/")
+
+def _link(request: Request, collection, ref_id):
+    return {"self": f"{_base_url(request)}/v3/{collection}/{ref_id}"}
+
+def _render(request: Request, collection, ref):
+    return dict(ref, links=_link(request, collection, ref["id"]))
+
+def _render_list(request: Request, collection, refs):
+    return {
+        collection: [_render(request, collection, ref) for ref in refs],
+        "links": {"self": f"{_base_url(request)}/v3/{collection}", "next": None, "previous": None},
+    }
+
+def _not_found(collection, ref_id):
+    return JSONResponse(status_code=404, content={"error": {
+        "code": 404, "title": "Not Found",
+        "message": f"Could not find {COLLECTIONS.get(collection, collection)}: {ref_id}.",
+    }})
+
+def seed(users=conf.FAKE_KEYSTONE_USERS):
+    domain = {"id": "default", "name": "Default", "enabled": True, "description": ""}
+    store["domains"][domain["id"]] = domain
+    for name in ("admin", "member", "reader", conf.OPENSTACK_OWNER_ROLE):
+        store["roles"].setdefault(name, {"id": name, "name": name, "domain_id": None})
+    for i in range(users):
+        project = {
+            "id": f"project-{i}", "name": f"project-{i}", "domain_id": "default",
+            "enabled": True, "description": "", "parent_id": "default", "is_domain": False,
+        }
+        user = {
+            "id": f"user-{i}", "name": f"user-{i}", "domain_id": "default", "enabled": True,
+            "email": f"user-{i}@example.com", "default_project_id": project["id"],
+            "password_expires_at": None, "options": {},
+        }
+        store["projects"][project["id"]] = project
+        store["users"][user["id"]] = user
+        assignments.add(("member", "user", user["id"], project["id"]))
+        assignments.add((conf.OPENSTACK_OWNER_ROLE, "user", user["id"], project["id"]))
+
+def _user_for_token(token):
+    """Map any token to a stable synthetic user."""
+    if token in tokens and tokens[token] in store["users"]:
+        return store["users"][tokens[token]]
+    users = list(store["users"].values())
+    if not users:
+        return None
+    return users[zlib.crc32((token or '').encode()) % len(users)]
+
+def _token_body(request: Request, user, project=None, methods=("token",)):
+    now = datetime.datetime.utcnow()
+    body = {
+        "methods": list(methods),
+        "audit_ids": [uuid.uuid4().hex[:22]],
+        "issued_at": now.strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+        "expires_at": (now + datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+        "user": {
+            "id": user["id"], "name": user["name"],
+            "domain": {"id": "default", "name": "Default"},
+            "password_expires_at": None,
+        },
+        "catalog": [{
+            "id": "identity", "type": "identity", "name": "keystone",
+            "endpoints": [
+                {"id": interface, "interface": interface, "region": "RegionOne",
+                 "region_id": "RegionOne", "url": f"{_base_url(request)}/v3"}
+                for interface in ("public", "internal", "admin")
+            ],
+        }],
+    }
+    if project:
+        body["project"] = {
+            "id": project["id"], "name": project["name"],
+            "domain": {"id": "default", "name": "Default"},
+        }
+        body["roles"] = [
+            {"id": role_id, "name": store["roles"][role_id]["name"]}
+            for role_id, actor_type, actor_id, project_id in assignments
+            if actor_id == user["id"] and project_id == project["id"] and role_id in store["roles"]
+        ]
+    return body
+
+@app.middleware("http")
+async def simulate_latency(request: Request, call_next):
+    if conf.FAKE_KEYSTONE_LATENCY_MS:
+        await asyncio.sleep(conf.FAKE_KEYSTONE_LATENCY_MS / 1000)
+    return await call_next(request)
+
+@app.on_event("startup")
+async def on_startup():
+    seed()
+
+@app.get("/")
+async def versions(request: Request):
+    return {"versions": {"values": [(await version(request))["version"]]}}
+
+@app.get("/v3")
+async def version(request: Request):
+    return {"version": {
+        "id": "v3.14", "status": "stable", "updated": "2020-04-07T00:00:00Z",
+        "links": [{"rel": "self", "href": f"{_base_url(request)}/v3/"}],
+        "media-types": [{"base": "application/json", "type": "application/vnd.openstack.identity-v3+json"}],
+    }}
+
+@app.post("/v3/auth/tokens")
+async def issue_token(request: Request):
+    auth = (await request.json()).get("auth", {})
+    identity = auth.get("identity", {})
+    methods = identity.get("methods", [])
+    if "password" in methods:
+        credentials = identity.get("password", {}).get("user", {})
+        user = next((u for u in store["users"].values() if credentials.get("name") in (u["name"], u["id"])), None)
+        if not user or not credentials.get("password"):
+            return JSONResponse(status_code=401, content={"error": {
+                "code": 401, "title": "Unauthorized", "message": "The request you have made requires authentication.",
+            }})
+    else:
+        user = _user_for_token(identity.get("token", {}).get("id"))
+
+    project = None
+    scope = auth.get("scope")
+    scope = scope.get("project") if isinstance(scope, dict) else None
+    if scope:
+        project = store["projects"].get(scope.get("id")) or next(
+            (p for p in store["projects"].values() if p["name"] == scope.get("name")), None)
+        if project is None:
+            return _not_found("projects", scope.get("id") or scope.get("name"))
+
+    token = uuid.uuid4().hex
+    tokens[token] = user["id"]
+    return JSONResponse(
+        status_code=201,
+        content={"token": _token_body(request, user, project, methods)},
+        headers={"X-Subject-Token": token},
+    )
+
+@app.get("/v3/auth/tokens")
+async def validate_token(request: Request):
+    token = request.headers.get("x-subject-token")
+    user = _user_for_token(token)
+    if not token or not user:
+        return _not_found("tokens", token)
+    project = store["projects"].get(user.get("default_project_id"))
+    return JSONResponse(
+        content={"token": _token_body(request, user, project)},
+        headers={"X-Subject-Token": token},
+    )
+
+@app.get("/v3/role_assignments")
+async def list_role_assignments(request: Request):
+    params = request.query_params
+    refs = []
+    for role_id, actor_type, actor_id, project_id in sorted(assignments):
+        if params.get("role.id") not in (None, role_id):
+            continue
+        if params.get("scope.project.id") not in (None, project_id):
+            continue
+        if params.get("user.id") not in (None, actor_id) or params.get("group.id") not in (None, actor_id):
+            continue
+        refs.append({
+            "role": {"id": role_id},
+            actor_type: {"id": actor_id},
+            "scope": {"project": {"id": project_id}},
+            "links": {"assignment": f"{_base_url(request)}/v3/projects/{project_id}/{actor_type}s/{actor_id}/roles/{role_id}"},
+        })
+    return {"role_assignments": refs, "links": {"self": f"{_base_url(request)}/v3/role_assignments"}}
+
+@app.get("/v3/users/{user_id}/projects")
+async def list_user_projects(request: Request, user_id: str):
+    project_ids = {project_id for _, _, actor_id, project_id in assignments if actor_id == user_id}
+    refs = [store["projects"][p] for p in sorted(project_ids) if p in store["projects"]]
+    return _render_list(request, "projects", refs)
+
+@app.get("/v3/groups/{group_id}/users")
+async def list_group_users(request: Request, group_id: str):
+    if group_id not in store["groups"]:
+        return _not_found("groups", group_id)
+    members = group_members.get(group_id, set())
+    return _render_list(request, "users", [store["users"][u] for u in sorted(members) if u in store["users"]])
+
+@app.put("/v3/groups/{group_id}/users/{user_id}", status_code=204)
+async def add_group_user(group_id: str, user_id: str):
+    group_members.setdefault(group_id, set()).add(user_id)
+    return Response(status_code=204)
+
+@app.delete("/v3/groups/{group_id}/users/{user_id}", status_code=204)
+async def remove_group_user(group_id: str, user_id: str):
+    group_members.get(group_id, set()).discard(user_id)
+    return Response(status_code=204)
+
+@app.put("/v3/projects/{project_id}/{actor_type}/{actor_id}/roles/{role_id}", status_code=204)
+async def grant_role(project_id: str, actor_type: str, actor_id: str, role_id: str):
+    assignments.add((role_id, actor_type.rstrip("s"), actor_id, project_id))
+    return Response(status_code=204)
+
+@app.delete("/v3/projects/{project_id}/{actor_type}/{actor_id}/roles/{role_id}", status_code=204)
+async def revoke_role(project_id: str, actor_type: str, actor_id: str, role_id: str):
+    assignments.discard((role_id, actor_type.rstrip("s"), actor_id, project_id))
+    return Response(status_code=204)
+
+@app.get("/v3/{collection}")
+async def list_refs(request: Request, collection: str):
+    if collection not in COLLECTIONS:
+        return _not_found(collection, "")
+    refs = store[collection].values()
+    name = request.query_params.get("name")
+    if name:
+        refs = [ref for ref in refs if ref.get("name") == name]
+    return _render_list(request, collection, refs)
+
+@app.post("/v3/{collection}", status_code=201)
+async def create_ref(request: Request, collection: str):
+    if collection not in COLLECTIONS:
+        return _not_found(collection, "")
+    ref = (await request.json()).get(COLLECTIONS[collection], {})
+    ref.pop("password", None)
+    ref["id"] = uuid.uuid4().hex
+    store[collection][ref["id"]] = ref
+    return JSONResponse(status_code=201, content={COLLECTIONS[collection]: _render(request, collection, ref)})
+
+@app.get("/v3/{collection}/{ref_id}")
+async def get_ref(request: Request, collection: str, ref_id: str):
+    ref = store.get(collection, {}).get(ref_id)
+    if ref is None:
+        return _not_found(collection, ref_id)
+    rendered = _render(request, collection, ref)
+    if collection == "projects" and "parents_as_ids" in request.query_params:
+        parents = None
+        parent = store["projects"].get(ref.get("parent_id"))
+        path = []
+        while parent is not None:
+            path.append(parent["id"])
+            parent = store["projects"].get(parent.get("parent_id"))
+        for parent_id in reversed(path):
+            parents = {parent_id: parents}
+        rendered = dict(rendered, parents=parents)
+    return {COLLECTIONS[collection]: rendered}
+
+@app.patch("/v3/{collection}/{ref_id}")
+async def update_ref(request: Request, collection: str, ref_id: str):
+    ref = store.get(collection, {}).get(ref_id)
+    if ref is None:
+        return _not_found(collection, ref_id)
+    data = (await request.json()).get(COLLECTIONS[collection], {})
+    data.pop("password", None)
+    ref.update({k: v for k, v in data.items() if v is not None})
+    return {COLLECTIONS[collection]: _render(request, collection, ref)}
+
+@app.delete("/v3/{collection}/{ref_id}", status_code=204)
+async def delete_ref(collection: str, ref_id: str):
+    if store.get(collection, {}).pop(ref_id, None) is None:
+        return _not_found(collection, ref_id)
+    return Response(status_code=204)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=conf.APP_HOST, port=conf.FAKE_KEYSTONE_PORT, access_log=False)
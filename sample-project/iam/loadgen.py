@@ -0,0 +1,284 @@
+"""Open-loop load generator for capacity planning.
+
+Drives a weighted read/write mix against a running instance at a fixed
+arrival rate per step, ramping the rate step by step, and reports latency
+percentiles, error rates and the first step at which the service saturates.
+
+Latency is measured from the *scheduled* start of each request, so time spent
+queued behind a saturated worker is counted (no coordinated omission).
+
+Run from the root of project against a running instance::
+
+    python -m iam.loadgen --url http://127.0.0.1:8081 --rates 50,100,200
+
+or fully offline, spawning the fake Keystone and one app worker::
+
+    python -m iam.loadgen --offline --rates 50,100,200,400
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import urllib.parse
+import subprocess
+import concurrent.futures
+import requests
+
+from iam import conf
+
+# (weight, kind, method, path); paths are relative to WEBROOT/v1
+READS = [
+    (30, "read", "POST", "/token-validation"),
+    (20, "read", "GET", "/users"),
+    (20, "read", "GET", "/projects"),
+    (15, "read", "GET", "/roles"),
+    (10, "read", "GET", "/groups"),
+    (5, "read", "GET", "/role-assignments"),
+]
+WRITES = [
+    (60, "write", "POST", "/groups"),
+    (40, "write", "POST", "/projects"),
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+class Workload:
+    def __init__(self, base_url, tokens, write_ratio, timeout, seed=None):
+        self.base_url = base_url.rstrip("/") + conf.WEBROOT + "/v1"
+        self.tokens = [f"loadgen-{uuid.uuid4().hex[:8]}-{i}" for i in range(tokens)]
+        self.write_ratio = write_ratio
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def next_operation(self):
+        ops = WRITES if self.random.random() < self.write_ratio else READS
+        weight, kind, method, path = self.random.choices(ops, weights=[o[0] for o in ops])[0]
+        return kind, method, path, self.random.choice(self.tokens)
+
+    def execute(self, method, path, token):
+        headers = {conf.AUTHENTICATION_HEADER: token}
+        body = None
+        if path == "/token-validation":
+            body = {"token": token}
+        elif method == "POST":
+            body = {"name": f"loadgen-{uuid.uuid4().hex[:12]}"}
+        response = self._session().request(
+            method, self.base_url + path, headers=headers, json=body, timeout=self.timeout)
+        return response.status_code
+
+
+class Step:
+    def __init__(self, rate, duration):
+        self.rate = rate
+        self.duration = duration
+        self.latencies = {"read": [], "write": []}
+        self.errors = {}
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def record(self, kind, latency, error=None):
+        with self.lock:
+            self.completed += 1
+            self.latencies[kind].append(latency)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def report(self):
+        latencies = self.latencies["read"] + self.latencies["write"]
+        failed = sum(self.errors.values())
+        to_ms = lambda v: None if v is None else round(v * 1000, 2)
+        return {
+            "offered_rps": self.rate,
+            "achieved_rps": round(self.completed / self.duration, 2),
+            "requests": self.completed,
+            "error_rate": round(failed / self.completed, 4) if self.completed else 0.0,
+            "errors": self.errors,
+            "latency_ms": {
+                name: {
+                    "p50": to_ms(percentile(values, 50)),
+                    "p90": to_ms(percentile(values, 90)),
+                    "p99": to_ms(percentile(values, 99)),
+                    "max": to_ms(max(values) if values else None),
+                }
+                for name, values in (("all", latencies), ("read", self.latencies["read"]),
+                                     ("write", self.latencies["write"]))
+            },
+        }
+
+
+def run_step(workload, executor, rate, duration):
+    """Issue Poisson arrivals at ``rate`` for ``duration`` seconds (open loop)."""
+    step = Step(rate, duration)
+
+    def fire(kind, method, path, token, scheduled):
+        error = None
+        try:
+            status_code = workload.execute(method, path, token)
+            if status_code >= 400:
+                error = str(status_code)
+        except requests.Timeout:
+            error = "timeout"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        step.record(kind, time.perf_counter() - scheduled, error)
+
+    futures = []
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled - start < duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(executor.submit(fire, *workload.next_operation(), scheduled))
+        scheduled += workload.random.expovariate(rate)
+    concurrent.futures.wait(futures)
+    # Late completions still belong to the step that issued them.
+    step.duration = max(duration, time.perf_counter() - start)
+    return step.report()
+
+
+def find_saturation(reports, slo_p99_ms, max_error_rate):
+    for report in reports:
+        p99 = report["latency_ms"]["all"]["p99"]
+        if (report["error_rate"] > max_error_rate
+                or (p99 is not None and p99 > slo_p99_ms)
+                or report["achieved_rps"] < 0.9 * report["offered_rps"]):
+            return report["offered_rps"]
+    return None
+
+
+def wait_until_healthy(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+
+def spawn_offline(app_port, keystone_port, keystone_latency_ms):
+    """Start the fake Keystone and a single app worker as subprocesses."""
+    project_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [project_root, os.environ.get("PYTHONPATH")])),
+        OPENSTACK_KEYSTONE_URL=f"http://127.0.0.1:{keystone_port}/v3",
+        FAKE_KEYSTONE_LATENCY_MS=str(keystone_latency_ms),
+        DEBUG="False",
+    )
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--no-access-log"]
+    processes = [
+        subprocess.Popen(uvicorn + ["--port", str(keystone_port), "iam.fake_keystone:app"], env=env),
+        subprocess.Popen(uvicorn + ["--port", str(app_port), "iam.main:app"], env=env),
+    ]
+    try:
+        wait_until_healthy(f"http://127.0.0.1:{keystone_port}/v3")
+        wait_until_healthy(f"http://127.0.0.1:{app_port}/health")
+    except Exception:
+        for process in processes:
+            process.terminate()
+        raise
+    return processes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m iam.loadgen", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default=f"http://127.0.0.1:{conf.APP_PORT}", help="Base URL of the instance.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Spawn the fake Keystone and one app worker locally and target them.")
+    parser.add_argument("--keystone-port", type=int, default=conf.FAKE_KEYSTONE_PORT)
+    parser.add_argument("--keystone-latency-ms", type=float, default=conf.FAKE_KEYSTONE_LATENCY_MS,
+                        help="Latency added by the fake Keystone to every call (--offline only).")
+    parser.add_argument("--rates", default="25,50,100,200,400",
+                        help="Comma separated arrival rates (req/s), one ramp step each.")
+    parser.add_argument("--step-duration", type=float, default=10.0, help="Seconds per ramp step.")
+    parser.add_argument("--tokens", type=int, default=1000, help="Number of distinct auth tokens.")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="Fraction of write operations.")
+    parser.add_argument("--concurrency", type=int, default=256, help="Maximum in-flight requests.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per request timeout in seconds.")
+    parser.add_argument("--slo-p99-ms", type=float, default=500.0, help="p99 latency SLO for saturation.")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate considered saturated.")
+    parser.add_argument("--stop-on-saturation", action="store_true", help="Stop the ramp at the first saturated step.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args(argv)
+
+
+def print_report(reports, saturation):
+    header = f"{'offered':>8} {'achieved':>9} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        latency = r["latency_ms"]["all"]
+        print(f"{r['offered_rps']:>8} {r['achieved_rps']:>9} {r['requests']:>9} {r['error_rate']:>7.2%} "
+              f"{latency['p50']!s:>9} {latency['p90']!s:>9} {latency['p99']!s:>9} {latency['max']!s:>9}")
+    print()
+    if saturation is None:
+        print("No saturation observed; increase --rates.")
+    else:
+        print(f"Saturation point: {saturation} req/s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rates = [float(r) for r in args.rates.split(",") if r.strip()]
+
+    processes = []
+    url = args.url
+    if args.offline:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        processes = spawn_offline(port, args.keystone_port, args.keystone_latency_ms)
+        url = f"http://127.0.0.1:{port}"
+
+    workload = Workload(url, args.tokens, args.write_ratio, args.timeout, seed=args.seed)
+    reports = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for rate in rates:
+                report = run_step(workload, executor, rate, args.step_duration)
+                reports.append(report)
+                if not args.json:
+                    latency = report["latency_ms"]["all"]
+                    print(f"step {rate:g} req/s: achieved {report['achieved_rps']} req/s, "
+                          f"p99 {latency['p99']} ms, errors {report['error_rate']:.2%}", file=sys.stderr)
+                if args.stop_on_saturation and find_saturation([report], args.slo_p99_ms, args.max_error_rate):
+                    break
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    saturation = find_saturation(reports, args.slo_p99_ms, args.max_error_rate)
+    if args.json:
+        print(json.dumps({"steps": reports, "saturation_rps": saturation}, indent=2))
+    else:
+        print_report(reports, saturation)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
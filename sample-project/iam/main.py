@@ -1,15 +1,31 @@
+import time
+_started = time.perf_counter()
+
+import asyncio
 import logging
 import logging.config
-import uvicorn
+import contextlib
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from starlette import status as http_status
-from fastapi.openapi.utils import get_openapi
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
 
 from iam import conf
-from iam.api import routes
-from iam.api import models
 from iam import middlewares
+from iam.core import admission
+from iam.core import events
+from iam.core import hierarchy
+from iam.core import jobs
+from iam.core import openapi
+from iam.core import profiler
+from iam.core import resilience
+from iam.core import search
+from iam.core import snapshot
+from iam.core import startup
+from iam.core import warmup
+from iam.core.responses import FastJSONResponse, envelope
+
+startup.record("imports", _started)
 
 LOGGING_CONFIG = {
     "version": 1,
@@ -54,7 +70,43 @@ LOGGING_CONFIG = {
 
 logging.config.dictConfig(LOGGING_CONFIG)
 
-app = FastAPI(swagger_ui_parameters={
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    snapshot_task = warmup_task = search_task = hierarchy_task = None
+    jobs.engine.recover()
+    profiler_task = asyncio.ensure_future(profiler.run_periodic())
+    if snapshot.enabled():
+        snapshot.load_all()
+        snapshot_task = asyncio.ensure_future(snapshot.run_periodic())
+    if conf.SEARCH_ENABLED:
+        search_task = asyncio.ensure_future(search.run_periodic())
+    if conf.HIERARCHY_ENABLED:
+        hierarchy_task = asyncio.ensure_future(hierarchy.run_periodic())
+    if conf.WARMUP_ENABLED:
+        warmup_task = asyncio.ensure_future(warmup.warm_up(app))
+    else:
+        warmup.mark_ready()
+        startup.report()
+    try:
+        yield
+    finally:
+        warmup.state["ready"] = False
+        await jobs.engine.shutdown()
+        profiler_task.cancel()
+        profiler.sampler.stop()
+        if warmup_task is not None:
+            warmup_task.cancel()
+        if search_task is not None:
+            search_task.cancel()
+        if hierarchy_task is not None:
+            hierarchy_task.cancel()
+        if snapshot_task is not None:
+            snapshot_task.cancel()
+            snapshot.save_all()
+
+# The schema and docs routes are served below from the prebuilt schema.
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse,
+              openapi_url=None, docs_url=None, redoc_url=None, swagger_ui_parameters={
     'deepLinking': True,
     'persistAuthorization': True,
     'displayOperationId': False,
@@ -68,69 +120,109 @@ app = FastAPI(swagger_ui_parameters={
     'showCommonExtensions': True,
 })
 
-app.add_middleware(middlewares.RequestIDMiddleware)
-app.add_middleware(middlewares.LoggingMiddleware)
+with startup.phase("middleware"):
+    app.add_middleware(middlewares.ProfilerMiddleware)
+    app.add_middleware(middlewares.RequestIDMiddleware)
+    app.add_middleware(middlewares.LoggingMiddleware)
+    app.add_middleware(middlewares.CompressionMiddleware)
+    app.add_middleware(middlewares.DeadlineMiddleware)
 
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content=models.ResponseModel(
+        content=envelope(
             success=False,
             message=str(exc),
-        ).model_dump()
+        )
     )
 
 # v1
-app.include_router(routes.v1_pr)
-app.include_router(routes.v1_r)
-
-def custom_openapi():
-    if app.openapi_schema:
-        return app.openapi_schema
-    openapi_schema = get_openapi(
-        title=conf.APP_NAME,
-        version="1.0.0",
-        description="",
-        routes=app.routes,
-    )
-    openapi_schema["components"] = openapi_schema.get("components") or {}
-    openapi_schema["components"]["securitySchemes"] = {
-        "AuthToken": {
-            "type": "apiKey",
-            "in": "header",
-            "name": conf.AUTHENTICATION_HEADER
-        },
-        "Identity": {
-            "type": "apiKey",
-            "in": "header",
-            "name": conf.IDENTITY_HEADER
-        }
-    }
-    for path in openapi_schema["paths"].values():
-        for method in path.values():
-            method["security"] = [{"AuthToken": []}, {"Identity": []}]
-    app.openapi_schema = openapi_schema
-    return app.openapi_schema
+with startup.phase("routers"):
+    # Importing the API package registers every route on the routers.
+    from iam.api import routes
+    app.include_router(routes.v1_pr)
+    app.include_router(routes.v1_r)
+    app.include_router(routes.v1_sr)
+
+app.openapi = lambda: openapi.document(app).schema
+
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json(request: Request):
+    return openapi.response(app, request)
 
-app.openapi = custom_openapi
+@app.get("/docs", include_in_schema=False)
+async def swagger_ui_html(request: Request):
+    openapi_url = request.scope.get("root_path", "") + "/openapi.json"
+    return get_swagger_ui_html(openapi_url=openapi_url, title=f"{conf.APP_NAME} - Swagger UI",
+                               swagger_ui_parameters=app.swagger_ui_parameters)
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc_html(request: Request):
+    openapi_url = request.scope.get("root_path", "") + "/openapi.json"
+    return get_redoc_html(openapi_url=openapi_url, title=f"{conf.APP_NAME} - ReDoc")
 
 @app.get("/health")
 async def health_check():
     return JSONResponse(status_code=200, content={"status": "ok"})
 
+@app.get("/health/live")
+async def liveness_check():
+    return JSONResponse(status_code=200, content={"status": "ok"})
+
+@app.get("/health/ready")
+async def readiness_check():
+    status_code = 200 if warmup.state["ready"] else 503
+    return JSONResponse(status_code=status_code, content={
+        "status": "ready" if warmup.state["ready"] else "warming_up",
+        "phases": warmup.state["phases"],
+    })
+
+@app.get("/health/keystone")
+async def keystone_health_check():
+    return JSONResponse(status_code=200, content=resilience.snapshot())
+
+@app.get("/health/events")
+async def events_health_check():
+    return JSONResponse(status_code=200, content=events.log.snapshot())
+
+@app.get("/health/search")
+async def search_health_check():
+    return JSONResponse(status_code=200, content=search.snapshot())
+
+@app.get("/health/hierarchy")
+async def hierarchy_health_check():
+    return JSONResponse(status_code=200, content=hierarchy.snapshot())
+
+@app.get("/health/jobs")
+async def jobs_health_check():
+    return JSONResponse(status_code=200, content=jobs.engine.snapshot())
+
+@app.get("/health/profiler")
+async def profiler_health_check():
+    return JSONResponse(status_code=200, content=profiler.snapshot())
+
+@app.get("/health/admission")
+async def admission_health_check():
+    return JSONResponse(status_code=200, content=admission.controller.snapshot())
+
 if __name__ == '__main__':
-    # Run from the root of project 
+    # Run from the root of project. Without DEBUG, this is the production
+    # launcher (``python -m iam.server``).
     import os
+    import sys
+    import uvicorn
     def get_import_string(app_variable_name: str = "app") -> str:
         current_path = os.path.abspath(__file__)
         project_root_path = os.path.join(current_path, '..', '..')
         rel_path = os.path.relpath(current_path, project_root_path)
         module_path = rel_path.replace(".py", "").replace(os.sep, ".")
         return f"{module_path}:{app_variable_name}"
+    if not conf.DEBUG:
+        # In a fresh interpreter, so that the application is not imported twice.
+        os.execv(sys.executable, [sys.executable, "-m", "iam.server"])
     uvicorn.run(
         app=get_import_string("app"),
         host=conf.APP_HOST, port=conf.APP_PORT,
-        reload=conf.DEBUG, workers=conf.WORKERS,
-        access_log=False,
+        reload=True, access_log=False,
     )
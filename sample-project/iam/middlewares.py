@@ -4,9 +4,13 @@ import uuid
 import logging
 from fastapi import Request
 from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.base import BaseHTTPMiddleware
 
 from iam import conf
+from iam.core import compression
+from iam.core import deadline
+from iam.core import profiler
 
 logger = logging.getLogger(conf.APP_NAME)
 
@@ -84,3 +88,149 @@ class RequestIDMiddleware(BaseHTTPMiddleware):
         response = await call_next(request)
         response.headers["x-request-id"] = request_id
         return response
+
+
+class CompressionMiddleware:
+    """Negotiated gzip/br/zstd compression of response bodies.
+
+    Written as a plain ASGI middleware so bodies of unknown length are
+    compressed chunk by chunk instead of being buffered. Bodies with a known
+    length below ``minimum_size`` are sent as is; larger ones carrying an
+    ETag are compressed once and then served from
+    ``compression.compressed_cache``. Responses to HEAD requests, which have
+    no body to compress, are passed through unmodified.
+    """
+
+    def __init__(self, app, minimum_size=conf.COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+
+        encoder = None
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                encoder = compression.negotiate(value.decode("latin-1"))
+                break
+        if encoder is None:
+            return await self.app(scope, receive, send)
+
+        state = {"start": None, "headers": None, "mode": None, "compressor": None, "chunks": []}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=list(message.get("headers", [])))
+                content_length = headers.get("content-length")
+                if message["status"] == 304 and "etag" in headers:
+                    headers["etag"] = compression.encoded_etag(headers["etag"], encoder.name)
+                    headers.add_vary_header("Accept-Encoding")
+                    message["headers"] = headers.raw
+                    state["mode"] = "passthrough"
+                elif (message["status"] == 204
+                        or not compression.is_compressible(headers.raw)
+                        or (content_length is not None and int(content_length) < self.minimum_size)):
+                    state["mode"] = "passthrough"
+                else:
+                    headers["content-encoding"] = encoder.name
+                    headers.add_vary_header("Accept-Encoding")
+                    state["mode"] = "buffer" if content_length is not None else "stream"
+                    state["headers"] = headers
+                    state["start"] = message
+                    return
+                return await send(message)
+
+            if message["type"] != "http.response.body" or state["mode"] == "passthrough":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = state["headers"]
+
+            if state["mode"] == "buffer":
+                # The whole body is already materialized upstream, so collect
+                # it and compress it in one go (or reuse a cached result).
+                state["chunks"].append(body)
+                if more_body:
+                    return
+                body = b"".join(state["chunks"])
+                etag = headers.get("etag")
+                key = (etag, encoder.name)
+                compressed = compression.compressed_cache.get(key) if etag else None
+                if compressed is None:
+                    compressed = encoder.compress(body)
+                    if etag:
+                        compression.compressed_cache.set(key, compressed)
+                if etag:
+                    headers["etag"] = compression.encoded_etag(etag, encoder.name)
+                headers["content-length"] = str(len(compressed))
+                state["start"]["headers"] = headers.raw
+                await send(state["start"])
+                return await send({"type": "http.response.body", "body": compressed})
+
+            if state["compressor"] is None:
+                if "etag" in headers:
+                    headers["etag"] = compression.encoded_etag(headers["etag"], encoder.name)
+                state["start"]["headers"] = headers.raw
+                state["compressor"] = encoder.compressobj()
+                await send(state["start"])
+
+            chunk = state["compressor"].compress(body)
+            if not more_body:
+                chunk += state["compressor"].flush()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class DeadlineMiddleware:
+    """Start the request deadline from ``conf.DEADLINE_HEADER`` (seconds)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = conf.DEADLINE_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        value = next((v for k, v in scope["headers"] if k == self.header), None)
+        token = deadline.start(deadline.parse_timeout(value))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            deadline.reset(token)
+
+
+class ProfilerMiddleware:
+    """Track requests for the profiler while it is on (see ``iam.core.profiler``).
+
+    Added innermost, so it runs in the task that runs the route and knows
+    the request id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.active():
+            return await self.app(scope, receive, send)
+        profile = profiler.begin(scope)
+        if profile is None:
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+
+        async def send_tracked(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                content_type = dict(message.get("headers", ())).get(b"content-type", b"")
+                if content_type.startswith(b"text/event-stream"):
+                    # Streams last as long as their client does.
+                    profiler.discard(profile)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            profiler.end(profile, status["code"])
@@ -0,0 +1,305 @@
+"""Production launcher.
+
+Run from the root of project::
+
+    python -m iam.server
+
+Unless ``SERVER_PRELOAD`` is off, the master process imports the application
+and what every worker would load anyway (Keystone client libraries, OpenAPI
+schema) before it binds the listening socket and forks ``WORKERS`` uvicorn workers.
+What was loaded before the fork stays shared copy-on-write between the
+workers; the garbage collector is frozen first so that collections in the
+workers do not write to those pages.
+
+``WORKERS=0`` runs one worker per CPU available to the process: its CPU
+affinity, capped by the cgroup CPU quota of a container or service. Jobs,
+idempotency keys, rate limits, admission, the caches, the event feed, the
+search index and the project tree are kept in each worker unless their
+backend says otherwise, so more than one worker is only consistent with
+shared backends; a warning lists what is not. uvloop
+and httptools are used when installed (the ``speedups`` extra), falling back
+to asyncio and h11.
+
+The master restarts workers that exit: with ``SERVER_MAX_REQUESTS`` set, each
+worker exits after that many requests plus a random part of
+``SERVER_MAX_REQUESTS_JITTER``, so that workers do not all restart at once.
+On SIGTERM or SIGINT the workers get ``SERVER_GRACEFUL_TIMEOUT`` to finish
+their requests; a second signal stops them at once.
+"""
+import gc
+import os
+import sys
+import math
+import time
+import random
+import signal
+import socket
+import logging
+import importlib
+
+import uvicorn
+from uvicorn.config import STARTUP_FAILURE
+
+from iam import conf
+
+LOG = logging.getLogger(conf.APP_NAME)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+# Time given to workers past their graceful shutdown before they are killed.
+KILL_DELAY = 5
+# Workers dying sooner than this after their start are restarted with a delay.
+MIN_LIFETIME = 1
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+def _cgroup_v2_quota():
+    try:
+        path = next(line[3:] for line in _read("/proc/self/cgroup").splitlines() if line.startswith("0::"))
+    except (OSError, StopIteration):
+        return None
+    quotas = []
+    # The quota of any ancestor applies too. In a container the cgroup is
+    # usually the root of the mounted hierarchy, which this ends at.
+    while True:
+        try:
+            quota, period = _read(os.path.join(CGROUP_ROOT, path.lstrip("/"), "cpu.max")).split()
+            if quota != "max":
+                quotas.append(int(quota) / int(period))
+        except (OSError, ValueError):
+            pass
+        if path in ("", "/"):
+            return min(quotas, default=None)
+        path = os.path.dirname(path)
+
+def _cgroup_v1_quota():
+    try:
+        quota = int(_read(os.path.join(CGROUP_ROOT, "cpu", "cpu.cfs_quota_us")))
+        period = int(_read(os.path.join(CGROUP_ROOT, "cpu", "cpu.cfs_period_us")))
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+def available_cpus():
+    """CPUs this process may use: its affinity, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_v2_quota() or _cgroup_v1_quota()
+    return min(cpus, quota) if quota is not None else cpus
+
+def worker_count():
+    if conf.WORKERS > 0:
+        return conf.WORKERS
+    # A fractional quota still gets a worker of its own.
+    return max(1, math.ceil(available_cpus()))
+
+def per_process_state():
+    """Features whose state is not shared between the workers."""
+    features = []
+    if conf.JOB_BACKEND == "memory":
+        features.append("jobs (JOB_BACKEND)")
+    if conf.IDEMPOTENCY_ENABLED:
+        features.append("idempotency keys")
+    if conf.RATE_LIMIT_ENABLED and conf.RATE_LIMIT_BACKEND == "memory":
+        features.append("rate limits (RATE_LIMIT_BACKEND)")
+    if conf.PROFILER_BACKEND == "memory":
+        features.append("profiler (PROFILER_BACKEND)")
+    if conf.LOGIN_CACHE_ENABLED:
+        features.append("login cache")
+    if conf.TOKEN_CACHE_TTL > 0:
+        features.append("token cache")
+    features.append("admission limits")
+    features.append("event feed (/events)")
+    if conf.SEARCH_ENABLED:
+        # Rebuilt periodically, but only patched by the changes of its worker.
+        features.append("search index")
+    if conf.HIERARCHY_ENABLED:
+        features.append("project tree")
+    return features
+
+def _installed(module) -> bool:
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        return False
+    return True
+
+def _choose(setting, fast, fallback):
+    """``fast`` if ``setting`` is ``auto`` or ``fast`` and it is installed, else ``fallback``."""
+    if setting not in ("auto", fast):
+        return setting
+    if _installed(fast):
+        return fast
+    if setting == fast:
+        LOG.warning("%s is not installed, using %s.", fast, fallback)
+    return fallback
+
+
+def preload():
+    """The application, with what the workers can share loaded before forking."""
+    from iam.main import app
+    from iam.core import keystone
+    from iam.core import openapi
+    keystone.preload()
+    openapi.document(app)
+    return app
+
+def bind():
+    family = socket.AF_INET6 if ":" in conf.APP_HOST else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((conf.APP_HOST, conf.APP_PORT))
+    # Listening before the workers start queues the first connections
+    # instead of refusing them.
+    sock.listen(conf.SERVER_BACKLOG)
+    try:
+        somaxconn = int(_read("/proc/sys/net/core/somaxconn"))
+    except (OSError, ValueError):
+        somaxconn = None
+    if somaxconn is not None and somaxconn < conf.SERVER_BACKLOG:
+        LOG.warning("SERVER_BACKLOG %d is capped to %d by net.core.somaxconn.", conf.SERVER_BACKLOG, somaxconn)
+    return sock
+
+def serve(app, sock, loop, http, max_requests=None):
+    """Run one uvicorn worker on ``sock``."""
+    config = uvicorn.Config(
+        app, loop=loop, http=http, log_config=None, access_log=False,
+        backlog=conf.SERVER_BACKLOG,
+        timeout_keep_alive=conf.SERVER_KEEPALIVE_TIMEOUT,
+        limit_concurrency=conf.SERVER_LIMIT_CONCURRENCY or None,
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=conf.SERVER_GRACEFUL_TIMEOUT or None,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class Master:
+    def __init__(self, app, sock, workers, loop, http):
+        self.app = app
+        self.sock = sock
+        self.count = workers
+        self.loop = loop
+        self.http = http
+        self.workers = {}  # pid -> start time
+        self.stopping = False
+        self.exit_code = 0
+
+    def spawn(self):
+        max_requests = None
+        if conf.SERVER_MAX_REQUESTS > 0:
+            max_requests = conf.SERVER_MAX_REQUESTS + random.randint(0, max(conf.SERVER_MAX_REQUESTS_JITTER, 0))
+        # Blocked so that a stop cannot come between the fork and the
+        # worker being known.
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(max_requests)
+        self.workers[pid] = time.monotonic()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    def _run_worker(self, max_requests):
+        code = 0
+        try:
+            for signum in STOP_SIGNALS | {signal.SIGALRM}:
+                signal.signal(signum, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+            gc.enable()
+            app = self.app if self.app is not None else importlib.import_module("iam.main").app
+            serve(app, self.sock, self.loop, self.http, max_requests)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            LOG.exception("Worker %d failed.", os.getpid())
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def kill(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, signum=signal.SIGTERM, frame=None):
+        if self.stopping:
+            self.kill(signal.SIGKILL)
+            return
+        self.stopping = True
+        LOG.info("Stopping %d workers.", len(self.workers))
+        self.kill(signal.SIGTERM)
+        signal.signal(signal.SIGALRM, lambda *_: self.kill(signal.SIGKILL))
+        signal.alarm(conf.SERVER_GRACEFUL_TIMEOUT + KILL_DELAY)
+
+    def run(self):
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, self.stop)
+        for _ in range(self.count):
+            self.spawn()
+        LOG.info("Serving on %s:%d with %d workers (%s, %s).",
+                 conf.APP_HOST, conf.APP_PORT, self.count, self.loop, self.http)
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            code = _exit_code(status)
+            if code == STARTUP_FAILURE:
+                LOG.error("Worker %d failed to start, stopping.", pid)
+                self.exit_code = STARTUP_FAILURE
+                self.stop()
+                continue
+            if code == 0:
+                LOG.info("Worker %d exited, restarting it.", pid)
+            else:
+                LOG.warning("Worker %d exited with %d, restarting it.", pid, code)
+            if time.monotonic() - started < MIN_LIFETIME:
+                time.sleep(MIN_LIFETIME)
+            if not self.stopping:
+                self.spawn()
+        signal.alarm(0)
+        return self.exit_code
+
+
+def main():
+    # Allocations of the preload should not leave collected holes in the
+    # pages the workers share; collection resumes in each worker.
+    gc.disable()
+    # Imported before forking even without preload, so the workers share
+    # one boot id and only fail the jobs of the ones that died.
+    importlib.import_module("iam.core.jobs")
+    app = preload() if conf.SERVER_PRELOAD else None
+    loop = _choose(conf.SERVER_LOOP, "uvloop", "asyncio")
+    http = _choose(conf.SERVER_HTTP, "httptools", "h11")
+    sock = bind()
+    if not hasattr(os, "fork"):
+        gc.enable()
+        serve(app or importlib.import_module("iam.main").app, sock, loop, http)
+        return 0
+    gc.freeze()
+    workers = worker_count()
+    if workers > 1:
+        LOG.warning("Running %d workers, each with its own %s.", workers, ", ".join(per_process_state()))
+    try:
+        return Master(app, sock, workers, loop, http).run()
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+import pytest
+
+from iam.core import compression
+
+zstandard = pytest.importorskip("zstandard")
+
+
+def test_interleaved_zstd_streams():
+    encoder = compression.ZstdEncoder()
+    chunks = {"a": [b"a" * 1000, b"b" * 2000, b"c" * 3000], "b": [b"x" * 500, b"y" * 7000, b"z" * 10]}
+    streams = {name: encoder.compressobj() for name in chunks}
+    encoded = {name: b"" for name in chunks}
+    for i in range(3):
+        for name, stream in streams.items():
+            encoded[name] += stream.compress(chunks[name][i])
+        # A one-shot compression in between must not disturb open streams.
+        encoder.compress(b"interleaved")
+    decompressor = zstandard.ZstdDecompressor()
+    for name, stream in streams.items():
+        encoded[name] += stream.flush()
+        assert decompressor.decompressobj().decompress(encoded[name]) == b"".join(chunks[name])
@@ -0,0 +1,15 @@
+import json
+import base64
+
+from fastapi.testclient import TestClient
+
+from iam import conf
+from iam.main import app
+
+
+def test_search_refuses_identity_header():
+    identity = {"user": {"id": "attacker"}, "roles": [{"name": role} for role in conf.SEARCH_ROLES],
+                "token": "bogus"}
+    headers = {conf.IDENTITY_HEADER: base64.b64encode(json.dumps(identity).encode()).decode()}
+    response = TestClient(app).get(f"{conf.WEBROOT}/v1/search", params={"q": "admin"}, headers=headers)
+    assert response.status_code == 403
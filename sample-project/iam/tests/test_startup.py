@@ -0,0 +1,6 @@
+from iam.benchmarks import startup
+
+
+def test_import_within_budget():
+    median_ms, modules, eager = startup.measure(runs=3)
+    assert startup.check(median_ms, modules, eager) == []